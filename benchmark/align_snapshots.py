@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+# It compares the incremental AgnosticQuery._align_snapshots with a full realignment at every call,
+# which is how the snapshots were aligned before, on synthetic entities with many snapshots.
+# The entities are merged a few at a time, calling the alignment after each group,
+# as AgnosticQuery._explicit_solvable_variables does while solving the variables of a query.
+# After each call, the triples of every snapshot are read, as the query does: the incremental alignment
+# only builds views, which are evaluated when they are read, so both alignments are timed on the same work.
+# The time spent aligning and the time spent reading are also reported separately,
+# since the views move part of the cost from the former to the latter.
+#
+#   python -m benchmark.align_snapshots --entities 200 --snapshots 50 --calls 20
+
+from typing import Dict, Tuple
+
+import argparse, random, time
+from copy import deepcopy
+from datetime import datetime, timedelta
+from rdflib import ConjunctiveGraph, URIRef, Literal
+
+from time_agnostic_browser.agnostic_query import AgnosticQuery
+from time_agnostic_browser.support import convert_to_timestamp
+from time_agnostic_browser.temporal_store import TemporalIndex
+
+
+GRAPH = URIRef("https://github.com/arcangelo7/time_agnostic/br/")
+
+
+def get_entities_graphs(entities:int, snapshots:int, triples:int, seed:int) -> Dict[URIRef, Dict[str, ConjunctiveGraph]]:
+    rnd = random.Random(seed)
+    start = datetime(2021, 1, 1)
+    times = [(start + timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%S") for i in range(snapshots * 4)]
+    entities_graphs = dict()
+    for i in range(entities):
+        entity = URIRef(f"https://github.com/arcangelo7/time_agnostic/br/{i}")
+        entities_graphs[entity] = dict()
+        for snapshot in sorted(rnd.sample(times, snapshots)):
+            cg = ConjunctiveGraph()
+            for j in range(triples):
+                cg.add((entity, URIRef(f"http://purl.org/spar/cito/cites{j}"), Literal(rnd.randint(0, 3)), GRAPH))
+            entities_graphs[entity][snapshot] = cg
+    return entities_graphs
+
+def full_alignment(agnostic_query:AgnosticQuery) -> None:
+    # The previous algorithm: every call merges all the entities again and rescans the whole timeline
+    for _, snapshots in agnostic_query.relevant_entities_graphs.items():
+        for snapshot, graph in snapshots.items():
+            if snapshot in agnostic_query.relevant_graphs:
+                for quad in graph.quads():
+                    agnostic_query.relevant_graphs[snapshot].add(quad)
+            else:
+                agnostic_query.relevant_graphs[snapshot] = deepcopy(graph)
+    ordered_data = sorted(agnostic_query.relevant_graphs.items(), key=lambda x: convert_to_timestamp(x[0]))
+    for index, (se, cg) in enumerate(ordered_data):
+        if index > 0:
+            previous_se = ordered_data[index-1][0]
+            for subject in agnostic_query.relevant_graphs[previous_se].subjects():
+                if (subject, None, None, None) not in cg:
+                    if subject in agnostic_query.relevant_entities_graphs:
+                        if se not in agnostic_query.relevant_entities_graphs[subject]:
+                            for quad in agnostic_query.relevant_graphs[previous_se].quads((subject, None, None, None)):
+                                agnostic_query.relevant_graphs[se].add(quad)
+
+def get_empty_agnostic_query() -> AgnosticQuery:
+    # The query is not processed: only the attributes used by the alignment are set
+    agnostic_query = AgnosticQuery.__new__(AgnosticQuery)
+    agnostic_query.relevant_entities_graphs = dict()
+    agnostic_query.relevant_graphs = dict()
+    agnostic_query.temporal_index = TemporalIndex()
+    agnostic_query._aligned_entities = set()
+    return agnostic_query
+
+def run(entities_graphs:Dict[URIRef, Dict[str, ConjunctiveGraph]], calls:int, align) -> Tuple[Dict[str, set], float, float]:
+    agnostic_query = get_empty_agnostic_query()
+    entities = list(entities_graphs)
+    group_size = max(1, -(-len(entities) // calls))
+    align_time = 0.0
+    read_time = 0.0
+    for i in range(0, len(entities), group_size):
+        for entity in entities[i:i+group_size]:
+            agnostic_query.relevant_entities_graphs[entity] = entities_graphs[entity]
+        start = time.perf_counter()
+        align(agnostic_query)
+        align_time += time.perf_counter() - start
+        start = time.perf_counter()
+        triples = to_triples(agnostic_query)
+        read_time += time.perf_counter() - start
+    return triples, align_time, read_time
+
+def to_triples(agnostic_query:AgnosticQuery) -> Dict[str, set]:
+    return {snapshot: set(cg.triples((None, None, None))) for snapshot, cg in agnostic_query.relevant_graphs.items()}
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark of the alignment of the snapshots in AgnosticQuery.")
+    arg_parser.add_argument("--entities", type=int, default=200, help="The number of entities.")
+    arg_parser.add_argument("--snapshots", type=int, default=50, help="The number of snapshots of each entity.")
+    arg_parser.add_argument("--triples", type=int, default=3, help="The number of triples of each entity at each snapshot.")
+    arg_parser.add_argument("--calls", type=int, default=20, help="How many times the alignment is called, each time after merging a new group of entities.")
+    arg_parser.add_argument("--seed", type=int, default=0, help="The seed of the random generator.")
+    args = arg_parser.parse_args()
+    entities_graphs = get_entities_graphs(args.entities, args.snapshots, args.triples, args.seed)
+    print(f"[Benchmark:INFO] {args.entities} entities, {args.snapshots} snapshots each, alignment called {args.calls} times.")
+    full, full_align_time, full_read_time = run(entities_graphs, args.calls, full_alignment)
+    incremental, incremental_align_time, incremental_read_time = run(entities_graphs, args.calls, AgnosticQuery._align_snapshots)
+    if full != incremental:
+        raise ValueError("The incremental alignment differs from the full one.")
+    full_time = full_align_time + full_read_time
+    incremental_time = incremental_align_time + incremental_read_time
+    print(f"[Benchmark:INFO] Full realignment: {full_time:.2f} s ({full_align_time:.2f} s aligning, {full_read_time:.2f} s reading)")
+    print(f"[Benchmark:INFO] Incremental alignment: {incremental_time:.2f} s ({incremental_align_time:.2f} s aligning, {incremental_read_time:.2f} s reading)")
+    print(f"[Benchmark:INFO] Speed-up: {full_time / incremental_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
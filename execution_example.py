@@ -34,7 +34,7 @@ query = """
         FILTER (?literal_1 != ?literal_2)
     }     
 """
-agnostic_query = BlazegraphQuery(query, entity_types={"http://purl.org/spar/fabio/JournalArticle"}, config_path="config.json")
+agnostic_query = BlazegraphQuery(query, entity_types={"http://purl.org/spar/fabio/JournalArticle"}, config="config.json")
 # output = agnostic_query.run_agnostic_query()
 # pprint(output)
 
@@ -1,15 +1,16 @@
-from typing import Dict, List, Tuple
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-from rdflib.plugins.sparql.processor import prepareQuery
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, flash, stream_with_context, make_response
 from collections import OrderedDict
-from dateutil import parser
+from concurrent.futures import ThreadPoolExecutor
 from SPARQLWrapper import SPARQLWrapper, JSON
-import urllib
+import urllib, json, hashlib, threading, time, uuid
 
-from time_agnostic_browser.agnostic_entity import AgnosticEntity
-from time_agnostic_browser.agnostic_query import AgnosticQuery, BlazegraphQuery, CONFIG_PATH
-from time_agnostic_browser.support import FileManager, _to_nt_sorted_list, _to_dict_of_nt_sorted_lists
+from time_agnostic_browser.agnostic_entity import AgnosticEntity, _query_latest_snapshots
+from time_agnostic_browser.agnostic_query import AgnosticQuery, BlazegraphQuery, EVALUATION_STAGE
+from time_agnostic_browser.config import Config, CONFIG_PATH as SOURCES_CONFIG_PATH
+from time_agnostic_browser.support import FileManager, convert_to_datetime, convert_to_timestamp, _to_nt_sorted_list, _to_dict_of_nt_sorted_lists
 from time_agnostic_browser.sparql import Sparql
+from time_agnostic_browser.prepared_query import prepare_query
 
 from pprint import pprint
 
@@ -20,9 +21,169 @@ app.secret_key = b'\x94R\x06?\xa4!+\xaa\xae\xb2\xf3Z\xb4\xb7\xab\xf8'
 app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
 config = FileManager(CONFIG_PATH).import_json()
 rules:Dict[str, Dict] = config["rules_on_properties_order"]
+# The pages depend on the rules too: a change of the rules changes the ETags
+RULES_DIGEST = hashlib.sha1(json.dumps(rules, sort_keys=True).encode("utf-8")).hexdigest()
+MAX_ENTRIES = 256
+TTL = 600
+WORKERS = 2
+JOB_TTL = 3600
+ROWS = "rows"
+COLUMNAR = "columnar"
+RESULT_FORMATS = (ROWS, COLUMNAR)
+
+
+class EntityCache:
+    """
+    A cache of the histories and of the provenance metadata shown in the entity pages, shared by all the requests.
+    Each entity is cached together with its latest snapshot, which is checked at every request: 
+    a cached page is valid as long as the latest snapshot of the entity is still the same.
+    Pages older than ttl seconds are discarded anyway, and the least recently used ones are evicted 
+    when there are more than max_entries.
+
+    :param max_entries: The maximum number of entities in the cache. The default is 256.
+    :type max_entries: int.
+    :param ttl: The number of seconds after which a page is discarded. The default is 600.
+    :type ttl: float.
+    """
+    def __init__(self, max_entries:int=MAX_ENTRIES, ttl:float=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries:OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, res:str, latest_snapshot:Tuple[str, str]) -> Optional[Tuple[dict, dict]]:
+        with self._lock:
+            entry = self._entries.get(res)
+            if entry is None:
+                return None
+            created, snapshot, page = entry
+            if snapshot != latest_snapshot or time.monotonic() - created > self.ttl:
+                del self._entries[res]
+                return None
+            self._entries.move_to_end(res)
+            return page
+
+    def put(self, res:str, latest_snapshot:Tuple[str, str], page:Tuple[dict, dict]) -> None:
+        with self._lock:
+            self._entries[res] = (time.monotonic(), latest_snapshot, page)
+            self._entries.move_to_end(res)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+entity_cache = EntityCache(**config.get("entity_cache", dict()))
+
+
+class QueryJob:
+    """
+    A time agnostic query executed in the background. 
+    Its status is "queued", "running", "done" or "failed", and its progress is the one reported by the AgnosticQuery:
+    the description of the current stage, the number of items processed and the total number of items of the stage.
+    The results are collected as they are produced, so that they can be read before the query is over.
+
+    :param job_id: The identifier of the job.
+    :type job_id: str.
+    :param query: The SPARQL query.
+    :type query: str.
+    :param max_results: The maximum number of results, or None to get all of them.
+    :type max_results: int.
+    """
+    def __init__(self, job_id:str, query:str, max_results:int=None):
+        self.id = job_id
+        self.query = query
+        self.max_results = max_results
+        self.status = "queued"
+        self.progress = {"stage": None, "done": 0, "total": 0}
+        self.variables:List[str] = list()
+        self.snapshots:List[str] = list()
+        # The results, each with the snapshot it belongs to, and the number of snapshots whose results are complete
+        self.results:List[Tuple[str, Tuple]] = list()
+        self.evaluated_snapshots = 0
+        self.error:Optional[str] = None
+        self.finished:Optional[float] = None
+
+    def set_progress(self, stage:str, done:int, total:int) -> None:
+        # While the results are produced, the AgnosticQuery reports each snapshot as soon as its results are complete
+        if stage == EVALUATION_STAGE:
+            self.evaluated_snapshots = done
+        self.progress = {"stage": stage, "done": done, "total": total}
+
+    def to_dict(self) -> dict:
+        return {"job_id": self.id, "status": self.status, "progress": self.progress, "results": len(self.results), "error": self.error}
+
+
+class QueryJobs:
+    """
+    The time agnostic queries submitted to the interface, executed by a pool of background workers,
+    so that no request waits for a query to be over. 
+    An identical query submitted while the previous one is still queued or running is not executed again: 
+    the job already in progress is returned instead. 
+    The jobs are discarded ttl seconds after they are over.
+
+    :param workers: The number of queries executed at the same time. The default is 2.
+    :type workers: int.
+    :param ttl: The number of seconds for which the results of a job are kept after it is over. The default is 3600.
+    :type ttl: float.
+    """
+    def __init__(self, workers:int=WORKERS, ttl:float=JOB_TTL):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs:Dict[str, QueryJob] = dict()
+        # The jobs queued or running, by query
+        self._in_progress:Dict[str, str] = dict()
+        self._lock = threading.Lock()
+
+    def submit(self, query:str, max_results:int=None) -> QueryJob:
+        # The queries differing only in the whitespace are the same
+        key = hashlib.sha1(json.dumps([" ".join(query.split()), max_results]).encode("utf-8")).hexdigest()
+        with self._lock:
+            self._discard_expired()
+            if key in self._in_progress:
+                return self._jobs[self._in_progress[key]]
+            job = QueryJob(uuid.uuid4().hex, query, max_results)
+            self._jobs[job.id] = job
+            self._in_progress[key] = job.id
+        self._executor.submit(self._run, job, key)
+        return job
+
+    def get(self, job_id:str) -> Optional[QueryJob]:
+        with self._lock:
+            self._discard_expired()
+            return self._jobs.get(job_id)
+
+    def _discard_expired(self) -> None:
+        now = time.monotonic()
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished is not None and now - job.finished > self.ttl]:
+            del self._jobs[job_id]
+
+    def _run(self, job:QueryJob, key:str) -> None:
+        job.status = "running"
+        try:
+            agnostic_query = BlazegraphQuery(job.query, config=Config.from_path(SOURCES_CONFIG_PATH), on_progress=job.set_progress)
+            job.variables = [str(variable) for variable in prepare_query(job.query).variables]
+            job.snapshots = sorted(agnostic_query.relevant_graphs, key=convert_to_timestamp)
+            # The results are produced from the oldest snapshot to the most recent
+            for se, result in agnostic_query.iter_agnostic_query(job.max_results):
+                job.results.append((se, result))
+            # With max_results, the evaluation stops before the last snapshots, whose results are complete anyway
+            job.set_progress(EVALUATION_STAGE, len(job.snapshots), len(job.snapshots))
+            job.status = "done"
+        except urllib.error.URLError:
+            job.error = "There are connection problems with the database."
+            job.status = "failed"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            with self._lock:
+                job.finished = time.monotonic()
+                del self._in_progress[key]
+
+
+query_jobs = QueryJobs(**config.get("query_jobs", dict()))
 
 def get_human_readable_date(date:str) -> str:
-    datetime_obj = parser.parse(date).replace(tzinfo=None)
+    datetime_obj = convert_to_datetime(date)
     return datetime_obj.strftime("%d %B %Y, %H:%M:%S")
 
 def get_type_of_entity(snapshots:Dict[str, List[str]]) -> str:
@@ -35,7 +196,7 @@ def get_type_of_entity(snapshots:Dict[str, List[str]]) -> str:
 def sort_by_time(snapshots:Dict[str, Dict]) -> List[Tuple[str, Dict]]:
     sorted_snapshots = sorted(
         snapshots.items(),
-        key=lambda x: parser.parse(x[0]),
+        key=lambda x: convert_to_timestamp(x[0]),
         reverse=True
     )
     return sorted_snapshots
@@ -83,41 +244,119 @@ def get_prov_metadata_by_time(prov_metadata:Dict[str, Dict]) -> Dict[str, Dict]:
 def home():
     return render_template("home.jinja2")
 
+def get_entity_etag(res:str, latest_snapshot:Tuple[str, str]) -> str:
+    snapshot, snapshot_time = latest_snapshot
+    return hashlib.sha1("\n".join([res, snapshot, snapshot_time, RULES_DIGEST]).encode("utf-8")).hexdigest()
+
 @app.route("/entity/<path:res>")
 def entity(res):
-    agnostic_entity = AgnosticEntity(res=res, related_entities_history=False)
+    # The latest snapshot of the entity is looked up first: if it has not changed, 
+    # the page is either still valid in the browser or cached here, and the history is not reconstructed
+    sources_config = Config.from_path(SOURCES_CONFIG_PATH)
     try:
-        history = agnostic_entity.get_history(include_prov_metadata=True)
+        latest_snapshot = _query_latest_snapshots([res], sources_config).get(res)
     except urllib.error.URLError:
         flash("There are connection problems with the database.")
         return redirect(url_for("home"))
-    human_readable_history = get_human_readable_history(history[0])
-    if human_readable_history:
-        prov_metadata = get_prov_metadata_by_time(history[1])
-        return render_template("entity.jinja2", res=res, history=human_readable_history, prov_metadata=prov_metadata)
-    else:
-        flash("I do not have information about that entity in my data.")
-        return redirect(request.referrer)
+    etag = get_entity_etag(res, latest_snapshot) if latest_snapshot is not None else None
+    if etag is not None and etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    page = entity_cache.get(res, latest_snapshot) if latest_snapshot is not None else None
+    if page is None:
+        agnostic_entity = AgnosticEntity(res=res, related_entities_history=False, config=sources_config)
+        try:
+            history = agnostic_entity.get_history(include_prov_metadata=True)
+        except urllib.error.URLError:
+            flash("There are connection problems with the database.")
+            return redirect(url_for("home"))
+        human_readable_history = get_human_readable_history(history[0])
+        if not human_readable_history:
+            flash("I do not have information about that entity in my data.")
+            return redirect(request.referrer)
+        page = (human_readable_history, get_prov_metadata_by_time(history[1]))
+        if latest_snapshot is not None:
+            entity_cache.put(res, latest_snapshot, page)
+    human_readable_history, prov_metadata = page
+    response = make_response(render_template("entity.jinja2", res=res, history=human_readable_history, prov_metadata=prov_metadata))
+    if etag is not None:
+        response.set_etag(etag)
+        # The browser keeps the page, but asks whether it is still valid at every view
+        response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @app.route("/query", methods = ['POST'])
 def query():
+    # The query is executed in the background: the client polls its status and then reads the results
     query = request.form.get("query")
-    agnostic_query = BlazegraphQuery(query)
-    agnostic_results = agnostic_query.run_agnostic_query()
-    variables = prepareQuery(query).algebra["PV"]
-    agnostic_results = sort_by_time(agnostic_results)
-    response = list()
-    for se, outputs in agnostic_results:
+    if not query:
+        return jsonify({"error": "No query was submitted."}), 400
+    job = query_jobs.submit(query, request.form.get("max_results", type=int))
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers["Location"] = url_for("query_job", job_id=job.id)
+    return response
+
+@app.route("/query/<job_id>")
+def query_job(job_id):
+    job = query_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "There is no such query."}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/query/<job_id>/results")
+def query_job_results(job_id):
+    # The results produced so far, for a job in progress as well as for one that is over.
+    # While the query is running, only the snapshots whose results are complete are included
+    job = query_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "There is no such query."}), 404
+    result_format = request.args.get("format", ROWS)
+    if result_format not in RESULT_FORMATS:
+        return jsonify({"error": f"The format must be one of {', '.join(RESULT_FORMATS)}."}), 400
+    snapshots = job.snapshots[:job.evaluated_snapshots]
+    results = job.results[:]
+    return Response(stream_with_context(stream_query_results(snapshots, job.variables, results, result_format)), mimetype="application/json")
+
+def stream_query_results(snapshots:List[str], variables:List[str], results:Iterable[Tuple[str, Tuple]], result_format:str=ROWS) -> Iterator[str]:
+    """
+    It shapes the results of a time agnostic query into a JSON document, which is yielded a snapshot at a time, 
+    from the oldest to the most recent. The results are grouped by snapshot in a single pass, 
+    whatever their order, and those of snapshots that are not listed are left out. 
+    With the "rows" format, each result is an object by variable name: ::
+
+        {"response": [{time: [{var: value}]}]}
+
+    With the "columnar" format, the variable names are listed once and each result is an array of values, in the same order: ::
+
+        {"variables": [var], "response": [{time: [[value]]}]}
+
+    :param snapshots: The snapshots, from the oldest to the most recent.
+    :type snapshots: List[str].
+    :param variables: The names of the variables of the query.
+    :type variables: List[str].
+    :param results: The results, each with the snapshot it belongs to.
+    :type results: Iterable[Tuple[str, Tuple]].
+    :param result_format: Either "rows" or "columnar". The default is "rows".
+    :type result_format: str.
+    :returns: Iterator[str] -- The parts of the JSON document.
+    """
+    rows_by_snapshot:Dict[str, List[Tuple]] = {se: list() for se in snapshots}
+    for se, result in results:
+        rows = rows_by_snapshot.get(se)
+        if rows is not None:
+            rows.append(result)
+    if result_format == COLUMNAR:
+        yield '{"variables": ' + json.dumps(variables) + ', "response": ['
+        encode_row = json.dumps
+    else:
+        yield '{"response": ['
+        encode_row = lambda row: json.dumps(dict(zip(variables, row)))
+    for index, se in enumerate(snapshots):
         time = get_human_readable_date(se)
-        response.append({time: list()})
-        for output in outputs:
-            var_to_values = dict()
-            for i, el in enumerate(output):
-                var = str(variables[i])
-                var_to_values[var] = el
-            dict_to_update:Dict[str, list] = next(item for item in response if time in item.keys())
-            dict_to_update[time].append(var_to_values)
-    return jsonify(response=response)
+        yield ("" if index == 0 else ", ") + "{" + json.dumps(time) + ": [" + ", ".join(map(encode_row, rows_by_snapshot[se])) + "]}"
+    yield "]}"
 
 @app.route("/get_config")
 def get_config():
@@ -1,4 +1,6 @@
 acronymns = ["doi", "orcid"]
+// The milliseconds between two requests for the status of a query
+POLLING_INTERVAL = 1000
 orcid = /orcid\.org\/\d{4}\-\d{4}\-\d{4}\-\d{4}/
 
 function isURI(string) {
@@ -127,30 +129,74 @@ const App = new Vue({
             `);
             $(".sparqlResults .row").empty();
             var query = $("textarea#sparqlEndpoint").val()
+            // The query is executed in the background: its status is polled until it is over
             this.$http.post("/query", { "query": query }, { 'emulateJSON': true }).then(function (data) {
-                this.response = data["body"]["response"]
-                headers = []
-                $(this.response).each(function (_, snapshots) {
-                    $.each(snapshots, function (_, values) {
-                        $(values).each(function (_, value) {
-                            $.each(value, function (key, _) {
-                                header = { "text": key, "value": key, "sortable": true }
-                                if (!headers.some(header => header.text == key && header.value == key)) {
-                                    headers.push(header)
-                                }
+                this.pollQuery(data["body"]["job_id"])
+            }, function (data) {
+                this.showQueryError(data["body"]["error"])
+            });
+        },
+        pollQuery(jobId) {
+            this.$http.get(`/query/${jobId}`).then(function (data) {
+                var job = data["body"]
+                if (job["status"] == "done") {
+                    this.getQueryResults(jobId)
+                } else if (job["status"] == "failed") {
+                    this.showQueryError(job["error"])
+                } else {
+                    var progress = job["progress"]
+                    var message = progress["stage"] ? `${progress["stage"]}: ${progress["done"]}/${progress["total"]}` : "Waiting..."
+                    $("#querySubmit span.ml-1").text(message)
+                    setTimeout(() => this.pollQuery(jobId), POLLING_INTERVAL)
+                }
+            }, function (data) {
+                this.showQueryError(data["body"]["error"])
+            });
+        },
+        getQueryResults(jobId) {
+            // The variables are sent once and each result as an array of values
+            this.$http.get(`/query/${jobId}/results`, { params: { "format": "columnar" } }).then(function (data) {
+                var variables = data["body"]["variables"]
+                // The snapshots are streamed from the oldest, but they are shown from the most recent
+                this.response = $.map(data["body"]["response"].reverse(), function (snapshot) {
+                    var results = {}
+                    $.each(snapshot, function (time, rows) {
+                        results[time] = $.map(rows, function (row) {
+                            var result = {}
+                            $.each(variables, function (index, variable) {
+                                result[variable] = row[index]
                             });
+                            return result
                         });
                     });
+                    return results
+                });
+                this.headers = $.map(variables, function (variable) {
+                    return { "text": variable, "value": variable, "sortable": true }
                 });
-                this.headers = headers
                 showHumanReadableEntities();
-                $("#querySubmit")
-                    .html(`
-                        <span class="mr-1"><span class="fas fa-search"></span></span>
-                        Submit the query
-                    `)
-                    .blur();
+                this.resetSubmitButton()
             });
+        },
+        showQueryError(error) {
+            $("#sparqlResults .alert").remove();
+            $("#querySubmit").after(`
+                <div class="alert alert-danger alert-dismissible fade show" role="alert">
+                    <span class="fas fa-exclamation-circle"></span>
+                    <span class="alert-inner--text"></span>
+                    <button type="button" class="btn-close" data-dismiss="alert" aria-label="Close"></button>
+                </div>
+            `);
+            $("#sparqlResults .alert .alert-inner--text").text(error || "The query could not be executed.");
+            this.resetSubmitButton()
+        },
+        resetSubmitButton() {
+            $("#querySubmit")
+                .html(`
+                    <span class="mr-1"><span class="fas fa-search"></span></span>
+                    Submit the query
+                `)
+                .blur();
         }
     },
     updated: function(){
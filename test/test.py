@@ -14,16 +14,61 @@
 # ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
 # SOFTWARE.
 
-import unittest, datetime, rdflib
+import unittest, datetime, rdflib, json, threading, tempfile, shutil, os, urllib, pickle, io, re, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 
 from rdflib.graph import ConjunctiveGraph
 from pprint import pprint
+from dateutil import parser
 
 from time_agnostic_browser.sparql import Sparql
 from time_agnostic_browser.prov_entity import ProvEntity
-from time_agnostic_browser.agnostic_entity import AgnosticEntity
+from time_agnostic_browser.agnostic_entity import AgnosticEntity, get_entities_histories, _query_latest_snapshots
+from time_agnostic_browser.entity_snapshots import EntitySnapshots
+from time_agnostic_browser.update_query import parse_update_query, invert_update_query, apply_update_query
+from time_agnostic_browser.temporal_store import TemporalIndex, get_view
 from time_agnostic_browser.agnostic_query import AgnosticQuery, BlazegraphQuery
-from time_agnostic_browser.support import FileManager, _to_dict_of_nt_sorted_lists, _to_nt_sorted_list, _to_dict_of_conjunctive_graphs, _to_conjunctive_graph
+from time_agnostic_browser.support import FileManager, convert_to_datetime, convert_to_timestamp, _to_dict_of_nt_sorted_lists, _to_nt_sorted_list, _to_dict_of_conjunctive_graphs, _to_conjunctive_graph
+from time_agnostic_browser.config import Config
+from time_agnostic_browser.connection_pool import ConnectionPool
+from time_agnostic_browser.graph_store import GraphStore
+from time_agnostic_browser.history_cache import HistoryCache
+from time_agnostic_browser.snapshot_checkpoints import SnapshotCheckpoints
+from time_agnostic_browser.past_graphs import materialize_past_graphs, prepare_past_graphs, refresh_past_graphs, read_past_graphs, read_checkpoint, get_checkpoint_path, _query_entities
+from time_agnostic_browser.prepared_query import parse_update, prepare_query
+from time_agnostic_browser.sparql_results import iter_bindings
+from tab_interface import app as tab_interface
+FILES_CONFIG_PATH = "./test/files_config.json"
+
+def _to_dict_of_n3_sorted_lists(dictionary:dict) -> dict:
+    # Like _to_dict_of_nt_sorted_lists, but independent of how the installed rdflib serializes N-Triples
+    return {
+        str(entity): {snapshot: sorted(" ".join(el.n3() for el in triple) for triple in cg.triples((None, None, None))) for snapshot, cg in snapshots.items()}
+        for entity, snapshots in dictionary.items()}
+
+AR_15519_HISTORY = {
+    'https://github.com/arcangelo7/time_agnostic/ar/15519': {
+        '2021-06-01T18:46:41': [
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/4>', 
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/withRole> <http://purl.org/spar/pro/author>', 
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://purl.org/spar/pro/RoleInTime>', 
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <https://w3id.org/oc/ontology/hasNext> <https://github.com/arcangelo7/time_agnostic/ar/15520>'
+        ], 
+        '2021-05-07T09:59:15': [
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/15519>', 
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/withRole> <http://purl.org/spar/pro/author>', 
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <https://w3id.org/oc/ontology/hasNext> <https://github.com/arcangelo7/time_agnostic/ar/15520>'
+        ], 
+        '2021-05-31T18:19:47': [
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/15519>', 
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/withRole> <http://purl.org/spar/pro/author>', 
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://purl.org/spar/pro/RoleInTime>', 
+            '<https://github.com/arcangelo7/time_agnostic/ar/15519> <https://w3id.org/oc/ontology/hasNext> <https://github.com/arcangelo7/time_agnostic/ar/15520>'
+        ]
+    }
+}
+
 
 class Test_AgnosticEntity(unittest.TestCase):
     def test_get_history(self):
@@ -737,6 +782,54 @@ class Test_AgnosticEntity(unittest.TestCase):
         self.assertEqual(AgnosticEntity._convert_to_datetime(input), expected_output)
 
 
+class Test_AgnosticEntityFiles(unittest.TestCase):
+    def test_get_entities_histories(self):
+        input = {"https://github.com/arcangelo7/time_agnostic/ar/15519", "https://github.com/arcangelo7/time_agnostic/ra/4"}
+        output = get_entities_histories(input, include_prov_metadata=True, config=FILES_CONFIG_PATH)
+        ra_4 = [
+            '<https://github.com/arcangelo7/time_agnostic/ra/4> <http://purl.org/spar/datacite/hasIdentifier> <https://github.com/arcangelo7/time_agnostic/id/14>', 
+            '<https://github.com/arcangelo7/time_agnostic/ra/4> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://xmlns.com/foaf/0.1/Agent>', 
+            '<https://github.com/arcangelo7/time_agnostic/ra/4> <http://xmlns.com/foaf/0.1/familyName> "Marini"^^<http://www.w3.org/2001/XMLSchema#string>', 
+            '<https://github.com/arcangelo7/time_agnostic/ra/4> <http://xmlns.com/foaf/0.1/givenName> "Giulio"^^<http://www.w3.org/2001/XMLSchema#string>', 
+            '<https://github.com/arcangelo7/time_agnostic/ra/4> <http://xmlns.com/foaf/0.1/name> "Giulio Marini"^^<http://www.w3.org/2001/XMLSchema#string>'
+        ]
+        expected_output_0 = dict(AR_15519_HISTORY)
+        expected_output_0["https://github.com/arcangelo7/time_agnostic/ra/4"] = {
+            '2021-05-07T09:59:15': ra_4,
+            '2021-06-01T18:46:41': ra_4
+        }
+        expected_output_1 = {
+            'https://github.com/arcangelo7/time_agnostic/ra/4/prov/se/1', 'https://github.com/arcangelo7/time_agnostic/ra/4/prov/se/2',
+            'https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/1', 'https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/2', 
+            'https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/3'
+        }
+        self.assertEqual(_to_dict_of_n3_sorted_lists(output[0]), expected_output_0)
+        self.assertEqual({se for metadata in output[1].values() for se in metadata}, expected_output_1)
+
+    def test_get_entities_histories_batches(self):
+        input = {"https://github.com/arcangelo7/time_agnostic/ar/15519", "https://github.com/arcangelo7/time_agnostic/ra/4", "https://github.com/arcangelo7/time_agnostic/id/14"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_path = os.path.join(tmp_dir, "config.json")
+            config = FileManager(FILES_CONFIG_PATH).import_json()
+            config["reconstruction"] = {"batch_size": 1}
+            FileManager(config_path).dump_json(config)
+            output = get_entities_histories(input, config=config_path)
+        expected_output = get_entities_histories(input, config=FILES_CONFIG_PATH)
+        self.assertEqual(_to_dict_of_n3_sorted_lists(output[0]), _to_dict_of_n3_sorted_lists(expected_output[0]))
+
+    def test__get_old_graphs_deltas(self):
+        input = "https://github.com/arcangelo7/time_agnostic/ar/15519"
+        output = get_entities_histories({input}, config=FILES_CONFIG_PATH)[0][input]
+        self.assertIsInstance(output, EntitySnapshots)
+        self.assertEqual(set(output), set(AR_15519_HISTORY[input]))
+        self.assertEqual(_to_dict_of_n3_sorted_lists({input: output}), AR_15519_HISTORY)
+        # Each access materialises a new graph, so modifying it does not alter the history
+        graph = output["2021-05-07T09:59:15"]
+        graph.remove((None, None, None))
+        self.assertEqual(len(output["2021-05-07T09:59:15"]), 3)
+        self.assertEqual(_to_dict_of_n3_sorted_lists({input: pickle.loads(pickle.dumps(output))}), AR_15519_HISTORY)
+
+
 class Test_AgnosticQuery(unittest.TestCase):        
     def test__tree_traverse_no_options(self):
         query = """
@@ -1901,6 +1994,249 @@ class Test_AgnosticQuery(unittest.TestCase):
         self.assertEqual(output, expected_output)
 
 
+class Test_AgnosticQueryFiles(unittest.TestCase):
+    query = """
+        SELECT ?s ?o
+        WHERE {
+            ?s <http://purl.org/spar/pro/isHeldBy> ?o.
+            ?o <http://xmlns.com/foaf/0.1/name> ?n.
+        }
+    """
+
+    def _get_config(self, tmp_dir:str, reconstruction:dict) -> str:
+        config_path = os.path.join(tmp_dir, "config.json")
+        config = FileManager(FILES_CONFIG_PATH).import_json()
+        config["reconstruction"] = reconstruction
+        FileManager(config_path).dump_json(config)
+        return config_path
+
+    def test_run_agnostic_query(self):
+        output = AgnosticQuery(self.query, config=FILES_CONFIG_PATH).run_agnostic_query()
+        expected_output = {
+            '2021-05-07T09:59:15': {('https://github.com/arcangelo7/time_agnostic/ar/15519', 'https://github.com/arcangelo7/time_agnostic/ra/15519')}, 
+            '2021-05-31T18:19:47': {('https://github.com/arcangelo7/time_agnostic/ar/15519', 'https://github.com/arcangelo7/time_agnostic/ra/15519')}, 
+            '2021-06-01T18:46:41': {('https://github.com/arcangelo7/time_agnostic/ar/15519', 'https://github.com/arcangelo7/time_agnostic/ra/4')}
+        }
+        self.assertEqual(output, expected_output)
+
+    def test__rebuild_relevant_graphs_workers(self):
+        expected_output = _to_dict_of_n3_sorted_lists(AgnosticQuery(self.query, config=FILES_CONFIG_PATH).relevant_entities_graphs)
+        for executor in ["thread", "process"]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                config_path = self._get_config(tmp_dir, {"batch_size": 1, "workers": 2, "executor": executor})
+                output = _to_dict_of_n3_sorted_lists(AgnosticQuery(self.query, config=config_path).relevant_entities_graphs)
+            self.assertEqual(output, expected_output)
+
+    def test_run_agnostic_query_single_pass(self):
+        queries = [
+            self.query,
+            """
+                SELECT ?s ?n
+                WHERE {
+                    ?s <http://purl.org/spar/pro/isHeldBy> ?o.
+                    OPTIONAL {?o <http://xmlns.com/foaf/0.1/name> ?n.}
+                }
+            """
+        ]
+        for query in queries:
+            agnostic_query = AgnosticQuery(query, config=FILES_CONFIG_PATH)
+            output = agnostic_query.run_agnostic_query()
+            # The same query evaluated on each snapshot separately
+            expected_output = {
+                snapshot: {tuple(str(var) for var in result) for result in graph.query(query)}
+                for snapshot, graph in agnostic_query.relevant_graphs.items()}
+            self.assertEqual(output, expected_output)
+        self.assertTrue(agnostic_query._is_monotonic(prepare_query(queries[0]).algebra, list()))
+        self.assertFalse(agnostic_query._is_monotonic(prepare_query(queries[1]).algebra, list()))
+
+    def test_iter_agnostic_query_progress(self):
+        # Each snapshot is reported as soon as its results are complete, even if it has none
+        queries = [
+            self.query.replace("?n.", "?n. FILTER (?o = <https://github.com/arcangelo7/time_agnostic/ra/4>)"),
+            """
+                SELECT ?s ?n
+                WHERE {
+                    ?s <http://purl.org/spar/pro/isHeldBy> ?o.
+                    OPTIONAL {?o <http://xmlns.com/foaf/0.1/name> ?n.}
+                    FILTER (?o = <https://github.com/arcangelo7/time_agnostic/ra/4>)
+                }
+            """
+        ]
+        for query in queries:
+            agnostic_query = AgnosticQuery(query, config=FILES_CONFIG_PATH)
+            snapshots = sorted(agnostic_query.relevant_graphs, key=convert_to_timestamp)
+            expected_output = agnostic_query.run_agnostic_query()
+            yielded = list()
+            reports = list()
+            agnostic_query.on_progress = lambda stage, done, total: reports.append((stage, done, total, len(yielded)))
+            for snapshot, _ in agnostic_query.iter_agnostic_query():
+                yielded.append(snapshot)
+            self.assertEqual([report[1] for report in reports], list(range(len(snapshots) + 1)))
+            for stage, done, total, results_count in reports:
+                self.assertEqual((stage, total), ("Evaluating the query", len(snapshots)))
+                self.assertEqual(results_count, sum(len(expected_output[snapshot]) for snapshot in snapshots[:done]))
+            self.assertEqual(len(expected_output[snapshots[0]]), 0)
+
+    def test_iter_agnostic_query_path(self):
+        # The second hop of the path changes on an intermediate node, which no pattern of the query mentions
+        a, b, c1, c2 = (rdflib.URIRef(f"https://github.com/arcangelo7/time_agnostic/br/{i}") for i in ("a", "b", "c1", "c2"))
+        p, q = rdflib.URIRef("http://purl.org/spar/cito/p"), rdflib.URIRef("http://purl.org/spar/cito/q")
+        graph = rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/br/")
+        snapshots = ["2021-05-07T09:59:15", "2021-05-31T18:19:47"]
+        t1, t2 = (convert_to_timestamp(snapshot) for snapshot in snapshots)
+        agnostic_query = AgnosticQuery.__new__(AgnosticQuery)
+        agnostic_query.query = f"SELECT ?o WHERE {{<{a}> <{p}>/<{q}> ?o}}"
+        agnostic_query.on_progress = None
+        agnostic_query.temporal_index = TemporalIndex()
+        agnostic_query.temporal_index.add((a, p, b, graph), t1)
+        agnostic_query.temporal_index.add((b, q, c1, graph), t1, t2)
+        agnostic_query.temporal_index.add((b, q, c2, graph), t2)
+        agnostic_query.relevant_graphs = {snapshot: get_view(agnostic_query.temporal_index, time, time) for snapshot, time in zip(snapshots, (t1, t2))}
+        output = agnostic_query.run_agnostic_query()
+        expected_output = {snapshots[0]: {(str(c1),)}, snapshots[1]: {(str(c2),)}}
+        self.assertEqual(output, expected_output)
+
+    def test__align_snapshots_incremental(self):
+        agnostic_query = AgnosticQuery(self.query, config=FILES_CONFIG_PATH)
+        expected_output = _to_dict_of_n3_sorted_lists({"graphs": agnostic_query.relevant_graphs})
+        entities_graphs = agnostic_query.relevant_entities_graphs
+        agnostic_query.relevant_graphs = dict()
+        agnostic_query.temporal_index = TemporalIndex()
+        agnostic_query._aligned_entities = set()
+        # The entities are aligned one at a time, as if they had been reconstructed one after the other
+        agnostic_query.relevant_entities_graphs = dict()
+        for entity in sorted(entities_graphs, reverse=True):
+            agnostic_query.relevant_entities_graphs[entity] = entities_graphs[entity]
+            agnostic_query._align_snapshots()
+        output = _to_dict_of_n3_sorted_lists({"graphs": agnostic_query.relevant_graphs})
+        self.assertEqual(output, expected_output)
+
+    def test_iter_agnostic_query(self):
+        queries = [
+            self.query,
+            """
+                SELECT ?s ?n
+                WHERE {
+                    ?s <http://purl.org/spar/pro/isHeldBy> ?o.
+                    OPTIONAL {?o <http://xmlns.com/foaf/0.1/name> ?n.}
+                }
+            """
+        ]
+        for query in queries:
+            agnostic_query = AgnosticQuery(query, config=FILES_CONFIG_PATH)
+            expected_output = agnostic_query.run_agnostic_query()
+            output = list(agnostic_query.iter_agnostic_query())
+            times = [convert_to_timestamp(snapshot) for snapshot, _ in output]
+            self.assertEqual(times, sorted(times))
+            self.assertEqual(len(output), sum(len(results) for results in expected_output.values()))
+            self.assertEqual({(snapshot, result) for snapshot, results in expected_output.items() for result in results}, set(output))
+            output_max_results = list(agnostic_query.iter_agnostic_query(max_results=2))
+            self.assertEqual(len(output_max_results), 2)
+            self.assertTrue(set(output_max_results).issubset(output))
+
+    def test_run_agnostic_query_past_graphs(self):
+        expected_output = AgnosticQuery(self.query, config=FILES_CONFIG_PATH).run_agnostic_query()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            past_graphs_path = os.path.join(tmp_dir, "past_graphs.log.gz")
+            output_1 = AgnosticQuery(self.query, config=FILES_CONFIG_PATH, past_graphs_destination=past_graphs_path).run_agnostic_query()
+            output_2 = AgnosticQuery(self.query, config=FILES_CONFIG_PATH, past_graphs_location=past_graphs_path).run_agnostic_query()
+        self.assertEqual((output_1, output_2), (expected_output, expected_output))
+
+
+class Test_PastGraphs(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.past_graphs_path = os.path.join(self.tmp_dir.name, "past_graphs.log.gz")
+        self.config_path = os.path.join(self.tmp_dir.name, "config.json")
+        config = FileManager(FILES_CONFIG_PATH).import_json()
+        config["reconstruction"] = {"batch_size": 2}
+        FileManager(self.config_path).dump_json(config)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_materialize_past_graphs(self):
+        materialize_past_graphs(self.past_graphs_path, self.config_path, progress_bar=False)
+        entities = _query_entities(Config.load(FILES_CONFIG_PATH))
+        expected_output = get_entities_histories(set(entities), config=FILES_CONFIG_PATH)[0]
+        output = read_past_graphs(self.past_graphs_path)
+        self.assertEqual(_to_dict_of_n3_sorted_lists(output), _to_dict_of_n3_sorted_lists(expected_output))
+        self.assertEqual(read_checkpoint(self.past_graphs_path)["last_entity"], entities[-1])
+        self.assertTrue(read_checkpoint(self.past_graphs_path)["complete"])
+
+    def test_materialize_past_graphs_resume(self):
+        materialize_past_graphs(self.past_graphs_path, self.config_path, progress_bar=False)
+        expected_output = _to_dict_of_n3_sorted_lists(read_past_graphs(self.past_graphs_path))
+        # A crash while writing a batch leaves a truncated gzip member after the last checkpoint
+        checkpoint = read_checkpoint(self.past_graphs_path)
+        with open(self.past_graphs_path, "ab") as past_graphs_file:
+            past_graphs_file.write(b"\x1f\x8b\x08\x00")
+        checkpoint["complete"] = False
+        FileManager(get_checkpoint_path(self.past_graphs_path)).dump_json(checkpoint)
+        with self.assertRaises(ValueError):
+            read_past_graphs(self.past_graphs_path)
+        materialize_past_graphs(self.past_graphs_path, self.config_path, progress_bar=False)
+        output = _to_dict_of_n3_sorted_lists(read_past_graphs(self.past_graphs_path))
+        self.assertEqual(output, expected_output)
+        self.assertEqual(os.path.getsize(self.past_graphs_path), checkpoint["size"])
+
+    def _add_snapshots(self) -> str:
+        # A new snapshot of ra/4, recording a new triple, and a new entity, br/1, are added to the dataset and to the provenance.
+        # The time of the former is a plain literal, the time of the latter an xsd:dateTime with a timezone
+        ra_4 = rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/ra/4")
+        br_1 = rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/br/1")
+        nick = (ra_4, rdflib.URIRef("http://xmlns.com/foaf/0.1/nick"), rdflib.Literal("Giulio"), rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/ra/"))
+        dataset = ConjunctiveGraph()
+        dataset.parse("./test/dataset.json", format="json-ld")
+        dataset.add(nick)
+        dataset.add((br_1, rdflib.RDF.type, rdflib.URIRef("http://purl.org/spar/fabio/Expression"), rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/br/")))
+        provenance = ConjunctiveGraph()
+        provenance.parse("./test/prov.json", format="json-ld")
+        for entity, snapshot, time, update_query in [
+            (ra_4, "prov/se/3", "2021-06-10T10:00:00.000Z", f"INSERT DATA {{ GRAPH <{nick[3]}> {{ {nick[0].n3()} {nick[1].n3()} {nick[2].n3()} . }} }}"),
+            (br_1, "prov/se/1", rdflib.Literal("2021-06-10T10:00:00+02:00", datatype=rdflib.XSD.dateTime), None)]:
+            snapshot = rdflib.URIRef(f"{entity}/{snapshot}")
+            context = rdflib.URIRef(f"{entity}/prov/")
+            provenance.add((snapshot, ProvEntity.iri_specialization_of, entity, context))
+            provenance.add((snapshot, ProvEntity.iri_generated_at_time, rdflib.Literal(time), context))
+            if update_query is not None:
+                provenance.add((snapshot, ProvEntity.iri_has_update_query, rdflib.Literal(update_query), context))
+        dataset.serialize(os.path.join(self.tmp_dir.name, "dataset.json"), format="json-ld")
+        provenance.serialize(os.path.join(self.tmp_dir.name, "prov.json"), format="json-ld")
+        config_path = os.path.join(self.tmp_dir.name, "new_config.json")
+        config = FileManager(self.config_path).import_json()
+        config["dataset"]["file_paths"] = [os.path.join(self.tmp_dir.name, "dataset.json")]
+        config["provenance"]["file_paths"] = [os.path.join(self.tmp_dir.name, "prov.json")]
+        FileManager(config_path).dump_json(config)
+        return config_path
+
+    def test_refresh_past_graphs(self):
+        materialize_past_graphs(self.past_graphs_path, self.config_path, progress_bar=False)
+        self.assertEqual(refresh_past_graphs(self.past_graphs_path, self.config_path), set())
+        self.assertEqual(read_checkpoint(self.past_graphs_path)["watermark"], "2021-06-01T18:46:41")
+        new_config_path = self._add_snapshots()
+        output_1 = refresh_past_graphs(self.past_graphs_path, new_config_path)
+        output_2 = refresh_past_graphs(self.past_graphs_path, new_config_path)
+        expected_output = _to_dict_of_n3_sorted_lists(get_entities_histories(set(_query_entities(Config.load(new_config_path))), config=new_config_path)[0])
+        self.assertEqual(output_1, {"https://github.com/arcangelo7/time_agnostic/ra/4", "https://github.com/arcangelo7/time_agnostic/br/1"})
+        self.assertEqual(output_2, set())
+        self.assertEqual(_to_dict_of_n3_sorted_lists(read_past_graphs(self.past_graphs_path)), expected_output)
+        self.assertEqual(read_checkpoint(self.past_graphs_path)["watermark"], "2021-06-10T10:00:00")
+
+    def test_prepare_past_graphs(self):
+        prepare_past_graphs(self.past_graphs_path, self.config_path)
+        self.assertTrue(read_checkpoint(self.past_graphs_path)["complete"])
+        new_config_path = self._add_snapshots()
+        # Within the interval, the provenance is not scanned again
+        prepare_past_graphs(self.past_graphs_path, new_config_path)
+        self.assertEqual(read_checkpoint(self.past_graphs_path)["watermark"], "2021-06-01T18:46:41")
+        config = FileManager(new_config_path).import_json()
+        config["past_graphs"] = {"refresh_interval": 0}
+        FileManager(new_config_path).dump_json(config)
+        prepare_past_graphs(self.past_graphs_path, new_config_path)
+        self.assertEqual(read_checkpoint(self.past_graphs_path)["watermark"], "2021-06-10T10:00:00")
+
+
 class Test_BlazegraphQuery(unittest.TestCase):
     def test__get_query_to_identify(self):
         query = """
@@ -1968,6 +2304,217 @@ class Test_Support(unittest.TestCase):
         }
         self.assertEqual(FileManager(input).import_json(), expected_output)
 
+    def test_convert_to_datetime(self):
+        input = [
+            "2021-06-01T18:46:41.000Z", "2021-06-01T18:46:41+00:00", "2021-06-01T18:46:41.123456789+02:00", 
+            "2021-06-01T18:46", "2021-06-01", "1 June 2021 18:46:41"]
+        for time_string in input:
+            self.assertEqual(convert_to_datetime(time_string), parser.parse(time_string).replace(tzinfo=None))
+        self.assertEqual(convert_to_datetime(rdflib.term.Literal("2021-06-01T18:46:41+00:00", datatype=rdflib.XSD.dateTime)), datetime.datetime(2021, 6, 1, 18, 46, 41))
+
+    def test_convert_to_timestamp(self):
+        input = ["2021-06-01T18:46:41.000Z", "2021-05-07T09:59:15+00:00", "2021-05-31T18:19:47.000001Z"]
+        output = sorted(input, key=convert_to_timestamp)
+        self.assertEqual(output, ["2021-05-07T09:59:15+00:00", "2021-05-31T18:19:47.000001Z", "2021-06-01T18:46:41.000Z"])
+        self.assertEqual(convert_to_timestamp("1970-01-01T00:00:01Z"), 1000000)
+
+
+class Test_Config(unittest.TestCase):
+    def test_from_path(self):
+        output_1 = Config.from_path("./test/config.json")
+        output_2 = Config.from_path("./test/config.json")
+        self.assertIs(output_1, output_2)
+        self.assertEqual(output_1["provenance"]["file_paths"], ("./test/prov.json",))
+
+    def test_from_path_modified_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_path = os.path.join(tmp_dir, "config.json")
+            shutil.copy("./test/config.json", config_path)
+            output_1 = Config.from_path(config_path)
+            os.utime(config_path, (0, 0))
+            output_2 = Config.from_path(config_path)
+        self.assertIsNot(output_1, output_2)
+
+    def test_get_storer(self):
+        config = Config.from_path("./test/config.json")
+        input_1 = f"SELECT ?t WHERE {{?s <{ProvEntity.iri_generated_at_time}> ?t}}"
+        input_2 = "SELECT ?o WHERE {?s <http://purl.org/spar/pro/isHeldBy> ?o}"
+        output = (config.get_storer(input_1), config.get_storer(input_2))
+        expected_output = (config["provenance"], config["dataset"])
+        self.assertEqual(output, expected_output)
+
+    def test_load_config_path(self):
+        # The path passed under the deprecated name is still accepted
+        with self.assertWarns(DeprecationWarning):
+            output = Sparql("SELECT ?o WHERE {?s <http://purl.org/spar/pro/isHeldBy> ?o}", config_path="./test/config.json")
+        self.assertEqual(output.storer, Config.from_path("./test/config.json")["dataset"])
+
+
+class Test_PreparedQuery(unittest.TestCase):
+    def test_prepare_query(self):
+        input = """
+            SELECT ?p ?o
+            WHERE {
+                <https://github.com/arcangelo7/time_agnostic/ar/15519> ?p ?o
+            }
+            LIMIT 2
+        """
+        output_1 = prepare_query(input)
+        output_2 = prepare_query(input)
+        self.assertIs(output_1, output_2)
+        self.assertEqual((output_1.variables, output_1.limit), ([rdflib.term.Variable("p"), rdflib.term.Variable("o")], 2))
+
+    def test_prepare_query_construct(self):
+        input = """
+            CONSTRUCT {<https://github.com/arcangelo7/time_agnostic/ar/15519> ?p ?o}
+            WHERE {<https://github.com/arcangelo7/time_agnostic/ar/15519> ?p ?o}
+        """
+        output = prepare_query(input)
+        self.assertEqual((output.algebra.name, output.variables, output.limit), ("ConstructQuery", None, None))
+
+    def test_prepare_query_threads(self):
+        # Different queries, and update queries, parsed by several threads at once
+        queries = [f"SELECT ?o{i} WHERE {{<https://github.com/arcangelo7/time_agnostic/ar/{i}> ?p ?o{i}}} LIMIT {i + 1}" for i in range(40)]
+        updates = [f"INSERT DATA {{GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> {{<https://github.com/arcangelo7/time_agnostic/ar/{i}> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/{i}> .}}}}" for i in range(40)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            prepared_queries = list(executor.map(prepare_query, queries))
+            parsed_updates = list(executor.map(parse_update, updates))
+        self.assertEqual([output.limit for output in prepared_queries], list(range(1, 41)))
+        self.assertEqual([len(output["request"]) for output in parsed_updates], [1] * 40)
+
+
+class Test_UpdateQuery(unittest.TestCase):
+    def test_parse_update_query(self):
+        input = """
+            PREFIX pro: <http://purl.org/spar/pro/>
+            DELETE DATA { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { 
+                <https://github.com/arcangelo7/time_agnostic/ar/15519> pro:isHeldBy <https://github.com/arcangelo7/time_agnostic/ra/15519> ;
+                    a pro:RoleInTime .
+            } };
+            INSERT DATA { 
+                <https://github.com/arcangelo7/time_agnostic/ra/4> <http://xmlns.com/foaf/0.1/name> "Giulio \\"Marini\\"", "Giulio"@it, 4 .
+            }
+        """
+        output = list(parse_update_query(input))
+        ar = rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/15519")
+        ra = rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/4")
+        name = rdflib.term.URIRef("http://xmlns.com/foaf/0.1/name")
+        graph = rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/")
+        expected_output = [
+            ("DELETE", (ar, rdflib.term.URIRef("http://purl.org/spar/pro/isHeldBy"), rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/15519"), graph)),
+            ("DELETE", (ar, rdflib.RDF.type, rdflib.term.URIRef("http://purl.org/spar/pro/RoleInTime"), graph)),
+            ("INSERT", (ra, name, rdflib.term.Literal('Giulio "Marini"'), None)),
+            ("INSERT", (ra, name, rdflib.term.Literal("Giulio", lang="it"), None)),
+            ("INSERT", (ra, name, rdflib.term.Literal("4", datatype=rdflib.XSD.integer), None))
+        ]
+        self.assertEqual(output, expected_output)
+
+    def test_invert_update_query(self):
+        graph = rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/")
+        held_by_4 = (
+            rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/15519"), 
+            rdflib.term.URIRef("http://purl.org/spar/pro/isHeldBy"), 
+            rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/4"), 
+            graph)
+        held_by_15519 = held_by_4[:2] + (rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/15519"), graph)
+        input_1 = ConjunctiveGraph()
+        input_1.add(held_by_4)
+        input_2 = "DELETE DATA { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { <https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/15519> .} }; INSERT DATA { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { <https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/4> .} }"
+        output = invert_update_query(input_1, input_2)
+        self.assertEqual(output, ({held_by_15519}, {held_by_4}))
+        self.assertEqual(set(input_1.quads()), {held_by_15519[:3] + (input_1.get_context(graph),)})
+
+    def test_invert_update_query_deleted_and_inserted(self):
+        # The quad was present before the query, which deleted it and inserted it again: it is present after the undo
+        quad = (
+            rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/15519"), 
+            rdflib.term.URIRef("http://purl.org/spar/pro/isHeldBy"), 
+            rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/4"), 
+            rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/"))
+        triples = "<https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/4> ."
+        input_1 = ConjunctiveGraph()
+        input_1.add(quad)
+        input_2 = f"DELETE DATA {{ GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> {{ {triples} }} }}; INSERT DATA {{ GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> {{ {triples} }} }}"
+        output = invert_update_query(input_1, input_2)
+        self.assertEqual(output, (set(), set()))
+        self.assertEqual(set(input_1.quads()), {quad[:3] + (input_1.get_context(quad[3]),)})
+        # The quad was absent before the query, which inserted it and deleted it again: it is absent after the undo
+        input_3 = f"INSERT DATA {{ GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> {{ {triples} }} }}; DELETE DATA {{ GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> {{ {triples} }} }}"
+        input_1.remove(quad)
+        output = invert_update_query(input_1, input_3)
+        self.assertEqual((output, len(input_1)), ((set(), set()), 0))
+
+    def test_invert_update_query_unsupported(self):
+        input_1 = ConjunctiveGraph()
+        input_2 = """
+            DELETE DATA { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { <https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/15519> .} };
+            INSERT { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { <https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/4> } } WHERE {}
+        """
+        # The query is parsed before the graph is changed
+        with self.assertRaises(ValueError):
+            invert_update_query(input_1, input_2)
+        self.assertEqual(len(input_1), 0)
+        output = AgnosticEntity._manage_update_queries(input_1, input_2)
+        self.assertEqual((len(output[0]), len(output[1])), (1, 0))
+
+    def test_apply_update_query(self):
+        graph = rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/")
+        held_by_4 = (
+            rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/15519"), 
+            rdflib.term.URIRef("http://purl.org/spar/pro/isHeldBy"), 
+            rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/4"), 
+            graph)
+        held_by_15519 = held_by_4[:2] + (rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/15519"), graph)
+        input_1 = {held_by_15519}
+        input_2 = "DELETE DATA { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { <https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/15519> .} }; INSERT DATA { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { <https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/4> .} }"
+        output = apply_update_query(input_1, input_2)
+        self.assertEqual((output, input_1), (({held_by_4}, {held_by_15519}), {held_by_4}))
+        # The triples outside a GRAPH block cannot be applied, and the changes already applied are undone
+        with self.assertRaises(ValueError):
+            apply_update_query(input_1, "INSERT DATA { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { <https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/15519> .} }; DELETE DATA { <https://github.com/arcangelo7/time_agnostic/ar/15519> <http://purl.org/spar/pro/isHeldBy> <https://github.com/arcangelo7/time_agnostic/ra/4> .}")
+        self.assertEqual(input_1, {held_by_4})
+
+
+class Test_TemporalStore(unittest.TestCase):
+    ar = rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/15519")
+    held_by = rdflib.term.URIRef("http://purl.org/spar/pro/isHeldBy")
+    graph = rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ar/")
+    held_by_15519 = (ar, held_by, rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/15519"), graph)
+    held_by_4 = (ar, held_by, rdflib.term.URIRef("https://github.com/arcangelo7/time_agnostic/ra/4"), graph)
+
+    def _get_index(self) -> TemporalIndex:
+        index = TemporalIndex()
+        index.add(self.held_by_15519, 10, 20)
+        index.add(self.held_by_15519, 20, 30)
+        index.add(self.held_by_4, 30)
+        return index
+
+    def test_add(self):
+        index = self._get_index()
+        self.assertEqual(index.get_intervals(self.held_by_15519), [(10, 30)])
+        self.assertEqual(index.get_intervals(self.held_by_4), [(30, None)])
+        self.assertEqual(len(index), 2)
+        with self.assertRaises(ValueError):
+            index.add(self.held_by_4, 5, 5)
+
+    def test_quads(self):
+        index = self._get_index()
+        self.assertEqual(set(index.quads((self.ar, None, None, None), 29, 29)), {self.held_by_15519})
+        self.assertEqual(set(index.quads((self.ar, None, None, None), 30, 30)), {self.held_by_4})
+        self.assertEqual(set(index.quads((None, self.held_by, None, self.graph), 25, 35)), {self.held_by_15519, self.held_by_4})
+        self.assertEqual(set(index.quads((None, None, None, None), 0, 9)), set())
+
+    def test_get_view(self):
+        view = get_view(self._get_index(), 15, 15)
+        self.assertIsInstance(view.store, rdflib.plugin.get("Temporal", rdflib.store.Store))
+        self.assertEqual(set(view.triples((None, None, None))), {self.held_by_15519[:3]})
+        output = {tuple(result) for result in view.query("""
+            SELECT ?ra WHERE { GRAPH <https://github.com/arcangelo7/time_agnostic/ar/> { ?ar <http://purl.org/spar/pro/isHeldBy> ?ra } }
+        """)}
+        self.assertEqual(output, {(self.held_by_15519[2],)})
+        with self.assertRaises(TypeError):
+            view.add(self.held_by_4)
+
 
 class Test_Sparql(unittest.TestCase):
     def test_run_select_query(self):
@@ -2104,5 +2651,690 @@ class Test_Sparql(unittest.TestCase):
         self.assertEqual(output, expected_output)
 
 
+class _SparqlJsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"head": {"vars": ["o"]}, "results": {"bindings": [{"o": {"type": "literal", "value": "1"}}]}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/sparql-results+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _SlowSparqlJsonHandler(_SparqlJsonHandler):
+    delay = 5
+
+    def do_POST(self):
+        time.sleep(self.delay)
+        try:
+            super(_SlowSparqlJsonHandler, self).do_POST()
+        except OSError:
+            pass
+
+
+class _QueuedSparqlJsonHandler(_SlowSparqlJsonHandler):
+    delay = 0.6
+
+
+class _SparqlQuadsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    queries = list()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.queries.append(urllib.parse.parse_qs(body.decode("utf-8"))["query"][0])
+        if self.headers["Accept"] == "application/n-quads":
+            content_type = "application/n-quads"
+            body = (
+                '<https://github.com/arcangelo7/time_agnostic/ar/1> <http://purl.org/spar/pro/withRole> <http://purl.org/spar/pro/author> <https://github.com/arcangelo7/time_agnostic/ar/> .\n'
+                '<https://github.com/arcangelo7/time_agnostic/ar/1> <http://www.w3.org/2000/01/rdf-schema#label> "author"@en <https://github.com/arcangelo7/time_agnostic/ar/> .\n').encode("utf-8")
+        else:
+            content_type = "application/sparql-results+json"
+            body = json.dumps({"head": {"vars": ["s", "p", "o", "c"]}, "results": {"bindings": [
+                {"s": {"type": "uri", "value": "https://github.com/arcangelo7/time_agnostic/ar/1"}, "p": {"type": "uri", "value": "http://purl.org/spar/pro/withRole"},
+                 "o": {"type": "uri", "value": "http://purl.org/spar/pro/author"}, "c": {"type": "uri", "value": "https://github.com/arcangelo7/time_agnostic/ar/"}},
+                {"s": {"type": "uri", "value": "https://github.com/arcangelo7/time_agnostic/ar/1"}, "p": {"type": "uri", "value": "http://www.w3.org/2000/01/rdf-schema#label"},
+                 "o": {"type": "literal", "value": "author", "xml:lang": "en"}, "c": {"type": "uri", "value": "https://github.com/arcangelo7/time_agnostic/ar/"}}]}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _SparqlPagesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    queries = list()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        query = urllib.parse.parse_qs(body.decode("utf-8"))["query"][0]
+        self.queries.append(query)
+        limit = re.search(r"LIMIT (\d+)", query)
+        offset = re.search(r"OFFSET (\d+)", query)
+        start = int(offset.group(1)) if offset else 0
+        end = start + int(limit.group(1)) if limit else 25
+        entities = [f"https://github.com/arcangelo7/time_agnostic/br/{i}" for i in sorted(range(25), key=str)[start:end]]
+        if "SELECT" in query:
+            bindings = [{
+                "s": {"type": "uri", "value": entity},
+                "p": {"type": "uri", "value": str(rdflib.RDF.type)},
+                "o": {"type": "uri", "value": "http://purl.org/spar/fabio/JournalArticle"},
+                "c": {"type": "uri", "value": "https://github.com/arcangelo7/time_agnostic/br/"}} for entity in entities]
+            body = json.dumps({"head": {"vars": ["s", "p", "o", "c"]}, "results": {"bindings": bindings}}).encode("utf-8")
+            content_type = "application/sparql-results+json"
+        else:
+            graph = rdflib.Graph()
+            for entity in entities:
+                graph.add((rdflib.URIRef(entity), rdflib.RDF.type, rdflib.URIRef("http://purl.org/spar/fabio/JournalArticle")))
+            body = graph.serialize(format="xml").encode("utf-8")
+            content_type = "application/rdf+xml"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class Test_ConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("localhost", 0), _SparqlJsonHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://localhost:{self.server.server_port}/sparql"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_request(self):
+        pool = ConnectionPool(self.url)
+        status, data = pool.request("POST", b"query=ASK{}", {"Content-Type": "application/x-www-form-urlencoded"})
+        pool.close()
+        self.assertEqual((status, json.loads(data)["results"]["bindings"][0]["o"]["value"]), (200, "1"))
+
+    def test_get_stats(self):
+        pool = ConnectionPool(self.url)
+        for _ in range(3):
+            pool.request("POST", b"query=ASK{}", {"Content-Type": "application/x-www-form-urlencoded"})
+        output = pool.get_stats()
+        pool.close()
+        expected_output = {"hits": 2, "misses": 1, "idle": 1}
+        self.assertEqual(output, expected_output)
+
+
+    def test_stream(self):
+        pool = ConnectionPool(self.url)
+        with pool.stream("POST", b"query=ASK{}", {"Content-Type": "application/x-www-form-urlencoded"}) as response:
+            output = list(iter_bindings(response, chunk_size=8))
+        # The body was read to the end, so the connection is reused
+        pool.request("POST", b"query=ASK{}", {"Content-Type": "application/x-www-form-urlencoded"})
+        stats = pool.get_stats()
+        pool.close()
+        self.assertEqual(output, [{"o": {"type": "literal", "value": "1"}}])
+        self.assertEqual(stats, {"hits": 1, "misses": 1, "idle": 1})
+
+
+class Test_SparqlQuads(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("localhost", 0), _SparqlQuadsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        _SparqlQuadsHandler.queries = list()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.query = """
+            PREFIX pro: <http://purl.org/spar/pro/>
+            SELECT DISTINCT ?s ?p ?o ?c
+            WHERE {
+                GRAPH ?c {?s ?p ?o}
+                BIND (<https://github.com/arcangelo7/time_agnostic/ar/1> AS ?s)
+            }
+        """
+        self.expected_output = {
+            ("<https://github.com/arcangelo7/time_agnostic/ar/1>", "<http://purl.org/spar/pro/withRole>", "<http://purl.org/spar/pro/author>", "<https://github.com/arcangelo7/time_agnostic/ar/>"),
+            ("<https://github.com/arcangelo7/time_agnostic/ar/1>", "<http://www.w3.org/2000/01/rdf-schema#label>", '"author"@en', "<https://github.com/arcangelo7/time_agnostic/ar/>")}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def _write_config(self, construct_quads:bool) -> str:
+        config_path = os.path.join(self.tmp_dir.name, "config.json")
+        config = {
+            "dataset": {"triplestore_urls": [f"http://localhost:{self.server.server_port}/sparql"], "file_paths": []},
+            "provenance": {"triplestore_urls": [], "file_paths": []},
+            "construct_quads": construct_quads
+        }
+        FileManager(config_path).dump_json(config)
+        return config_path
+
+    def _to_n3_quads(self, cg:ConjunctiveGraph) -> set:
+        return {(s.n3(), p.n3(), o.n3(), c.identifier.n3()) for s, p, o, c in cg.quads()}
+
+    def test_run_construct_query(self):
+        # The language tags and the datatypes of the literals are kept
+        output = Sparql(self.query, self._write_config(False)).run_construct_query()
+        self.assertEqual(self._to_n3_quads(output), self.expected_output)
+        self.assertIn("SELECT DISTINCT ?s ?p ?o ?c", _SparqlQuadsHandler.queries[0])
+
+    def test_run_construct_query_nquads(self):
+        output = Sparql(self.query, self._write_config(True)).run_construct_query()
+        self.assertEqual(self._to_n3_quads(output), self.expected_output)
+        self.assertIn("PREFIX pro: <http://purl.org/spar/pro/>\n            CONSTRUCT {GRAPH ?c {?s ?p ?o}}", _SparqlQuadsHandler.queries[0])
+
+    def test__to_quads_construct_query(self):
+        config_path = self._write_config(True)
+        self.assertIsNone(Sparql("SELECT ?s ?p ?o WHERE {GRAPH ?c {?s ?p ?o}}", config_path)._to_quads_construct_query())
+        self.assertIsNone(Sparql("SELECT ?x WHERE {{SELECT ?s ?p ?o ?c WHERE {GRAPH ?c {?s ?p ?o}}} BIND (?s AS ?x)}", config_path)._to_quads_construct_query())
+
+class Test_SparqlPages(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("localhost", 0), _SparqlPagesHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        _SparqlPagesHandler.queries = list()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.tmp_dir.name, "config.json")
+        config = {
+            "dataset": {"triplestore_urls": [f"http://localhost:{self.server.server_port}/sparql"], "file_paths": []},
+            "provenance": {"triplestore_urls": [], "file_paths": []},
+            "pagination": {"page_size": 10}
+        }
+        FileManager(self.config_path).dump_json(config)
+        self.query = """
+            CONSTRUCT {?s a <http://purl.org/spar/fabio/JournalArticle>}
+            WHERE {?s a <http://purl.org/spar/fabio/JournalArticle>}
+        """
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_iter_construct_query(self):
+        output = list(Sparql(self.query, self.config_path).iter_construct_query())
+        self.assertEqual([len(page) for page in output], [10, 10, 5])
+        self.assertEqual(len({triple for page in output for triple in page}), 25)
+        # The triples of a CONSTRUCT do not tell how many solutions there were: the pages are requested until an empty one is returned
+        self.assertEqual(len(_SparqlPagesHandler.queries), 4)
+        self.assertIn("ORDER BY ?s\nLIMIT 10\nOFFSET 20", _SparqlPagesHandler.queries[2])
+
+    def test_iter_construct_query_select(self):
+        query = "SELECT ?s ?p ?o ?c WHERE {GRAPH ?c {?s ?p ?o}}"
+        output = list(Sparql(query, self.config_path).iter_construct_query())
+        self.assertEqual([len(page) for page in output], [10, 10, 5])
+        # The last page holds fewer solutions than requested, so no more pages are requested
+        self.assertEqual(len(_SparqlPagesHandler.queries), 3)
+        self.assertIn("ORDER BY ?s ?p ?o ?c\nLIMIT 10\nOFFSET 20", _SparqlPagesHandler.queries[2])
+
+    def test_iter_construct_query_limit(self):
+        output = list(Sparql(self.query + "LIMIT 12", self.config_path).iter_construct_query())
+        self.assertEqual([len(page) for page in output], [10, 2])
+        self.assertEqual(len(_SparqlPagesHandler.queries), 2)
+        self.assertTrue(_SparqlPagesHandler.queries[1].endswith("ORDER BY ?s\nLIMIT 2\nOFFSET 10"))
+        self.assertNotIn("LIMIT 12", _SparqlPagesHandler.queries[0])
+
+    def test_iter_construct_query_order_by(self):
+        query = self.query + "ORDER BY DESC(?s)"
+        output = list(Sparql(query, self.config_path).iter_construct_query(page_size=5))
+        self.assertEqual([len(page) for page in output], [25])
+        self.assertEqual(_SparqlPagesHandler.queries, [query])
+
+class Test_SparqlResults(unittest.TestCase):
+    def test_iter_bindings(self):
+        bindings = [
+            {"s": {"type": "uri", "value": f"https://github.com/arcangelo7/time_agnostic/ar/{i}"}, "o": {"type": "literal", "value": "Pèter \"Ωmega\"\n", "xml:lang": "en"}}
+            for i in range(50)] + [{"s": {"type": "bnode", "value": "b0"}}]
+        results = {"head": {"vars": ["s", "o"], "link": []}, "results": {"distinct": False, "ordered": True, "bindings": bindings}}
+        data = json.dumps(results, indent=2, ensure_ascii=False).encode("utf-8")
+        # Every chunk size splits the values and the multi-byte characters at different points
+        for chunk_size in (1, 2, 3, 7, 64, len(data)):
+            output = list(iter_bindings(io.BytesIO(data), chunk_size=chunk_size))
+            self.assertEqual(output, bindings)
+
+    def test_iter_bindings_results_first(self):
+        data = b'{"results":{"bindings":[{"n":{"type":"literal","value":"12345"}}]},"head":{"vars":["n"]}}'
+        output = list(iter_bindings(io.BytesIO(data), chunk_size=5))
+        self.assertEqual(output, [{"n": {"type": "literal", "value": "12345"}}])
+
+    def test_iter_bindings_empty(self):
+        self.assertEqual(list(iter_bindings(io.BytesIO(b'{"head":{"vars":[]},"results":{"bindings":[]}}'))), [])
+        self.assertEqual(list(iter_bindings(io.BytesIO(b'{"head":{},"boolean":true}'), chunk_size=3)), [])
+
+    def test_iter_bindings_truncated(self):
+        with self.assertRaises(ValueError):
+            list(iter_bindings(io.BytesIO(b'{"head":{"vars":["o"]},"results":{"bindings":[{"o":{"type":"literal","value":"1"}},{"o":'), chunk_size=4))
+
+class Test_SparqlFanOut(unittest.TestCase):
+    def setUp(self):
+        self.servers = [ThreadingHTTPServer(("localhost", 0), _SparqlJsonHandler) for _ in range(2)]
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.urls = [f"http://localhost:{server.server_port}/sparql" for server in self.servers]
+        # Nothing listens on the port of a closed server
+        closed_server = ThreadingHTTPServer(("localhost", 0), _SparqlJsonHandler)
+        self.unreachable_url = f"http://localhost:{closed_server.server_port}/sparql"
+        closed_server.server_close()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.tmp_dir.cleanup()
+
+    def _write_config(self, triplestore_urls:list, allow_partial_results:bool, timeout:float=10) -> str:
+        config_path = os.path.join(self.tmp_dir.name, "config.json")
+        config = {
+            "dataset": {"triplestore_urls": triplestore_urls, "file_paths": []},
+            "provenance": {"triplestore_urls": [], "file_paths": ["./test/prov.json"]},
+            "connection_pool": {"retries": 0},
+            "fan_out": {"max_workers": 4, "timeout": timeout, "allow_partial_results": allow_partial_results}
+        }
+        FileManager(config_path).dump_json(config)
+        return config_path
+
+    def test_run_select_query(self):
+        config_path = self._write_config(self.urls, False)
+        output = Sparql("SELECT ?o WHERE {?s ?p ?o}", config_path).run_select_query()
+        self.assertEqual(output, {("1",)})
+
+    def test_run_select_query_partial_results(self):
+        config_path = self._write_config(self.urls + [self.unreachable_url], True)
+        sparql = Sparql("SELECT ?o WHERE {?s ?p ?o}", config_path)
+        with self.assertWarns(RuntimeWarning):
+            output = sparql.run_select_query()
+        self.assertEqual((output, list(sparql.failed_sources)), ({("1",)}, [self.unreachable_url]))
+
+    def test_run_select_query_failure(self):
+        config_path = self._write_config(self.urls + [self.unreachable_url], False)
+        with self.assertRaises(urllib.error.URLError):
+            Sparql("SELECT ?o WHERE {?s ?p ?o}", config_path).run_select_query()
+
+    def test_run_select_query_timeout(self):
+        # The request to the slow source is abandoned at the deadline, and its socket times out soon after
+        slow_server = ThreadingHTTPServer(("localhost", 0), _SlowSparqlJsonHandler)
+        slow_server.block_on_close = False
+        threading.Thread(target=slow_server.serve_forever, daemon=True).start()
+        slow_url = f"http://localhost:{slow_server.server_port}/sparql"
+        config_path = self._write_config(self.urls + [slow_url], True, timeout=0.5)
+        sparql = Sparql("SELECT ?o WHERE {?s ?p ?o}", config_path)
+        threads = set(threading.enumerate())
+        with self.assertWarns(RuntimeWarning):
+            output = sparql.run_select_query()
+        workers = [thread for thread in threading.enumerate() if thread not in threads and thread.name.startswith("ThreadPoolExecutor")]
+        for worker in workers:
+            worker.join(2)
+        slow_server.shutdown()
+        slow_server.server_close()
+        self.assertEqual((output, list(sparql.failed_sources)), ({("1",)}, [slow_url]))
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+
+    def test_run_select_query_queued_sources(self):
+        # With two threads, the third source is queried only when one of the first two has answered, 
+        # after half the timeout: its timeout starts then
+        servers = [ThreadingHTTPServer(("localhost", 0), _QueuedSparqlJsonHandler) for _ in range(3)]
+        for server in servers:
+            server.block_on_close = False
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        config_path = os.path.join(self.tmp_dir.name, "config.json")
+        FileManager(config_path).dump_json({
+            "dataset": {"triplestore_urls": [f"http://localhost:{server.server_port}/sparql" for server in servers], "file_paths": []},
+            "provenance": {"triplestore_urls": [], "file_paths": ["./test/prov.json"]},
+            "connection_pool": {"retries": 0},
+            "fan_out": {"max_workers": 2, "timeout": 1, "allow_partial_results": False}
+        })
+        sparql = Sparql("SELECT ?o WHERE {?s ?p ?o}", config_path)
+        output = sparql.run_select_query()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual((output, sparql.failed_sources), ({("1",)}, dict()))
+
+
+class Test_GraphStore(unittest.TestCase):
+    def test_get_graph(self):
+        graph_store = GraphStore()
+        output_1 = graph_store.get_graph("./test/prov.json")
+        output_2 = graph_store.get_graph("./test/prov.json")
+        self.assertIs(output_1, output_2)
+        self.assertEqual(graph_store.triples_count, len(output_1))
+
+    def test_get_graph_modified_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "prov.json")
+            shutil.copy("./test/prov.json", file_path)
+            graph_store = GraphStore()
+            output_1 = graph_store.get_graph(file_path)
+            os.utime(file_path, (0, 0))
+            output_2 = graph_store.get_graph(file_path)
+        self.assertIsNot(output_1, output_2)
+        self.assertEqual(graph_store.triples_count, len(output_2))
+
+    def test_get_graph_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "prov.json")
+            shutil.copy("./test/prov.json", file_path)
+            graph_store = GraphStore(max_triples=1)
+            graph_store.get_graph("./test/prov.json")
+            output = graph_store.get_graph(file_path)
+        self.assertEqual(graph_store.triples_count, len(output))
+
+
+class Test_EntitySnapshots(unittest.TestCase):
+    def setUp(self):
+        graph = rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/ar/")
+        res = rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/ar/15519")
+        self.quads = [(res, rdflib.URIRef(f"http://purl.org/spar/pro/p{i}"), rdflib.Literal(i), graph) for i in range(4)]
+
+    def test_same_time(self):
+        # The second snapshot with the same time is applied on top of the first one, as if it replaced it
+        q0, q1, q2, q3 = self.quads
+        snapshots = EntitySnapshots()
+        snapshots.add_newest("2021-06-01T18:46:41", {q0, q1})
+        snapshots.add_older("2021-05-31T18:19:47", {q2}, {q1})
+        snapshots.add_older("2021-05-31T18:19:47", {q3}, {q2})
+        snapshots.add_older("2021-05-07T09:59:15", {q1}, set())
+        expected_output = {
+            "2021-06-01T18:46:41": {q0, q1},
+            "2021-05-31T18:19:47": {q0, q3},
+            "2021-05-07T09:59:15": {q0, q1, q3}}
+        self.assertEqual({time: snapshots.get_quads(time) for time in snapshots}, expected_output)
+        self.assertEqual({time: set(quads) for time, quads in snapshots.iter_quads()}, expected_output)
+
+    def test_same_time_newest(self):
+        q0, q1, q2, _ = self.quads
+        snapshots = EntitySnapshots()
+        snapshots.add_newest("2021-06-01T18:46:41", {q0, q1})
+        snapshots.add_older("2021-06-01T18:46:41", {q2}, {q1})
+        snapshots.add_older("2021-05-31T18:19:47", {q1}, set())
+        self.assertEqual(snapshots.get_quads("2021-06-01T18:46:41"), {q0, q2})
+        self.assertEqual(snapshots.get_quads("2021-05-31T18:19:47"), {q0, q1, q2})
+        self.assertEqual(list(snapshots.iter_deltas())[0], ("2021-06-01T18:46:41", frozenset({q0, q2}), frozenset()))
+
+    def test_history_read_only(self):
+        # Each access returns a new graph, whose changes are not kept, and the history cannot be assigned to
+        res = "https://github.com/arcangelo7/time_agnostic/ar/15519"
+        history = get_entities_histories({res}, config=FILES_CONFIG_PATH)[0][res]
+        time = next(iter(history))
+        graph = history[time]
+        graph.add(self.quads[0])
+        self.assertNotIn(self.quads[0], history[time])
+        self.assertIsNot(history[time], history[time])
+        with self.assertRaises(TypeError):
+            history[time] = graph
+        # A copy into a dictionary keeps the changes
+        copy = dict(history.items())
+        copy[time].add(self.quads[0])
+        self.assertIn(self.quads[0], copy[time])
+
+    def test_same_time_not_consecutive(self):
+        snapshots = EntitySnapshots()
+        snapshots.add_newest("2021-06-01T18:46:41", set())
+        snapshots.add_older("2021-05-31T18:19:47", set(), set())
+        with self.assertRaises(ValueError):
+            snapshots.add_older("2021-06-01T18:46:41", set(), set())
+
+
+class Test_HistoryCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "history_cache.db")
+        self.config_path = os.path.join(self.tmp_dir.name, "config.json")
+        config = FileManager(FILES_CONFIG_PATH).import_json()
+        config["history_cache"] = {"path": self.cache_path}
+        FileManager(self.config_path).dump_json(config)
+        self.res = "https://github.com/arcangelo7/time_agnostic/ar/15519"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_entities_histories(self):
+        input = {self.res, "https://github.com/arcangelo7/time_agnostic/ra/4"}
+        expected_output = get_entities_histories(input, include_prov_metadata=True, config=FILES_CONFIG_PATH)
+        output_1 = get_entities_histories(input, include_prov_metadata=True, config=self.config_path)
+        output_2 = get_entities_histories(input, include_prov_metadata=True, config=self.config_path)
+        self.assertEqual(len(HistoryCache(self.cache_path)), 2)
+        for output in (output_1, output_2):
+            self.assertEqual(_to_dict_of_n3_sorted_lists(output[0]), _to_dict_of_n3_sorted_lists(expected_output[0]))
+            self.assertEqual(output[1], expected_output[1])
+
+    def test_get_history(self):
+        expected_output = AgnosticEntity(self.res, config=FILES_CONFIG_PATH).get_history()
+        AgnosticEntity(self.res, config=self.config_path).get_history()
+        output = AgnosticEntity(self.res, config=self.config_path).get_history()
+        self.assertEqual(_to_dict_of_n3_sorted_lists(output[0]), AR_15519_HISTORY)
+        self.assertEqual((output[1], expected_output[1]), (None, None))
+
+    def test_get_history_uriref(self):
+        # The histories read from the cache are returned under the entities as they were passed, as the reconstructed ones
+        res = rdflib.URIRef(self.res)
+        outputs = [AgnosticEntity(res, config=self.config_path).get_history(include_prov_metadata=True) for _ in range(2)]
+        for output in outputs:
+            self.assertEqual(list(output[0]), [res])
+            self.assertEqual(list(output[1]), [res])
+        self.assertEqual(_to_dict_of_n3_sorted_lists(outputs[0][0]), _to_dict_of_n3_sorted_lists(outputs[1][0]))
+        self.assertEqual(outputs[0][1], outputs[1][1])
+
+    def test_agnostic_query(self):
+        query = """
+            SELECT ?s ?o
+            WHERE {
+                ?s <http://purl.org/spar/pro/isHeldBy> ?o.
+                ?o <http://xmlns.com/foaf/0.1/name> ?n.
+            }
+        """
+        expected_output = AgnosticQuery(query, config=FILES_CONFIG_PATH)
+        outputs = [AgnosticQuery(query, config=self.config_path) for _ in range(2)]
+        self.assertGreater(len(HistoryCache(self.cache_path)), 0)
+        for output in outputs:
+            self.assertEqual(
+                _to_dict_of_n3_sorted_lists(output.relevant_entities_graphs), 
+                _to_dict_of_n3_sorted_lists(expected_output.relevant_entities_graphs))
+            self.assertEqual(output.run_agnostic_query(), expected_output.run_agnostic_query())
+
+    def test_get(self):
+        snapshot, time = _query_latest_snapshots([self.res], FILES_CONFIG_PATH)[self.res]
+        self.assertEqual(snapshot, "https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/3")
+        history = get_entities_histories({self.res}, config=FILES_CONFIG_PATH)[0][self.res]
+        HistoryCache(self.cache_path).put(self.res, snapshot, time, history)
+        # A new instance reads what the previous one stored, as after a restart
+        cache = HistoryCache(self.cache_path)
+        output, metadata = cache.get(self.res, snapshot, time)
+        self.assertEqual(_to_dict_of_n3_sorted_lists({self.res: output}), AR_15519_HISTORY)
+        self.assertIsNone(metadata)
+        self.assertIsNone(cache.get(self.res, snapshot, time, include_prov_metadata=True))
+        self.assertIsNone(cache.get(self.res, snapshot[:-1] + "4", time))
+
+    def test_get_entities_histories_outdated(self):
+        # A history stored for the current latest snapshot is returned without reconstructing the entity,
+        # whereas one stored for another snapshot is reconstructed again
+        snapshot, time = _query_latest_snapshots([self.res], FILES_CONFIG_PATH)[self.res]
+        cached_history = EntitySnapshots()
+        cached_history.add_newest("2021-06-01T18:46:41", set())
+        cache = HistoryCache(self.cache_path)
+        cache.put(self.res, snapshot, time, cached_history)
+        output_1 = get_entities_histories({self.res}, config=self.config_path)[0][self.res]
+        cache.put(self.res, snapshot[:-1] + "2", time, cached_history)
+        output_2 = get_entities_histories({self.res}, config=self.config_path)[0][self.res]
+        self.assertEqual(list(output_1), ["2021-06-01T18:46:41"])
+        self.assertEqual(_to_dict_of_n3_sorted_lists({self.res: output_2}), AR_15519_HISTORY)
+
+    def test_get_state_at_time(self):
+        get_entities_histories({self.res}, config=self.config_path)
+        output = AgnosticEntity(self.res, config=self.config_path).get_state_at_time("2021-05-31T19:19:47+00:00")
+        expected_output = {
+            ("<https://github.com/arcangelo7/time_agnostic/ar/15519>", "<http://purl.org/spar/pro/isHeldBy>", "<https://github.com/arcangelo7/time_agnostic/ra/15519>"),
+            ("<https://github.com/arcangelo7/time_agnostic/ar/15519>", "<http://purl.org/spar/pro/withRole>", "<http://purl.org/spar/pro/author>"),
+            ("<https://github.com/arcangelo7/time_agnostic/ar/15519>", "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>", "<http://purl.org/spar/pro/RoleInTime>"),
+            ("<https://github.com/arcangelo7/time_agnostic/ar/15519>", "<https://w3id.org/oc/ontology/hasNext>", "<https://github.com/arcangelo7/time_agnostic/ar/15520>")}
+        self.assertEqual({(s.n3(), p.n3(), o.n3()) for s, p, o in output[0]}, expected_output)
+        self.assertEqual(list(output[1]), ["https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/2"])
+
+    def test_get_state_at_time_cached(self):
+        # The state is read from the cached history, without undoing any update query
+        snapshot, time = _query_latest_snapshots([self.res], FILES_CONFIG_PATH)[self.res]
+        quad = (rdflib.URIRef(self.res), rdflib.RDF.type, rdflib.URIRef("http://purl.org/spar/pro/RoleInTime"), rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/ar/"))
+        cached_history = EntitySnapshots()
+        cached_history.add_newest("2021-06-01T18:46:41", set())
+        cached_history.add_older("2021-05-31T18:19:47", {quad}, set())
+        HistoryCache(self.cache_path).put(self.res, snapshot, time, cached_history)
+        output = AgnosticEntity(self.res, config=self.config_path).get_state_at_time("2021-06-01T00:00:00")
+        self.assertEqual(list(output[0].quads()), [quad[:3] + (output[0].get_context(quad[3]),)])
+
+
+
+class Test_SnapshotCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoints_path = os.path.join(self.tmp_dir.name, "checkpoints.db")
+        self.config_path = os.path.join(self.tmp_dir.name, "config.json")
+        config = FileManager(FILES_CONFIG_PATH).import_json()
+        config["checkpoints"] = {"path": self.checkpoints_path, "interval": 1}
+        FileManager(self.config_path).dump_json(config)
+        self.res = "https://github.com/arcangelo7/time_agnostic/ar/15519"
+        self.expected_state = {
+            ("<https://github.com/arcangelo7/time_agnostic/ar/15519>", "<http://purl.org/spar/pro/isHeldBy>", "<https://github.com/arcangelo7/time_agnostic/ra/15519>"),
+            ("<https://github.com/arcangelo7/time_agnostic/ar/15519>", "<http://purl.org/spar/pro/withRole>", "<http://purl.org/spar/pro/author>"),
+            ("<https://github.com/arcangelo7/time_agnostic/ar/15519>", "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>", "<http://purl.org/spar/pro/RoleInTime>"),
+            ("<https://github.com/arcangelo7/time_agnostic/ar/15519>", "<https://w3id.org/oc/ontology/hasNext>", "<https://github.com/arcangelo7/time_agnostic/ar/15520>")}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_entities_histories(self):
+        output = get_entities_histories({self.res}, config=self.config_path)
+        checkpoints = SnapshotCheckpoints(self.checkpoints_path)
+        # The latest snapshot is the present state, which is not stored
+        self.assertEqual(checkpoints.get_snapshots(self.res), {
+            "https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/1", "https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/2"})
+        self.assertEqual(_to_dict_of_n3_sorted_lists(output[0]), AR_15519_HISTORY)
+        stored_state = checkpoints.get(self.res, "https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/2")
+        self.assertEqual({(s.n3(), p.n3(), o.n3()) for s, p, o, _ in stored_state}, self.expected_state)
+
+    def test_get_state_at_time(self):
+        get_entities_histories({self.res}, config=self.config_path)
+        output = AgnosticEntity(self.res, config=self.config_path).get_state_at_time("2021-05-31T19:19:47+00:00")
+        self.assertEqual({(s.n3(), p.n3(), o.n3()) for s, p, o in output[0]}, self.expected_state)
+
+    def test_get_state_at_time_forward(self):
+        # The update query of the second snapshot is replayed on the checkpoint of the first one
+        history = get_entities_histories({self.res}, config=FILES_CONFIG_PATH)[0][self.res]
+        quad = (rdflib.URIRef(self.res), rdflib.RDFS.label, rdflib.Literal("checkpoint"), rdflib.URIRef("https://github.com/arcangelo7/time_agnostic/ar/"))
+        SnapshotCheckpoints(self.checkpoints_path).put_many(self.res, [
+            ("https://github.com/arcangelo7/time_agnostic/ar/15519/prov/se/1", history.get_quads("2021-05-07T09:59:15") | {quad})])
+        output = AgnosticEntity(self.res, config=self.config_path).get_state_at_time("2021-05-31T19:19:47+00:00")
+        self.assertEqual({(s.n3(), p.n3(), o.n3()) for s, p, o in output[0]}, self.expected_state | {tuple(term.n3() for term in quad[:3])})
+
+    def test_is_checkpoint(self):
+        checkpoints = SnapshotCheckpoints(self.checkpoints_path, interval=3)
+        self.assertEqual([index for index in range(10) if checkpoints.is_checkpoint(index)], [0, 3, 6, 9])
+        with self.assertRaises(ValueError):
+            SnapshotCheckpoints(self.checkpoints_path, interval=0)
+
+class Test_TabInterface(unittest.TestCase):
+    query = Test_AgnosticQueryFiles.query
+    entity = "https://github.com/arcangelo7/time_agnostic/ar/15519"
+
+    def setUp(self):
+        # The queries run on the files of the tests, with a real AgnosticQuery, since they contain no full-text search
+        self.sources_config_path = tab_interface.SOURCES_CONFIG_PATH
+        self.blazegraph_query = tab_interface.BlazegraphQuery
+        self.query_jobs = tab_interface.query_jobs
+        tab_interface.SOURCES_CONFIG_PATH = FILES_CONFIG_PATH
+        tab_interface.BlazegraphQuery = AgnosticQuery
+        tab_interface.query_jobs = tab_interface.QueryJobs(workers=1)
+        self.client = tab_interface.app.test_client()
+
+    def tearDown(self):
+        tab_interface.query_jobs._executor.shutdown()
+        tab_interface.SOURCES_CONFIG_PATH = self.sources_config_path
+        tab_interface.BlazegraphQuery = self.blazegraph_query
+        tab_interface.query_jobs = self.query_jobs
+
+    def _wait(self, location:str) -> dict:
+        deadline = time.monotonic() + 60
+        while True:
+            status = self.client.get(location)
+            self.assertEqual(status.status_code, 200)
+            if status.json["status"] not in {"queued", "running"} or time.monotonic() > deadline:
+                return status.json
+            time.sleep(0.05)
+
+    def test_query(self):
+        response = self.client.post("/query", data={"query": self.query})
+        self.assertEqual(response.status_code, 202)
+        location = response.headers["Location"]
+        self.assertEqual(location, f"/query/{response.json['job_id']}")
+        self.assertIn(response.json["status"], {"queued", "running", "done"})
+        status = self._wait(location)
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["results"], 3)
+        self.assertEqual(status["progress"]["done"], status["progress"]["total"])
+        self.assertEqual(self.client.get("/query/unknown").status_code, 404)
+        self.assertEqual(self.client.post("/query", data={}).status_code, 400)
+
+    def test_query_dedup(self):
+        # The only worker is kept busy, so that the jobs are still queued when the same query is submitted again
+        busy = threading.Event()
+        tab_interface.query_jobs._executor.submit(busy.wait, 60)
+        try:
+            job_id_1 = self.client.post("/query", data={"query": self.query}).json["job_id"]
+            job_id_2 = self.client.post("/query", data={"query": " ".join(self.query.split())}).json["job_id"]
+            job_id_3 = self.client.post("/query", data={"query": self.query, "max_results": 1}).json["job_id"]
+            self.assertEqual(self.client.get(f"/query/{job_id_1}").json["status"], "queued")
+        finally:
+            busy.set()
+        self.assertEqual(job_id_1, job_id_2)
+        self.assertNotEqual(job_id_1, job_id_3)
+        self.assertEqual(self._wait(f"/query/{job_id_1}")["status"], "done")
+        self.assertEqual(self._wait(f"/query/{job_id_3}")["status"], "done")
+        # Once the job is over, the same query is executed again
+        job_id_4 = self.client.post("/query", data={"query": self.query}).json["job_id"]
+        self.assertNotEqual(job_id_1, job_id_4)
+
+    def test_query_results(self):
+        location = self.client.post("/query", data={"query": self.query}).headers["Location"]
+        self._wait(location)
+        expected_rows = [
+            ("07 May 2021, 09:59:15", "https://github.com/arcangelo7/time_agnostic/ra/15519"),
+            ("31 May 2021, 18:19:47", "https://github.com/arcangelo7/time_agnostic/ra/15519"),
+            ("01 June 2021, 18:46:41", "https://github.com/arcangelo7/time_agnostic/ra/4")]
+        rows = self.client.get(f"{location}/results").json
+        self.assertEqual(rows, {"response": [{time: [{"s": self.entity, "o": o}]} for time, o in expected_rows]})
+        columnar = self.client.get(f"{location}/results?format=columnar").json
+        self.assertEqual(columnar, {"variables": ["s", "o"], "response": [{time: [[self.entity, o]]} for time, o in expected_rows]})
+        self.assertEqual(self.client.get(f"{location}/results?format=xml").status_code, 400)
+
+    def test_stream_query_results(self):
+        snapshots = ["2021-05-07T09:59:15", "2021-06-01T18:46:41"]
+        # The results are grouped by snapshot whatever their order, and those of other snapshots are left out
+        results = [("2021-06-01T18:46:41", ("b",)), ("2021-05-31T18:19:47", ("c",)), ("2021-05-07T09:59:15", ("a",))]
+        rows = json.loads("".join(tab_interface.stream_query_results(snapshots, ["x"], results)))
+        columnar = json.loads("".join(tab_interface.stream_query_results(snapshots, ["x"], results, tab_interface.COLUMNAR)))
+        self.assertEqual(rows, {"response": [{"07 May 2021, 09:59:15": [{"x": "a"}]}, {"01 June 2021, 18:46:41": [{"x": "b"}]}]})
+        self.assertEqual(columnar, {"variables": ["x"], "response": [{"07 May 2021, 09:59:15": [["a"]]}, {"01 June 2021, 18:46:41": [["b"]]}]})
+
+    def test_entity_not_modified(self):
+        response = self.client.get(f"/entity/{self.entity}")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        response = self.client.get(f"/entity/{self.entity}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.data, b"")
+        response = self.client.get(f"/entity/{self.entity}", headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, 200)
+
+
 if __name__ == '__main__':
     unittest.main()
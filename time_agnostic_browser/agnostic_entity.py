@@ -15,19 +15,34 @@
 # SOFTWARE.
 
 from pprint import pprint
-from typing import List, Tuple, Dict, Set
+from typing import List, Optional, Tuple, Dict, Set, Union
 from datetime import datetime
 from rdflib.graph import ConjunctiveGraph
 from rdflib.term import URIRef
-import copy
 import re
-from rdflib.plugins.sparql.processor import processUpdate
-from dateutil import parser
+from concurrent.futures import ThreadPoolExecutor
 
 from time_agnostic_browser.sparql import Sparql
 from time_agnostic_browser.prov_entity import ProvEntity
+from time_agnostic_browser.config import Config, CONFIG_PATH
+from time_agnostic_browser.entity_snapshots import EntitySnapshots, Quad, get_quads, to_conjunctive_graph
+from time_agnostic_browser.history_cache import get_history_cache
+from time_agnostic_browser.snapshot_checkpoints import get_snapshot_checkpoints
+from time_agnostic_browser.update_query import apply_update_query, invert_update_query
+from time_agnostic_browser.prepared_query import process_update
+from time_agnostic_browser.support import convert_to_datetime, convert_to_timestamp
 
 
+BATCH_SIZE = 100
+# The provenance triples are removed from the graphs of the snapshots
+PROV_PROPERTIES_TO_REMOVE = [
+    ProvEntity.iri_generated_at_time, 
+    ProvEntity.iri_was_attributed_to, 
+    ProvEntity.iri_had_primary_source, 
+    ProvEntity.iri_has_update_query, 
+    ProvEntity.iri_description
+]
+
 class AgnosticEntity:
     """
     An entity you want to obtain information about.
@@ -38,13 +53,16 @@ class AgnosticEntity:
     :type res: str.
     :param related_entities_history: True if you also want to return information on related entities, that is, the ones that have the URI of the res parameter as object, False otherwise. The default is False. 
     :type related_entities_history: bool.
+    :param config: The path to the configuration file or the Config parsed from it. The default is "./config.json".
+    :type config: Union[str, Config].
     """
 
-    def __init__(self, res: str, related_entities_history: bool = False):
+    def __init__(self, res: str, related_entities_history: bool = False, config: Union[str, Config] = CONFIG_PATH):
         self.res = res
         self.related_entities_history = related_entities_history
+        self.config = Config.load(config)
 
-    def get_history(self, include_prov_metadata:bool=False) -> Tuple[Dict[str, Dict[str, ConjunctiveGraph]], Dict]:
+    def get_history(self, include_prov_metadata:bool=False) -> Tuple[Dict[str, EntitySnapshots], Dict]:
         """
         Given the URI of a resource, it reconstructs its entire history, 
         returning a dictionary according to the following model: ::
@@ -63,8 +81,17 @@ class AgnosticEntity:
         If the object of type AgnosticEntity has been instantiated by passing the 
         related_entities_history parameter as True, the graph also contains the related entities, 
         that is, those that have the entity as an object.
+        If the "history_cache" section of the configuration file is set, the histories are 
+        read from and saved to a persistent cache, see :func:`get_entities_histories`.
+        If the "checkpoints" section is set, the graphs at every "interval" snapshots are stored as checkpoints 
+        while the history is reconstructed, for :meth:`get_state_at_time` to start from them.
+
+        The history of each entity is an :class:`time_agnostic_browser.entity_snapshots.EntitySnapshots`, 
+        a read-only mapping from the snapshot times to the graphs. Each access to a graph returns a new ConjunctiveGraph: 
+        the changes made to it are not kept in the history. To get graphs that can be modified, 
+        copy the history into a dictionary, for example with dict(history[entity].items()), which materialises each graph once.
 
-        :returns:  Dict[str, Dict[str, ConjunctiveGraph]] -- A dictionary containing the graphs related to each considered entities in each of the existing snapshots of these entities.
+        :returns:  Tuple[Dict[str, EntitySnapshots], Dict] -- The history of each considered entity, that is, its graph at each of its snapshots, and the provenance metadata, if requested.
         """
         if self.related_entities_history:
             entities_to_query = {self.res}
@@ -74,7 +101,11 @@ class AgnosticEntity:
             for entity in related_entities:
                 if ProvEntity.PROV not in entity[1]:
                     entities_to_query.add(str(entity[0]))
-            return get_entities_histories(entities_to_query, include_prov_metadata)
+            return get_entities_histories(entities_to_query, include_prov_metadata, self.config)
+        history_cache = get_history_cache(self.config.get("history_cache"))
+        if history_cache is not None:
+            entity_history, prov_metadata = get_entities_histories({self.res}, include_prov_metadata, self.config)
+            return entity_history, prov_metadata if include_prov_metadata else None
         entity_history = self._get_entity_current_state(include_prov_metadata)
         entity_history = self._get_old_graphs(entity_history)
         return tuple(entity_history)
@@ -90,6 +121,13 @@ class AgnosticEntity:
         Snapshot metadata includes generation time, the responsible agent and the primary source.
         The specified time can be any time, not necessarily the exact time of a snapshot. 
         In addition, it can be specified in any existing standard. 
+        The provenance and the present state of the entity are fetched concurrently, 
+        and the update queries of the snapshots following the time are undone one snapshot at a time. 
+        If the "history_cache" section of the configuration file is set and the history of the entity is cached 
+        and still valid, the state is read from it and no update query is undone.
+        Otherwise, if the "checkpoints" section is set, the state is rebuilt from the nearest checkpoint, 
+        when it is nearer than the present state, replaying forward or undoing only the update queries in between, 
+        see :class:`time_agnostic_browser.snapshot_checkpoints.SnapshotCheckpoints`.
         Here is an example of possible output: ::
 
             (
@@ -121,7 +159,6 @@ class AgnosticEntity:
         :type include_prov_metadata: bool.
         :returns: tuple --   The method always returns a tuple of three elements: the first is the resource conjunctive graph at that time, the second is the snapshot metadata of which the state has been returned. If the include_prov_metadata parameter is True, the third element of the tuple is the metadata on the other snapshots, otherwise an empty dictionary. The third dictionary is empty also if only one snapshot exists.
         """
-        datetime_time = self._convert_to_datetime(time)
         query_snapshots = f"""
             SELECT ?snapshot ?time ?responsibleAgent ?updateQuery ?primarySource
             WHERE {{
@@ -136,20 +173,26 @@ class AgnosticEntity:
                 }}
             }}
         """
-        results = list(Sparql(query_snapshots).run_select_query())
-        results.sort(key=lambda x:self._convert_to_datetime(x[1]), reverse=True)
-        results_after_time = list()
-        for result in results:
-            if self._convert_to_datetime(result[1]) > datetime_time:
-                results_after_time.append(result)
-        sum_update_queries = ""
-        for result in results_after_time:
-            if result[3] is not None:
-                sum_update_queries += result[3] + ";"
-        entity_cg = self._query_dataset()
-        self._manage_update_queries(entity_cg, sum_update_queries)
+        # The provenance and the present state are fetched concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results_future = executor.submit(Sparql(query_snapshots, self.config).run_select_query)
+            dataset_future = executor.submit(self._query_dataset)
+            results = list(results_future.result())
+            results.sort(key=lambda x:convert_to_timestamp(x[1]), reverse=True)
+            timestamp = convert_to_timestamp(time)
+            entity_cg = self._get_cached_state(results, timestamp)
+            if entity_cg is None:
+                entity_cg = self._get_checkpoint_state(results, timestamp)
+            if entity_cg is None:
+                entity_cg = dataset_future.result()
+                # The update queries of the snapshots following the time are undone one at a time, from the most recent
+                for result in results:
+                    if convert_to_timestamp(result[1]) <= timestamp:
+                        break
+                    if result[3] is not None:
+                        self._manage_update_queries(entity_cg, result[3])
         entity_snapshot = dict()
-        snapshot_to_return = min(results, key=lambda x:abs(self._convert_to_datetime(x[1])-datetime_time))
+        snapshot_to_return = min(results, key=lambda x:abs(convert_to_timestamp(x[1])-timestamp))
         entity_snapshot[snapshot_to_return[0]] = {
             str(ProvEntity.iri_generated_at_time): snapshot_to_return[1],
             str(ProvEntity.iri_was_attributed_to): snapshot_to_return[2],
@@ -167,6 +210,25 @@ class AgnosticEntity:
             return entity_cg, entity_snapshot, other_snapshots
         return entity_cg, entity_snapshot, None
     
+    def _get_cached_state(self, results:List[Tuple], timestamp:int) -> Optional[ConjunctiveGraph]:
+        # The state as of a time is read from the history in the history cache, if any, 
+        # provided that the history is still valid, that is, its latest snapshot is still the latest one.
+        # Results are the snapshots of the entity, sorted from the most recent.
+        history_cache = get_history_cache(self.config.get("history_cache"))
+        if history_cache is None or self.related_entities_history or not results:
+            return None
+        latest_snapshot = max(results, key=lambda x:(convert_to_timestamp(x[1]), x[0]))
+        cached_history = history_cache.get(self.res, latest_snapshot[0], latest_snapshot[1])
+        if cached_history is None:
+            return None
+        snapshots_before_time = [result for result in results if convert_to_timestamp(result[1]) <= timestamp]
+        if not snapshots_before_time:
+            return None
+        snapshot_key = self._get_snapshot_key(snapshots_before_time[0][1])
+        if snapshot_key not in cached_history[0]:
+            return None
+        return cached_history[0][snapshot_key]
+
     def _include_prov_metadata(self, triples_generated_at_time:list, current_state:ConjunctiveGraph) -> dict:
         prov_metadata = {
             self.res: dict()
@@ -207,25 +269,27 @@ class AgnosticEntity:
             }
         }        
         """
-        entity_current_state = [{self.res: dict()}]
         current_state = ConjunctiveGraph()
         for quad in self._query_dataset().quads():
             current_state.add(quad)
         for quad in self._query_provenance(include_prov_metadata).quads():
             current_state.add(quad)
+        return self._build_entity_current_state(current_state, include_prov_metadata)
+
+    def _build_entity_current_state(self, current_state:ConjunctiveGraph, include_prov_metadata:bool=False) -> list:
+        entity_current_state = [{self.res: dict()}]
         if len(current_state) == 0:
             return entity_current_state
         triples_generated_at_time = list(current_state.triples(
             (None, ProvEntity.iri_generated_at_time, None)))
         most_recent_time = None
+        most_recent_timestamp = None
         for triple in triples_generated_at_time:
             snapshot_time = triple[2]
-            snapshot_date_time = self._convert_to_datetime(snapshot_time)
-            if most_recent_time:
-                if snapshot_date_time > self._convert_to_datetime(most_recent_time):
-                    most_recent_time = snapshot_time
-            elif not most_recent_time:
+            snapshot_timestamp = convert_to_timestamp(snapshot_time)
+            if most_recent_timestamp is None or snapshot_timestamp > most_recent_timestamp:
                 most_recent_time = snapshot_time
+                most_recent_timestamp = snapshot_timestamp
             entity_current_state[0][self.res][snapshot_time] = None
         entity_current_state[0][self.res][most_recent_time] = current_state
         if include_prov_metadata:
@@ -238,46 +302,112 @@ class AgnosticEntity:
     def _get_old_graphs(self, entity_current_state:List[Dict[str, Dict[str, ConjunctiveGraph]]]) -> list:
         """
         Given as input the output of _get_entity_current_state, it populates the graphs 
-        relating to the past snapshots of the resource.        
+        relating to the past snapshots of the resource.
+        The update queries are undone one after the other on a single graph, from the present to the past, 
+        and only the triples added and removed by each of them are kept, 
+        so that the graphs of the snapshots are returned as an EntitySnapshots.
         """
-        ordered_data: List[Tuple[str, ConjunctiveGraph]] = sorted(
-            entity_current_state[0][self.res].items(),
-            key=lambda x: self._convert_to_datetime(x[0]),
+        snapshots = entity_current_state[0][self.res]
+        ordered_times: List[str] = sorted(
+            snapshots,
+            key=convert_to_timestamp,
             reverse=True
         )
-        for index, date_graph in enumerate(ordered_data):
-            if index > 0:
-                next_snapshot = ordered_data[index-1][0]
-                previous_graph: ConjunctiveGraph = copy.deepcopy(
-                    entity_current_state[0][self.res][next_snapshot])
-                snapshot_uri = list(
-                    previous_graph.subjects(object=next_snapshot))[0]
-                snapshot_update_query: str = previous_graph.value(
-                    subject=snapshot_uri,
+        entity_snapshots = EntitySnapshots()
+        if ordered_times:
+            graph: ConjunctiveGraph = snapshots[ordered_times[0]]
+            snapshot_uris: Dict[str, URIRef] = {time: list(graph.subjects(object=time))[0] for time in ordered_times}
+            update_queries: Dict[str, str] = dict()
+            for time in ordered_times[:-1]:
+                update_queries[time] = graph.value(
+                    subject=snapshot_uris[time],
                     predicate=ProvEntity.iri_has_update_query,
                     object=None)
+            for prov_property in PROV_PROPERTIES_TO_REMOVE:
+                graph.remove((None, prov_property, None))
+            entity_snapshots.add_newest(self._get_snapshot_key(ordered_times[0]), get_quads(graph))
+            for index in range(1, len(ordered_times)):
+                snapshot_update_query = update_queries[ordered_times[index-1]]
                 # TODO: To be improved
                 if snapshot_update_query is None:
-                    entity_current_state[0][self.res][date_graph[0]
-                                                   ] = previous_graph
+                    added = removed = set()
                 else:
-                    self._manage_update_queries(
-                        previous_graph, snapshot_update_query)
-                    entity_current_state[0][self.res][date_graph[0]
-                                                   ] = previous_graph
-        for time in list(entity_current_state[0][self.res]):
-            cg_no_pro = entity_current_state[0][self.res].pop(time)
-            cg_no_pro.remove((None, ProvEntity.iri_generated_at_time, None))
-            cg_no_pro.remove((None, ProvEntity.iri_was_attributed_to, None))
-            cg_no_pro.remove((None, ProvEntity.iri_had_primary_source, None))
-            cg_no_pro.remove((None, ProvEntity.iri_has_update_query, None))
-            cg_no_pro.remove((None, ProvEntity.iri_description, None))
-            time_no_tz = self._convert_to_datetime(time)
-            entity_current_state[0][self.res][time_no_tz.strftime("%Y-%m-%dT%H:%M:%S")] = cg_no_pro
+                    added, removed = self._manage_update_queries(graph, snapshot_update_query)
+                entity_snapshots.add_older(self._get_snapshot_key(ordered_times[index]), added, removed)
+            self._save_checkpoints(entity_snapshots, [(self._get_snapshot_key(time), snapshot_uris[time]) for time in reversed(ordered_times)])
+        entity_current_state[0][self.res] = entity_snapshots
         return entity_current_state
 
+    def _save_checkpoints(self, entity_snapshots:EntitySnapshots, snapshots:List[Tuple[str, URIRef]]) -> None:
+        # The graphs at every interval snapshots, from the oldest, are stored as checkpoints, if they are enabled. 
+        # The latest snapshot is not, since its graph is the present state of the entity.
+        # Snapshots are the key and the IRI of each snapshot, from the oldest.
+        checkpoints = get_snapshot_checkpoints(self.config.get("checkpoints"))
+        if checkpoints is None or self.related_entities_history:
+            return
+        stored_snapshots = checkpoints.get_snapshots(self.res)
+        snapshots_to_store = {
+            key: str(snapshot) for index, (key, snapshot) in enumerate(snapshots[:-1])
+            if checkpoints.is_checkpoint(index) and str(snapshot) not in stored_snapshots}
+        if snapshots_to_store:
+            checkpoints.put_many(self.res, [
+                (snapshots_to_store[key], set(quads)) for key, quads in entity_snapshots.iter_quads() if key in snapshots_to_store])
+
+    def _get_checkpoint_state(self, results:List[Tuple], timestamp:int) -> Optional[ConjunctiveGraph]:
+        # The state as of a time is obtained from the nearest checkpoint, if any is nearer than the present, 
+        # replaying the update queries forward from an earlier checkpoint or undoing them from a later one.
+        # Results are the snapshots of the entity, sorted from the most recent.
+        checkpoints = get_snapshot_checkpoints(self.config.get("checkpoints"))
+        if checkpoints is None or self.related_entities_history:
+            return None
+        stored_snapshots = checkpoints.get_snapshots(self.res)
+        snapshots = list(reversed(results))
+        # The target is the most recent snapshot not following the time
+        target = sum(1 for result in snapshots if convert_to_timestamp(result[1]) <= timestamp) - 1
+        candidates = [index for index, result in enumerate(snapshots) if result[0] in stored_snapshots]
+        if target < 0 or not candidates:
+            return None
+        nearest = min(candidates, key=lambda index:abs(index - target))
+        if abs(nearest - target) > len(snapshots) - 1 - target:
+            return None
+        quads = checkpoints.get(self.res, snapshots[nearest][0])
+        if nearest <= target:
+            try:
+                for result in snapshots[nearest+1:target+1]:
+                    if result[3] is not None:
+                        apply_update_query(quads, result[3])
+            except ValueError:
+                return None
+            return to_conjunctive_graph(quads)
+        graph = to_conjunctive_graph(quads)
+        for result in reversed(snapshots[target+1:nearest+1]):
+            if result[3] is not None:
+                self._manage_update_queries(graph, result[3])
+        return graph
+
+    @classmethod
+    def _get_snapshot_key(cls, time:str) -> str:
+        time_no_tz = cls._convert_to_datetime(time)
+        return time_no_tz.strftime("%Y-%m-%dT%H:%M:%S")
+
     @classmethod
-    def _manage_update_queries(cls, graph: ConjunctiveGraph, update_query: str) -> None:
+    def _manage_update_queries(cls, graph: ConjunctiveGraph, update_query: str) -> Tuple[Set[Quad], Set[Quad]]:
+        """
+        It undoes an update query on a graph, in place, 
+        and returns the quads added to the graph and the quads removed from it.
+        Queries made of INSERT DATA and DELETE DATA operations, which are the ones found in the provenance, 
+        are parsed and undone in a single pass. Any other query is undone by rdflib.
+        """
+        try:
+            return invert_update_query(graph, update_query)
+        except ValueError:
+            quads = get_quads(graph)
+            cls._process_inverted_update_query(graph, update_query)
+            previous_quads = get_quads(graph)
+            return previous_quads - quads, quads - previous_quads
+
+    @classmethod
+    def _process_inverted_update_query(cls, graph: ConjunctiveGraph, update_query: str) -> None:
         update_query = update_query.replace("INSERT", "%temp%").replace("DELETE", "INSERT").replace("%temp%", "DELETE")
         triples_end_pattern = r">\s*\."
         operations_pattern = r"((?:DELETE|INSERT)\s(?:DATA)\s?{\s?(?:GRAPH)\s?<[\w\W]+?>\s{)"
@@ -300,14 +430,14 @@ class AgnosticEntity:
                     while len(matches_no_operation) > 0:
                         cut_update_query = operation + "> .".join(matches_no_operation[:90]) + "> .} }"
                         try:
-                            processUpdate(graph, cut_update_query)
+                            process_update(graph, cut_update_query)
                         except Exception:
                             print(update_query)
                         matches_no_operation = matches_no_operation[90:]
                 else:
-                    processUpdate(graph, operation_and_query)      
+                    process_update(graph, operation_and_query)      
         else:
-            processUpdate(graph, update_query)
+            process_update(graph, update_query)
 
     def _query_dataset(self) -> ConjunctiveGraph:
         # A SELECT hack can be used to return RDF quads in named graphs,
@@ -340,7 +470,7 @@ class AgnosticEntity:
                     BIND (<{self.res}> AS ?s) 
                 }}   
             """
-        return Sparql(query_dataset).run_construct_query()
+        return Sparql(query_dataset, self.config).run_construct_query()
 
     def _query_provenance(self, include_prov_metadata:bool=False) -> ConjunctiveGraph:
         if include_prov_metadata:
@@ -379,20 +509,14 @@ class AgnosticEntity:
                     }}   
                 }}
             """
-        return Sparql(query_provenance).run_construct_query()
+        return Sparql(query_provenance, self.config).run_construct_query()
 
     @classmethod
     def _convert_to_datetime(cls, time_string: str) -> datetime:
-        # date_patterns = ["%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z"]
-        # for pattern in date_patterns:
-        #     try:
-        #         return datetime.strptime(time_string, pattern)
-        #     except:
-        #         pass
-        return parser.parse(time_string).replace(tzinfo=None)
+        return convert_to_datetime(time_string)
 
 
-def get_entities_histories(res_set: Set[str], include_prov_metadata:bool=False) -> Tuple[Dict[str, Dict[str, ConjunctiveGraph]], Dict]:
+def get_entities_histories(res_set: Set[str], include_prov_metadata:bool=False, config:Union[str, Config]=CONFIG_PATH) -> Tuple[Dict[str, EntitySnapshots], Dict]:
     """
     Given a set of entities URIs it returns the history of those entities. 
     You can also specify via the related_entities_history parameter
@@ -417,20 +541,146 @@ def get_entities_histories(res_set: Set[str], include_prov_metadata:bool=False)
             }
         }
 
+    The entities are processed in batches, whose size is given by "batch_size" in the "reconstruction" section 
+    of the configuration file and is 100 by default. The present state and the provenance of all the entities 
+    in a batch are fetched with one query each, and then each entity is reconstructed locally.
+
+    The reconstructed histories can be kept in a persistent cache, which survives the restarts of the process, 
+    by setting the path of its database in the "history_cache" section of the configuration file: ::
+
+        "history_cache": {
+            "path": "./history_cache.db"
+        }
+
+    In that case, the latest snapshot of each entity in a batch is looked up first, with a single query, 
+    and the entities whose latest snapshot is the same as when their history was cached are not reconstructed again, 
+    see :class:`time_agnostic_browser.history_cache.HistoryCache`.
+
     :param res_set: A set of the entities URI you want to retrieve the history about.
     :type res_set: set.
     :param related_entities_history: True if you also want to return information on related entities, that is, the ones that have the URIs in the res_set parameter as object, False otherwise. The default is False. 
     :type related_entities_history: bool.
-    :returns:  Dict[str, Dict[str, ConjunctiveGraph]] -- A dictionary containing the graphs related to each considered entities in each of the existing snapshots of these entities.
+    :param config: The path to the configuration file or the Config parsed from it. The default is "./config.json".
+    :type config: Union[str, Config].
+    :returns:  Tuple[Dict[str, EntitySnapshots], Dict] -- The history of each entity, as a read-only mapping from the snapshot times to the graphs, see :meth:`AgnosticEntity.get_history`, and the provenance metadata, if requested.
     """
+    config = Config.load(config)
+    batch_size = config.get("reconstruction", dict()).get("batch_size", BATCH_SIZE)
+    history_cache = get_history_cache(config.get("history_cache"))
     entities_histories = [dict(), dict()]
-    for res in res_set:
-        agnosticEntity = AgnosticEntity(res, related_entities_history=False)
-        history_and_metadata = agnosticEntity.get_history(include_prov_metadata=include_prov_metadata)
-        if history_and_metadata:
-            history = history_and_metadata[0]
-            entities_histories[0].update(history)
-        if include_prov_metadata:
-            metadata = history_and_metadata[1]
-            entities_histories[1].update(metadata)
+    res_list = list(res_set)
+    for i in range(0, len(res_list), batch_size):
+        batch = res_list[i:i+batch_size]
+        latest_snapshots = dict()
+        if history_cache is not None:
+            latest_snapshots = _query_latest_snapshots(batch, config)
+            cached_histories = history_cache.get_many(latest_snapshots, include_prov_metadata)
+            # The cache is keyed by strings: the histories are returned under the entities as they were passed
+            entities = {str(res): res for res in batch}
+            for entity, (history, metadata) in cached_histories.items():
+                entities_histories[0][entities[entity]] = history
+                if include_prov_metadata:
+                    entities_histories[1].update({entities.get(key, key): value for key, value in metadata.items()})
+            batch = [res for res in batch if str(res) not in cached_histories]
+            if not batch:
+                continue
+        current_states = _query_current_states(batch, include_prov_metadata, config)
+        for res in batch:
+            agnosticEntity = AgnosticEntity(res, related_entities_history=False, config=config)
+            current_state = current_states.get(str(res), ConjunctiveGraph())
+            entity_current_state = agnosticEntity._build_entity_current_state(current_state, include_prov_metadata)
+            history_and_metadata = tuple(agnosticEntity._get_old_graphs(entity_current_state))
+            if history_and_metadata:
+                history = history_and_metadata[0]
+                entities_histories[0].update(history)
+            if include_prov_metadata and len(history_and_metadata) > 1:
+                metadata = history_and_metadata[1]
+                entities_histories[1].update(metadata)
+            if str(res) in latest_snapshots and len(history_and_metadata) > 1:
+                snapshot, time = latest_snapshots[str(res)]
+                history_cache.put(res, snapshot, time, history[res], metadata if include_prov_metadata else None)
     return tuple(entities_histories)
+
+def _query_latest_snapshots(res_list: List[str], config:Config) -> Dict[str, Tuple[str, str]]:
+    # Only the IRI and the generation time of the snapshots are fetched, which is enough
+    # to tell whether the history of an entity has changed since it was cached
+    values = " ".join(f"<{res}>" for res in res_list)
+    query_snapshots = f"""
+        SELECT ?entity ?snapshot ?time
+        WHERE {{
+            VALUES ?entity {{{values}}}
+            ?snapshot <{ProvEntity.iri_specialization_of}> ?entity;
+                      <{ProvEntity.iri_generated_at_time}> ?time.
+        }}
+    """
+    latest_snapshots:Dict[str, Tuple[str, str]] = dict()
+    latest_keys:Dict[str, Tuple[int, str]] = dict()
+    for entity, snapshot, time in Sparql(query_snapshots, config).run_select_query():
+        key = (convert_to_timestamp(time), snapshot)
+        if entity not in latest_keys or key > latest_keys[entity]:
+            latest_keys[entity] = key
+            latest_snapshots[entity] = (snapshot, time)
+    return latest_snapshots
+
+def _query_current_states(res_list: List[str], include_prov_metadata:bool, config:Config) -> Dict[str, ConjunctiveGraph]:
+    # The present state and the provenance of a batch of entities are fetched with two queries in all,
+    # binding the entities with VALUES, and then split by entity.
+    # It is the same as calling _query_dataset and _query_provenance on each entity.
+    values = " ".join(f"<{res}>" for res in res_list)
+    query_dataset = f"""
+        SELECT DISTINCT ?s ?p ?o ?c
+        WHERE {{
+            VALUES ?s {{{values}}}
+            GRAPH ?c {{?s ?p ?o}}
+        }}
+    """
+    if include_prov_metadata:
+        query_provenance = f"""
+            CONSTRUCT {{
+                ?snapshot <{ProvEntity.iri_specialization_of}> ?entity;
+                          <{ProvEntity.iri_generated_at_time}> ?t; 
+                          <{ProvEntity.iri_was_attributed_to}> ?responsibleAgent;
+                          <{ProvEntity.iri_had_primary_source}> ?source;
+                          <{ProvEntity.iri_description}> ?description;
+                          <{ProvEntity.iri_has_update_query}> ?updateQuery.
+            }} 
+            WHERE {{
+                VALUES ?entity {{{values}}}
+                ?snapshot <{ProvEntity.iri_specialization_of}> ?entity;
+                          <{ProvEntity.iri_was_attributed_to}> ?responsibleAgent;
+                          <{ProvEntity.iri_generated_at_time}> ?t;
+                          <{ProvEntity.iri_description}> ?description.
+            OPTIONAL {{
+                    ?snapshot <{ProvEntity.iri_had_primary_source}> ?source.
+                }}   
+            OPTIONAL {{
+                    ?snapshot <{ProvEntity.iri_has_update_query}> ?updateQuery.
+                }}  
+            }}
+        """
+    else:
+        query_provenance = f"""
+            CONSTRUCT {{
+                ?snapshot <{ProvEntity.iri_specialization_of}> ?entity;
+                          <{ProvEntity.iri_generated_at_time}> ?t;      
+                          <{ProvEntity.iri_has_update_query}> ?updateQuery.
+            }} 
+            WHERE {{
+                VALUES ?entity {{{values}}}
+                ?snapshot <{ProvEntity.iri_specialization_of}> ?entity;
+                          <{ProvEntity.iri_generated_at_time}> ?t.
+            OPTIONAL {{
+                    ?snapshot <{ProvEntity.iri_has_update_query}> ?updateQuery.
+                }}   
+            }}
+        """
+    current_states:Dict[str, ConjunctiveGraph] = dict()
+    for quad in Sparql(query_dataset, config).run_construct_query().quads():
+        current_states.setdefault(str(quad[0]), ConjunctiveGraph()).add(quad)
+    provenance = Sparql(query_provenance, config).run_construct_query()
+    # The specializationOf triples only serve to assign each snapshot to its entity
+    entity_by_snapshot = {snapshot: str(entity) for snapshot, _, entity in provenance.triples((None, ProvEntity.iri_specialization_of, None))}
+    for quad in provenance.quads():
+        if quad[1] != ProvEntity.iri_specialization_of and quad[0] in entity_by_snapshot:
+            current_states.setdefault(entity_by_snapshot[quad[0]], ConjunctiveGraph()).add(quad)
+    return current_states
@@ -14,56 +14,101 @@
 # ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
 # SOFTWARE.
 
-from typing import Set, Tuple, Dict, List, Union
+from typing import Callable, Set, Tuple, Dict, Iterator, List, Optional, Union
 
-from copy import deepcopy
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice
 import rdflib
 from rdflib.plugins.sparql.operators import string
-from rdflib.plugins.sparql.processor import prepareQuery
-from rdflib.plugins.sparql.parser import parseUpdate
 from rdflib.plugins.sparql.parserutils import CompValue
-from rdflib import ConjunctiveGraph, URIRef, Literal, Variable
+from rdflib.plugins.sparql.evaluate import evalPart
+from rdflib.plugins.sparql.sparql import QueryContext
+from rdflib import ConjunctiveGraph, URIRef, Literal, Variable, BNode
 from rdflib.paths import Path
 from tqdm import tqdm
 from datetime import datetime
-from dateutil import parser
 
-from time_agnostic_browser.support import FileManager, _to_nt_sorted_list, _to_dict_of_nt_sorted_lists
+from time_agnostic_browser.support import convert_to_timestamp, _to_nt_sorted_list, _to_dict_of_nt_sorted_lists
 from time_agnostic_browser.sparql import Sparql
+from time_agnostic_browser.config import Config, CONFIG_PATH
+from time_agnostic_browser.prepared_query import PreparedQuery, parse_update, prepare_query
 from time_agnostic_browser.prov_entity import ProvEntity
-from time_agnostic_browser.agnostic_entity import AgnosticEntity
+from time_agnostic_browser.agnostic_entity import AgnosticEntity, get_entities_histories, BATCH_SIZE
+from time_agnostic_browser.entity_snapshots import EntitySnapshots, get_quads
+from time_agnostic_browser.temporal_store import TemporalIndex, TemporalStore, get_view
+from time_agnostic_browser.past_graphs import load_past_graphs, prepare_past_graphs
 
 from pprint import pprint
 
-CONFIG_PATH = "./config.json"
+# The stage reported to on_progress while the results are produced, with the number of snapshots whose results are complete
+EVALUATION_STAGE = "Evaluating the query"
+# The algebra operators under which a query can be evaluated once on all the snapshots together
+SINGLE_PASS_NODES = {"SelectQuery", "Project", "Distinct", "Reduced", "OrderBy", "BGP", "Join", "Filter", "Extend"}
 
 class AgnosticQuery:
     """
     This class represents a time agnostic query, that is, it is executed both on the present state of knowledge and on those passed.
 
-    :param past_graphs_location: Path of a file or URL of a triplestore from which to derive the past graphs. If nothing is indicated, the graphs are automatically reconstructed to the destination indicated in the parameter "past_graphs_destination".
-    :type past_graphs_location: str
-    :param past_graphs_destination: Destination to save past graphs to. You can specify both a path or the URL of a triplestore. If nothing is indicated, by default it is a file named "past_graphs.json" in the current directory.
-    :type past_graphs_destination: str
     :param query: The query to execute on all the present and passed states of all the graphs.
     :type query: str
+    :param config: The path to the configuration file or the Config parsed from it. The default is "./config.json".
+    :type config: Union[str, Config]
+    :param past_graphs_location: Path of a file from which to derive the past graphs, as materialised by :func:`time_agnostic_browser.past_graphs.materialize_past_graphs`. If nothing is indicated, the past graphs are materialised to the destination indicated in the parameter "past_graphs_destination", if any.
+    :type past_graphs_location: str
+    :param past_graphs_destination: Path of a file to materialise the past graphs of all the entities to, before the query is executed. The materialisation is resumed if it was interrupted and, once it has been completed, the past graphs are refreshed at most once per interval, see :func:`time_agnostic_browser.past_graphs.prepare_past_graphs`. If neither this parameter nor "past_graphs_location" are indicated, only the entities relevant to the query are reconstructed, in memory.
+    :type past_graphs_destination: str
+    :param on_progress: A function called as the reconstruction proceeds, with the description of the current stage, the number of items processed and the total number of items of the stage. The default is None.
+    :type on_progress: Callable[[str, int, int], None]
+    :param config_path: Deprecated, use config instead.
+    :type config_path: str
+
+    The entities are reconstructed in batches, see :func:`time_agnostic_browser.agnostic_entity.get_entities_histories`. 
+    The batches can be processed by a pool of workers, configured in the "reconstruction" section of the configuration file: ::
+
+        "reconstruction": {
+            "batch_size": 100,
+            "workers": 4,
+            "executor": "process"
+        }
+
+    With "executor" set to "thread", the workers overlap the waits for the triplestores. 
+    With "process", they also replay the update queries on several cores. 
+    Either way, the reconstructed graphs are the same as with a single worker, which is the default.
+    The entities matching the hooks of the query are fetched a page at a time, 
+    and those of a page are reconstructed before the next page is processed, see :meth:`time_agnostic_browser.sparql.Sparql.iter_construct_query`.
 
     .. CAUTION::
         Depending on the amount of snapshots, reconstructing the past state of knowledge may take a long time. For example, reconstructing 26 different states in each of which 23,000 entities have changed takes about 12 hours. The experiment was performed with an Intel Core i5 8500, a 1 TB SSD Nvme Pcie 3.0, and 32 GB RAM DDR4 3000 Mhz CL15.
     """
-    def __init__(self, query:str, entity_types=set(), config_path:str=CONFIG_PATH):
+    def __init__(self, query:str, entity_types=set(), config:Union[str, Config]=CONFIG_PATH, past_graphs_location:str=None, past_graphs_destination:str=None, on_progress:Callable[[str, int, int], None]=None, config_path:str=None):
         self.query = query
         self.entity_types = entity_types
-        self.config_path = config_path
+        self.config = Config.load(config, config_path)
+        self.on_progress = on_progress
+        if past_graphs_location is None and past_graphs_destination is not None:
+            prepare_past_graphs(past_graphs_destination, self.config)
+            past_graphs_location = past_graphs_destination
+        # The histories of all the entities, if they have been materialised
+        self.past_graphs:Optional[Dict[str, EntitySnapshots]] = load_past_graphs(past_graphs_location) if past_graphs_location is not None else None
         self.vars_to_explicit_by_time:Dict[str, Set[Tuple]] = dict()
         self.reconstructed_entities = set()
         self.relevant_entities_graphs:Dict[URIRef, Dict[str, ConjunctiveGraph]] = dict()
         self.relevant_graphs:Dict[str, ConjunctiveGraph] = dict()
+        # The quads of the relevant entities with their intervals of validity, and the entities already indexed
+        self.temporal_index = TemporalIndex()
+        self._aligned_entities:Set[URIRef] = set()
+        self.reconstruction_settings:dict = self.config.get("reconstruction", dict())
+        self._executor:Optional[Executor] = None
         self.triples = self._process_query()
-        self._rebuild_relevant_graphs()
+        try:
+            self._rebuild_relevant_graphs()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
     
     def _process_query(self) -> List[Tuple]:
-        algebra:CompValue = prepareQuery(self.query).algebra
+        algebra:CompValue = prepare_query(self.query).algebra
         if algebra.name != "SelectQuery":
             raise ValueError("Only SELECT queries are allowed.")
         triples = list()
@@ -103,14 +148,15 @@ class AgnosticQuery:
                     CONSTRUCT {{{solvable_triple[0]} {solvable_triple[1]} {solvable_triple[2]}}}
                     WHERE {{{solvable_triple[0]} {solvable_triple[1]} {solvable_triple[2]}}}
                 """
-                present_results = Sparql(query_to_identify, self.config_path).run_construct_query()
                 print(f"[AgnosticQuery:INFO] Rebuilding current relevant entities for the triple {solvable_triple}.")
-                pbar = tqdm(total=len(present_results))
-                for result in present_results:
-                    self._rebuild_relevant_entity(result[0])
-                    self._rebuild_relevant_entity(result[2])
-                    pbar.update(1)
-                pbar.close()
+                # The entities of each page of results are reconstructed before the next page is processed
+                for page_number, present_results in enumerate(Sparql(query_to_identify, self.config).iter_construct_query(), start=1):
+                    print(f"[AgnosticQuery:INFO] Page {page_number}: {len(present_results)} triples.")
+                    entities = list()
+                    for result in present_results:
+                        entities.append(result[0])
+                        entities.append(result[2])
+                    self._rebuild_relevant_entities(entities, progress_bar=True)
                 self._find_entities_in_update_queries(triple)
             else:
                 self._rebuild_relevant_entity(triple[0])
@@ -122,43 +168,104 @@ class AgnosticQuery:
 
     def _rebuild_relevant_entity(self, entity:Union[URIRef, Literal]):
         if isinstance(entity, URIRef) and entity not in self.reconstructed_entities:
-            agnostic_entity = AgnosticEntity(entity, False)
-            entity_history = agnostic_entity.get_history()[0]
+            if self.past_graphs is not None:
+                entity_history = {entity: self.past_graphs.get(str(entity))}
+            else:
+                agnostic_entity = AgnosticEntity(entity, False, self.config)
+                entity_history = agnostic_entity.get_history()[0]
             if entity_history[entity]:
                 self.relevant_entities_graphs.update(entity_history) 
             self.reconstructed_entities.add(entity)
+
+    def _rebuild_relevant_entities(self, entities:List[Union[URIRef, Literal]], progress_bar:bool=False):
+        # Same as _rebuild_relevant_entity, but the histories are retrieved in batches,
+        # which are processed by the workers, if any, and merged in order
+        entities_to_rebuild = list(dict.fromkeys(
+            entity for entity in entities 
+            if isinstance(entity, URIRef) and entity not in self.reconstructed_entities))
+        if self.past_graphs is not None:
+            for entity in entities_to_rebuild:
+                if self.past_graphs.get(str(entity)):
+                    self.relevant_entities_graphs[entity] = self.past_graphs[str(entity)]
+                self.reconstructed_entities.add(entity)
+            self._report_progress("Rebuilding the relevant entities", len(entities_to_rebuild), len(entities_to_rebuild))
+            return
+        batch_size = self.reconstruction_settings.get("batch_size", BATCH_SIZE)
+        batches = [entities_to_rebuild[i:i+batch_size] for i in range(0, len(entities_to_rebuild), batch_size)]
+        pbar = tqdm(total=len(entities_to_rebuild)) if progress_bar else None
+        done = 0
+        self._report_progress("Rebuilding the relevant entities", done, len(entities_to_rebuild))
+        executor = self._get_executor() if len(batches) > 1 else None
+        if executor is not None:
+            results = [executor.submit(get_entities_histories, batch, False, self.config) for batch in batches]
+        else:
+            results = batches
+        for batch, result in zip(batches, results):
+            if executor is not None:
+                entities_histories = result.result()[0]
+            else:
+                entities_histories = get_entities_histories(batch, config=self.config)[0]
+            for entity in batch:
+                if entities_histories.get(entity):
+                    self.relevant_entities_graphs[entity] = entities_histories[entity]
+                self.reconstructed_entities.add(entity)
+            if pbar is not None:
+                pbar.update(len(batch))
+            done += len(batch)
+            self._report_progress("Rebuilding the relevant entities", done, len(entities_to_rebuild))
+        if pbar is not None:
+            pbar.close()
+
+    def _report_progress(self, stage:str, done:int, total:int) -> None:
+        if self.on_progress is not None:
+            self.on_progress(stage, done, total)
+
+    def _get_executor(self) -> Optional[Executor]:
+        workers = self.reconstruction_settings.get("workers", 1)
+        if workers <= 1:
+            return None
+        if self._executor is None:
+            if self.reconstruction_settings.get("executor", "thread") == "process":
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=workers)
+        return self._executor
     
     def _align_snapshots(self) -> None:
-        # Merge entities based on snapshots
-        for _, snapshots in self.relevant_entities_graphs.items():
-            for snapshot, graph in snapshots.items():
-                if snapshot in self.relevant_graphs:
-                    for quad in graph.quads():
-                        self.relevant_graphs[snapshot].add(quad)
+        # Merge entities based on snapshots. 
+        # Each quad is stored once in a temporal index, together with the intervals in which it is valid, 
+        # and each snapshot is a read-only view of the index as of its time. 
+        # The alignment is incremental: only the entities reconstructed since the last call are indexed.
+        new_entities = [entity for entity in self.relevant_entities_graphs if entity not in self._aligned_entities]
+        for entity in new_entities:
+            self._index_entity(entity)
+            self._aligned_entities.add(entity)
+            for snapshot in self.relevant_entities_graphs[entity]:
+                if snapshot not in self.relevant_graphs:
+                    time = convert_to_timestamp(snapshot)
+                    self.relevant_graphs[snapshot] = get_view(self.temporal_index, time, time)
+
+    def _index_entity(self, entity:URIRef) -> None:
+        # The triples having the entity as subject are valid from a snapshot of the entity to the following one: 
+        # if an entity hasn't changed, it is carried over the snapshots of the other entities, 
+        # from the past to the present, assuming that the past influences the present and not the opposite like in Dark. 
+        # Any other triple in the graph of the entity is valid only at that snapshot.
+        snapshots = self.relevant_entities_graphs[entity]
+        if isinstance(snapshots, EntitySnapshots):
+            # The deltas are applied one after the other, from the most recent snapshot
+            snapshots_quads = snapshots.iter_quads()
+        else:
+            snapshots_quads = ((snapshot, get_quads(snapshots[snapshot])) for snapshot in sorted(snapshots, key=convert_to_timestamp, reverse=True))
+        next_time = None
+        for snapshot, quads in snapshots_quads:
+            time = convert_to_timestamp(snapshot)
+            for quad in quads:
+                if quad[0] == entity:
+                    self.temporal_index.add(quad, time, next_time)
                 else:
-                    self.relevant_graphs[snapshot] = deepcopy(graph)
-        # If an entity hasn't changed, copy it
-        ordered_data: List[Tuple[str, ConjunctiveGraph]] = sorted(
-            self.relevant_graphs.items(),
-            key=lambda x: parser.parse(x[0]),
-            reverse=False # That is, from past to present, assuming that the past influences the present and not the opposite like in Dark
-        )
-        for index, se_cg in enumerate(ordered_data):
-            se = se_cg[0]
-            cg = se_cg[1]
-            if index > 0:
-                previous_se = ordered_data[index-1][0]
-                for subject in self.relevant_graphs[previous_se].subjects():
-                    # To copy the entity two conditions must be met: 
-                    #   1) the entity is present in tn but not in tn+1; 
-                    #   2) the entity is absent in tn+1 because it has not changed 
-                    #      and not because it has been deleted.
-                    if (subject, None, None, None) not in cg:
-                        if subject in self.relevant_entities_graphs:
-                            if se not in self.relevant_entities_graphs[subject]:
-                                for quad in self.relevant_graphs[previous_se].quads((subject, None, None, None)):
-                                    self.relevant_graphs[se].add(quad)
-            
+                    self.temporal_index.add(quad, time, time + 1)
+            next_time = time
+
     def _solve_variables(self) -> None:
         self._get_vars_to_explicit_by_time()
         while self._there_are_variables():
@@ -223,12 +330,12 @@ class AgnosticQuery:
                     variable = variables[0]
                     variable_index = triple.index(variable)
                     if variable_index == 2:
-                        results = self.relevant_graphs[se].query(query_to_identify)
+                        results = self.relevant_graphs[se].query(prepare_query(query_to_identify).query)
                         for result in results:
                             explicit_triples.setdefault(se, dict())
                             explicit_triples[se].setdefault(variable, set())
                             explicit_triples[se][variable].add(result)
-                            self._rebuild_relevant_entity(result[variable_index])
+                        self._rebuild_relevant_entities([result[variable_index] for result in results])
                 self._align_snapshots()
         return explicit_triples
         
@@ -278,12 +385,12 @@ class AgnosticQuery:
         uris_in_triple = {el for el in triple if isinstance(el, URIRef)}
         relevant_entities_found = set()
         query_to_identify = self._get_query_to_identify(triple)
-        results = Sparql(query_to_identify, self.config_path).run_select_query()
+        results = Sparql(query_to_identify, self.config).run_select_query()
         if results:
             pbar = tqdm(total=len(results))
             print(f"[AgnosticQuery:INFO] Searching for relevant entities in relevant update queries.")
-            for result in results:
-                update = parseUpdate(result[0])
+            for index, result in enumerate(results, start=1):
+                update = parse_update(result[0])
                 for request in update["request"]:
                     for quadsNotTriples in request["quads"]["quadsNotTriples"]:
                         for triple in quadsNotTriples["triples"]:
@@ -292,44 +399,210 @@ class AgnosticQuery:
                             if relevant_entities is not None:
                                 relevant_entities_found.update(relevant_entities)
                 pbar.update(1)
+                self._report_progress("Searching for relevant entities in the update queries", index, len(results))
             pbar.close()
         new_entities_found = relevant_entities_found.difference(self.reconstructed_entities)
         if new_entities_found:
             print(f"[AgnosticQuery:INFO] Rebuilding relevant entities' history.")
-            pbar = tqdm(total=len(new_entities_found))
-            for new_entity_found in new_entities_found:
-                self._rebuild_relevant_entity(new_entity_found)
-                pbar.update(1)
-            pbar.close()
+            self._rebuild_relevant_entities(list(new_entities_found), progress_bar=True)
         
     def run_agnostic_query(self) -> Dict[str, Set[Tuple]]:
         """
         It launches a time agnostic query, 
         which returns the result not only with respect to the current state of knowledge, 
         but also with respect to past ones.
+        Queries made only of basic graph patterns, joins, filters and bindings are evaluated once 
+        on all the snapshots together, and each solution is assigned to the snapshots at which all its triples are valid. 
+        Any other query is evaluated on each snapshot, unless none of the triples it can match changed 
+        since the previous snapshot, in which case the previous result is reused.
+        To consume the results while they are produced, use :meth:`iter_agnostic_query`.
 
         :returns Dict[str, Set[Tuple]] -- A dictionary is returned in which the keys correspond to the recorded snapshots, while the values correspond to a set of tuples containing the query results at that snapshot, where the positional value of the elements in the tuples is equivalent to the order of the variables indicated in the query.
         """
-        agnostic_result = dict()
-        for snapshot, graph in self.relevant_graphs.items():
-            results = graph.query(self.query)
-            output = set()
-            for result in results:
-                result_tuple = tuple(str(var) for var in result)
-                output.add(result_tuple)
-            agnostic_result[snapshot] = output
+        agnostic_result = {snapshot: set() for snapshot in self.relevant_graphs}
+        for snapshot, result_tuple in self.iter_agnostic_query():
+            agnostic_result[snapshot].add(result_tuple)
         return agnostic_result
 
+    def iter_agnostic_query(self, max_results:int=None) -> Iterator[Tuple[str, Tuple]]:
+        """
+        Like :meth:`run_agnostic_query`, but the results are yielded one at a time, as (snapshot, result) pairs, 
+        from the oldest snapshot to the most recent, and each snapshot is evaluated only when the results 
+        of the previous ones have been consumed. The results of a snapshot are yielded once each, in no particular order, 
+        and the snapshots without results are skipped: they are the keys of relevant_graphs. 
+        Closing the iterator, or stopping consuming it, stops the evaluation. 
+        Queries evaluated once on all the snapshots together yield their first result only after the evaluation.
+        Once all the results of a snapshot have been consumed, the on_progress function, if any, is called 
+        with the "Evaluating the query" stage and the number of snapshots whose results are complete, 
+        including the snapshots without results.
+
+        :param max_results: The maximum number of results to yield. The default is None, that is, all the results.
+        :type max_results: int.
+        :returns Iterator[Tuple[str, Tuple]] -- The snapshot and the result, where the positional value of the elements in the result is equivalent to the order of the variables indicated in the query.
+        """
+        prepared_query = prepare_query(self.query)
+        self._report_progress(EVALUATION_STAGE, 0, len(self.relevant_graphs))
+        is_indexed = all(
+            isinstance(graph.store, TemporalStore) and graph.store.index is self.temporal_index 
+            for graph in self.relevant_graphs.values())
+        results = None
+        if is_indexed:
+            triples = list()
+            if self._is_monotonic(prepared_query.algebra, triples):
+                results = self._iter_once(prepared_query, triples)
+        if results is None:
+            results = self._iter_by_snapshot(prepared_query, is_indexed)
+        if max_results is not None:
+            results = islice(results, max_results)
+        yield from results
+
+    def _is_monotonic(self, node:CompValue, triples:List[Tuple]) -> bool:
+        # It tells whether the solutions on a graph are the solutions on any larger graph whose triples are in the graph, 
+        # collecting the triple patterns in the meantime
+        if node.name not in SINGLE_PASS_NODES:
+            return False
+        if node.name == "BGP":
+            for triple in node.triples:
+                if any(isinstance(el, (Path, BNode)) for el in triple):
+                    return False
+                triples.append(triple)
+            return True
+        if node.name in {"Filter", "Extend"} and self._contains_exists(node.expr):
+            return False
+        for child in ("p", "p1", "p2"):
+            if child in node and isinstance(node[child], CompValue) and not self._is_monotonic(node[child], triples):
+                return False
+        return True
+
+    def _contains_exists(self, expr) -> bool:
+        if isinstance(expr, CompValue):
+            if expr.name in {"Builtin_EXISTS", "Builtin_NOTEXISTS"}:
+                return True
+            return any(self._contains_exists(v) for v in expr.values())
+        if isinstance(expr, (list, tuple)):
+            return any(self._contains_exists(v) for v in expr)
+        return False
+
+    def _iter_once(self, prepared_query:PreparedQuery, triples:List[Tuple]) -> Iterator[Tuple[str, Tuple]]:
+        # The query is evaluated on the union of all the snapshots, without projection, 
+        # so that the triples supporting each solution can be checked against the intervals of the index
+        snapshots = sorted(self.relevant_graphs, key=convert_to_timestamp)
+        times = [convert_to_timestamp(snapshot) for snapshot in snapshots]
+        all_indexes = frozenset(range(len(snapshots)))
+        node = prepared_query.algebra
+        while node.name in {"SelectQuery", "Distinct", "Reduced", "Project", "OrderBy"}:
+            node = node.p
+        ctx = QueryContext(get_view(self.temporal_index))
+        ctx.prologue = prepared_query.query.prologue
+        indexes_by_triple:Dict[Tuple, frozenset] = dict()
+        indexes_by_result:Dict[Tuple, Set[int]] = dict()
+        for solution in evalPart(ctx, node):
+            indexes = all_indexes
+            for triple in triples:
+                ground_triple = tuple(solution.get(el) if isinstance(el, Variable) else el for el in triple)
+                if ground_triple not in indexes_by_triple:
+                    intervals = [
+                        interval for quad in self.temporal_index.quads(ground_triple + (None,)) 
+                        for interval in self.temporal_index.get_intervals(quad)]
+                    indexes_by_triple[ground_triple] = frozenset(
+                        index for index, time in enumerate(times) 
+                        if any(start <= time and (end is None or time < end) for start, end in intervals))
+                indexes = indexes & indexes_by_triple[ground_triple]
+                if not indexes:
+                    break
+            if indexes:
+                result_tuple = tuple(str(solution.get(var)) for var in prepared_query.variables)
+                indexes_by_result.setdefault(result_tuple, set()).update(indexes)
+        # Each result is valid in some runs of consecutive snapshots: 
+        # the snapshots are swept in chronological order, keeping the results valid at each of them
+        starting:List[List[Tuple]] = [list() for _ in snapshots]
+        ending:List[List[Tuple]] = [list() for _ in range(len(snapshots) + 1)]
+        for result_tuple, indexes in indexes_by_result.items():
+            for start, end in self._get_runs(sorted(indexes)):
+                starting[start].append(result_tuple)
+                ending[end].append(result_tuple)
+        indexes_by_result.clear()
+        valid_results:Dict[Tuple, None] = dict()
+        for index, snapshot in enumerate(snapshots):
+            for result_tuple in ending[index]:
+                del valid_results[result_tuple]
+            for result_tuple in starting[index]:
+                valid_results[result_tuple] = None
+            for result_tuple in valid_results:
+                yield snapshot, result_tuple
+            self._report_progress(EVALUATION_STAGE, index + 1, len(snapshots))
+
+    @classmethod
+    def _get_runs(cls, indexes:List[int]) -> Iterator[Tuple[int, int]]:
+        # The runs of consecutive integers in a sorted list, as [start, end) pairs
+        start = previous = indexes[0]
+        for index in indexes[1:]:
+            if index != previous + 1:
+                yield start, previous + 1
+                start = index
+            previous = index
+        yield start, previous + 1
+
+    def _iter_by_snapshot(self, prepared_query:PreparedQuery, is_indexed:bool) -> Iterator[Tuple[str, Tuple]]:
+        patterns = list()
+        if is_indexed:
+            triples = list()
+            self._collect_triples(prepared_query.algebra, triples)
+            if any(isinstance(el, Path) for triple in triples for el in triple) or self._contains_graph_variable(prepared_query.algebra):
+                # A property path goes through intermediate nodes that no pattern of the query mentions, 
+                # and the named graphs can be enumerated even if no triple matches: any change counts
+                patterns.append((None, None, None, None))
+            else:
+                for triple in triples:
+                    patterns.append(tuple(None if isinstance(el, (Variable, BNode)) else el for el in triple) + (None,))
+        previous_time = None
+        output = None
+        snapshots = sorted(self.relevant_graphs, key=convert_to_timestamp)
+        for index, snapshot in enumerate(snapshots):
+            time = convert_to_timestamp(snapshot)
+            if not is_indexed or output is None or any(self.temporal_index.has_changes(pattern, previous_time, time) for pattern in patterns):
+                results = self.relevant_graphs[snapshot].query(prepared_query.query)
+                output = set()
+                for result in results:
+                    result_tuple = tuple(str(var) for var in result)
+                    output.add(result_tuple)
+            for result_tuple in output:
+                yield snapshot, result_tuple
+            self._report_progress(EVALUATION_STAGE, index + 1, len(snapshots))
+            previous_time = time
+
+    def _collect_triples(self, node, triples:List[Tuple]) -> None:
+        # Unlike _tree_traverse, it also looks into lists, such as the parts of the patterns in FILTER EXISTS
+        if isinstance(node, CompValue):
+            for k, v in node.items():
+                if k == "triples":
+                    triples.extend(v)
+                else:
+                    self._collect_triples(v, triples)
+        elif isinstance(node, (list, tuple)):
+            for v in node:
+                self._collect_triples(v, triples)
+
+    def _contains_graph_variable(self, node) -> bool:
+        if isinstance(node, CompValue):
+            if node.name == "Graph" and isinstance(node.term, Variable):
+                return True
+            return any(self._contains_graph_variable(v) for v in node.values())
+        if isinstance(node, (list, tuple)):
+            return any(self._contains_graph_variable(v) for v in node)
+        return False
+
 class BlazegraphQuery(AgnosticQuery):
-    def __init__(self, query:str, entity_types=set(), config_path:str = CONFIG_PATH):
-        blazegraph_full_text_search:str = FileManager(config_path).import_json()["blazegraph_full_text_search"]
+    def __init__(self, query:str, entity_types=set(), config:Union[str, Config]=CONFIG_PATH, past_graphs_location:str=None, past_graphs_destination:str=None, on_progress:Callable[[str, int, int], None]=None, config_path:str=None):
+        config = Config.load(config, config_path)
+        blazegraph_full_text_search:str = config["blazegraph_full_text_search"]
         if blazegraph_full_text_search.lower() in {"true", "1", 1, "t", "y", "yes", "ok"}:
             self.blazegraph_full_text_search = True
         elif blazegraph_full_text_search.lower() in {"false", "0", 0, "n", "f", "no"}:
             self.blazegraph_full_text_search = False
         else:
             raise ValueError("Enter a valid value for 'blazegraph_full_text_search' in the configuration file, for example 'yes' or 'no'.")
-        super(BlazegraphQuery, self).__init__(query, entity_types)
+        super(BlazegraphQuery, self).__init__(query, entity_types, config, past_graphs_location, past_graphs_destination, on_progress)
 
     def _get_query_to_identify(self, triple:tuple) -> str:
         uris_in_triple = {el for el in triple if isinstance(el, URIRef)}
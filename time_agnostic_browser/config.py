@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Any, Dict, FrozenSet, Mapping, Union
+
+import os, threading, warnings
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from time_agnostic_browser.support import FileManager
+from time_agnostic_browser.prov_entity import ProvEntity
+
+
+CONFIG_PATH = "./config.json"
+
+
+def _freeze(value:Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+@dataclass(frozen=True, eq=False)
+class Config:
+    """
+    The parsed content of a configuration file, which cannot be modified.
+    Use :meth:`Config.from_path` to obtain it: the file is parsed once and
+    parsed again only if its modification time changes.
+    The sections of the file can be read as in a dictionary, for example config["dataset"],
+    and the lists they contain are turned into tuples.
+
+    :param path: The absolute path to the configuration file.
+    :type path: str.
+    :param mtime: The modification time of the file when it was parsed.
+    :type mtime: float.
+    :param content: The content of the file.
+    :type content: Mapping.
+    :param prov_properties: The IRIs of the provenance properties, used to route the queries either to the provenance or to the dataset sources.
+    :type prov_properties: FrozenSet[str].
+    """
+    path: str
+    mtime: float
+    content: Mapping
+    prov_properties: FrozenSet[str] = frozenset(str(iri) for iri in ProvEntity.get_prov_properties())
+
+    def __reduce__(self):
+        # Read-only mappings cannot be pickled: a Config sent to another process is parsed again from its file
+        return (Config.from_path, (self.path,))
+
+    def __getitem__(self, key:str) -> Any:
+        return self.content[key]
+
+    def get(self, key:str, default:Any=None) -> Any:
+        """
+        It returns a section of the configuration file, or a default value if the section is missing.
+
+        :param key: The name of the section.
+        :type key: str.
+        :param default: The value returned if the section is missing. The default is None.
+        :returns: Any -- The section of the configuration file.
+        """
+        return self.content.get(key, default)
+
+    def get_storer(self, query:str) -> Mapping:
+        """
+        It returns the sources to be queried for a given query:
+        the provenance ones if the query contains at least one provenance property, the dataset ones otherwise.
+
+        :param query: A SPARQL query.
+        :type query: str.
+        :returns: Mapping -- The "provenance" or the "dataset" section of the configuration file.
+        """
+        if any(iri in query for iri in self.prov_properties):
+            return self.content["provenance"]
+        return self.content["dataset"]
+
+    @classmethod
+    def from_path(cls, config_path:str=CONFIG_PATH) -> "Config":
+        """
+        It returns the configuration contained in a file,
+        parsing the file only if it was never parsed or if it has changed since.
+
+        :param config_path: The path to the configuration file. The default is "./config.json".
+        :type config_path: str.
+        :returns: Config -- The configuration.
+        """
+        path = os.path.abspath(config_path)
+        mtime = os.path.getmtime(path)
+        with _configs_lock:
+            config = _configs.get(path)
+            if config is None or config.mtime != mtime:
+                content = _freeze(FileManager(path).import_json())
+                config = cls(path=path, mtime=mtime, content=content)
+                _configs[path] = config
+            return config
+
+    @classmethod
+    def load(cls, config:Union[str, "Config"], config_path:str=None) -> "Config":
+        """
+        It accepts either a Config, which is returned as it is, or the path to a configuration file.
+        The config_path parameter is the deprecated name under which the path used to be passed: 
+        if it is given, it takes precedence over config and a DeprecationWarning is issued.
+
+        :param config: A Config or the path to a configuration file.
+        :type config: Union[str, Config].
+        :param config_path: Deprecated, use config instead. The default is None.
+        :type config_path: str.
+        :returns: Config -- The configuration.
+        """
+        if config_path is not None:
+            warnings.warn("The config_path parameter is deprecated, use config instead.", DeprecationWarning, stacklevel=3)
+            config = config_path
+        if isinstance(config, Config):
+            return config
+        return cls.from_path(config)
+
+
+_configs:Dict[str, Config] = dict()
+_configs_lock = threading.Lock()
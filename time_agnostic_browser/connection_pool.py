@@ -0,0 +1,265 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Dict, Iterator, Optional, Tuple
+
+import http.client, socket, threading, time
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlsplit
+
+
+POOL_SIZE = 10
+TIMEOUT = 60
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+# Gateway errors are usually transient on a busy triplestore, so they are retried like connection errors
+RETRY_STATUSES = {502, 503, 504}
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of keep-alive HTTP connections to a single SPARQL endpoint.
+    Idle connections are kept in a LIFO queue, so that the most recently used one,
+    which is the least likely to have been closed by the server, is reused first.
+    Every reuse of an idle connection counts as a hit, every new connection as a miss.
+
+    :param url: The URL of the endpoint.
+    :type url: str.
+    :param pool_size: The maximum number of idle connections kept open. The default is 10.
+    :type pool_size: int.
+    :param timeout: The socket timeout in seconds. The default is 60.
+    :type timeout: float.
+    :param retries: How many times a failed request is retried. The default is 3.
+    :type retries: int.
+    :param backoff_factor: The n-th retry waits backoff_factor * 2 ** (n - 1) seconds. The default is 0.5.
+    :type backoff_factor: float.
+    """
+    def __init__(self, url:str, pool_size:int=POOL_SIZE, timeout:float=TIMEOUT, retries:int=RETRIES, backoff_factor:float=BACKOFF_FACTOR):
+        self.url = url
+        split_url = urlsplit(url)
+        self.scheme = split_url.scheme
+        self.host = split_url.hostname
+        self.port = split_url.port
+        self.path = split_url.path or "/"
+        if split_url.query:
+            self.path += "?" + split_url.query
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.hits = 0
+        self.misses = 0
+        self._idle:LifoQueue = LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _get_connection(self) -> Tuple[http.client.HTTPConnection, bool]:
+        try:
+            connection = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return connection, True
+        except Empty:
+            with self._lock:
+                self.misses += 1
+            return self._new_connection(), False
+
+    def _put_connection(self, connection:http.client.HTTPConnection) -> None:
+        try:
+            self._idle.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def request(self, method:str, body:bytes=None, headers:Dict[str, str]=None, timeout:float=None) -> Tuple[int, bytes]:
+        """
+        It sends a request to the endpoint on a pooled connection and returns the status and the body of the response.
+        Connection errors and gateway errors are retried with exponential backoff.
+        A stale keep-alive connection closed by the server is replaced immediately, without consuming a retry.
+
+        :param method: The HTTP method, for example "POST".
+        :type method: str.
+        :param body: The body of the request.
+        :type body: bytes.
+        :param headers: The headers of the request.
+        :type headers: Dict[str, str].
+        :param timeout: The socket timeout in seconds for this request, retries included, instead of the one of the pool. The default is None, that is, the timeout of the pool.
+        :type timeout: float.
+        :returns: Tuple[int, bytes] -- The HTTP status and the body of the response.
+        :raises: urllib.error.HTTPError if the endpoint answers with an error status, urllib.error.URLError if the endpoint cannot be reached.
+        """
+        with self.stream(method, body, headers, timeout) as response:
+            return response.status, response.read()
+
+    @contextmanager
+    def stream(self, method:str, body:bytes=None, headers:Dict[str, str]=None, timeout:float=None) -> Iterator[http.client.HTTPResponse]:
+        """
+        Like :meth:`request`, but the body of the response is not read: the response is returned as a file object,
+        so that it can be consumed a chunk at a time. It is meant to be used in a with statement: ::
+
+            with pool.stream("POST", body, headers) as response:
+                for chunk in iter(lambda: response.read(65536), b""):
+                    ...
+
+        The connection goes back to the pool at the end of the block if the body was read to the end, otherwise it is closed.
+        Only the requests that fail before the body is returned are retried.
+
+        :param method: The HTTP method, for example "POST".
+        :type method: str.
+        :param body: The body of the request.
+        :type body: bytes.
+        :param headers: The headers of the request.
+        :type headers: Dict[str, str].
+        :param timeout: The socket timeout in seconds for this request, retries included, instead of the one of the pool. The default is None, that is, the timeout of the pool.
+        :type timeout: float.
+        :returns: Iterator[http.client.HTTPResponse] -- The response, whose status is lower than 400.
+        :raises: urllib.error.HTTPError if the endpoint answers with an error status, urllib.error.URLError if the endpoint cannot be reached or the connection drops while the body is read.
+        """
+        connection, response = self._send(method, body, headers or dict(), timeout)
+        try:
+            yield response
+        except (http.client.HTTPException, socket.error) as e:
+            connection.close()
+            raise URLError(e)
+        except BaseException:
+            connection.close()
+            raise
+        self._release(connection, response)
+
+    def _send(self, method:str, body:bytes, headers:Dict[str, str], timeout:float=None) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        # With a timeout, each attempt only gets the time left by the previous ones
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            connection, reused = self._get_connection()
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._release_unused(connection)
+                    raise URLError(socket.timeout("timed out"))
+                self._set_timeout(connection, remaining)
+            try:
+                connection.request(method, self.path, body=body, headers=headers)
+                response = connection.getresponse()
+                if response.status < 400:
+                    return connection, response
+                data = response.read()
+            except (http.client.HTTPException, socket.error) as e:
+                connection.close()
+                if reused:
+                    continue
+                if attempt >= self.retries:
+                    raise URLError(e)
+                attempt += 1
+                self._sleep(self.backoff_factor * 2 ** (attempt - 1), deadline)
+                continue
+            self._release(connection, response)
+            if response.status in RETRY_STATUSES and attempt < self.retries:
+                attempt += 1
+                self._sleep(self.backoff_factor * 2 ** (attempt - 1), deadline)
+                continue
+            raise HTTPError(self.url, response.status, data.decode("utf-8", errors="replace"), response.headers, None)
+
+    def _release(self, connection:http.client.HTTPConnection, response:http.client.HTTPResponse) -> None:
+        # A connection can be reused only once the body of the previous response has been read to the end
+        if response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self._release_unused(connection)
+
+    def _release_unused(self, connection:http.client.HTTPConnection) -> None:
+        # The connections go back to the pool with the timeout of the pool
+        if connection.timeout != self.timeout:
+            self._set_timeout(connection, self.timeout)
+        self._put_connection(connection)
+
+    @classmethod
+    def _set_timeout(cls, connection:http.client.HTTPConnection, timeout:float) -> None:
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+
+    @classmethod
+    def _sleep(cls, seconds:float, deadline:Optional[float]) -> None:
+        if deadline is not None:
+            seconds = min(seconds, max(deadline - time.monotonic(), 0))
+        time.sleep(seconds)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        It returns the hit and miss counters of the pool.
+
+        :returns: Dict[str, int] -- A dictionary with the keys "hits", "misses" and "idle".
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "idle": self._idle.qsize()}
+
+    def close(self) -> None:
+        """
+        It closes all the idle connections of the pool.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+_pools:Dict[str, ConnectionPool] = dict()
+_pools_lock = threading.Lock()
+
+def get_pool(url:str, settings:dict=None) -> ConnectionPool:
+    """
+    It returns the connection pool shared by all the callers for a given endpoint, creating it at the first request.
+    The settings are read from the "connection_pool" section of the configuration file: ::
+
+        "connection_pool": {
+            "pool_size": 10,
+            "timeout": 60,
+            "retries": 3,
+            "backoff_factor": 0.5
+        }
+
+    :param url: The URL of the endpoint.
+    :type url: str.
+    :param settings: The "connection_pool" section of the configuration file. Missing keys take the default values.
+    :type settings: dict.
+    :returns: ConnectionPool -- The pool of the endpoint.
+    """
+    with _pools_lock:
+        if url not in _pools:
+            settings = settings or dict()
+            _pools[url] = ConnectionPool(
+                url,
+                pool_size=settings.get("pool_size", POOL_SIZE),
+                timeout=settings.get("timeout", TIMEOUT),
+                retries=settings.get("retries", RETRIES),
+                backoff_factor=settings.get("backoff_factor", BACKOFF_FACTOR))
+        return _pools[url]
+
+def get_pools_stats() -> Dict[str, Dict[str, int]]:
+    """
+    It returns the hit and miss counters of every pool, by endpoint URL.
+
+    :returns: Dict[str, Dict[str, int]] -- A dictionary in which the keys are the endpoints and the values the counters returned by ConnectionPool.get_stats.
+    """
+    with _pools_lock:
+        return {url: pool.get_stats() for url, pool in _pools.items()}
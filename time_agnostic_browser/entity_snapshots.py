@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple
+
+from collections.abc import Mapping, ItemsView, ValuesView
+from rdflib import ConjunctiveGraph, Literal, BNode
+from rdflib.plugins.serializers.nt import _quoteLiteral
+from rdflib.term import Node
+
+
+Quad = Tuple[Node, Node, Node, Node]
+
+
+def get_quads(cg:ConjunctiveGraph) -> Set[Quad]:
+    """
+    It returns the quads of a graph, identifying each context by its identifier rather than by its graph,
+    so that they do not depend on the store of the graph.
+
+    :param cg: A ConjunctiveGraph.
+    :type cg: ConjunctiveGraph.
+    :returns: Set[Quad] -- The quads of the graph.
+    """
+    return {(s, p, o, c.identifier) for s, p, o, c in cg.quads()}
+
+def to_conjunctive_graph(quads:Set[Quad]) -> ConjunctiveGraph:
+    """
+    It returns a new ConjunctiveGraph containing some quads.
+
+    :param quads: The quads, whose contexts are identifiers.
+    :type quads: Set[Quad].
+    :returns: ConjunctiveGraph -- The graph.
+    """
+    cg = ConjunctiveGraph()
+    for quad in quads:
+        cg.add(quad)
+    return cg
+
+def dump_quads(quads:Iterable[Quad]) -> str:
+    """
+    It serializes quads as N-Quads, one per line, sorted.
+
+    :param quads: The quads, whose contexts are identifiers.
+    :type quads: Iterable[Quad].
+    :returns: str -- The N-Quads.
+    """
+    return "".join(sorted(
+        f"{s.n3()} {p.n3()} {_quoteLiteral(o) if isinstance(o, Literal) else o.n3()} {c.n3()} .\n" for s, p, o, c in quads))
+
+def load_quads(nquads:str, bnode_context:Dict[str, BNode]=None) -> Set[Quad]:
+    """
+    It parses quads serialized by :func:`dump_quads`.
+
+    :param nquads: The N-Quads.
+    :type nquads: str.
+    :param bnode_context: The blank nodes already parsed, by label. Pass the same dictionary to several calls to give the same label the same blank node in all of them. The default is None, that is, a new blank node for each label.
+    :type bnode_context: Dict[str, BNode].
+    :returns: Set[Quad] -- The quads, whose contexts are identifiers.
+    """
+    if not nquads:
+        return set()
+    cg = ConjunctiveGraph()
+    cg.parse(data=nquads, format="nquads", bnode_context=bnode_context)
+    return get_quads(cg)
+
+
+class EntitySnapshots(Mapping):
+    """
+    The graphs of an entity at each of its snapshots, by snapshot time.
+    Only the most recent graph is stored in full. Each of the previous snapshots is stored as a delta,
+    that is, as the quads added and removed with respect to the snapshot that follows it.
+    Graphs are materialised only when they are accessed, and each access returns a new ConjunctiveGraph,
+    which can be modified without affecting the snapshots.
+    Iterating over the items materialises the graphs one after the other, from the most recent,
+    applying one delta at a time.
+    """
+    def __init__(self):
+        self._times:List[str] = list()
+        self._indexes:Dict[str, int] = dict()
+        self._newest_quads:FrozenSet[Quad] = frozenset()
+        # The delta of the snapshot at index i is relative to the snapshot at index i - 1
+        self._deltas:List[Tuple[FrozenSet[Quad], FrozenSet[Quad]]] = list()
+
+    def add_newest(self, time:str, quads:Set[Quad]) -> None:
+        """
+        It sets the most recent snapshot, which must be added before any other.
+
+        :param time: The time of the snapshot.
+        :type time: str.
+        :param quads: The quads of the snapshot graph.
+        :type quads: Set[Quad].
+        """
+        if self._times:
+            raise ValueError("The most recent snapshot has already been added.")
+        self._newest_quads = frozenset(quads)
+        self._append(time, frozenset(), frozenset())
+
+    def add_older(self, time:str, added:Set[Quad], removed:Set[Quad]) -> None:
+        """
+        It adds a snapshot preceding the last one added, as a delta with respect to it.
+
+        :param time: The time of the snapshot.
+        :type time: str.
+        :param added: The quads that are in this snapshot but not in the following one.
+        :type added: Set[Quad].
+        :param removed: The quads that are in the following snapshot but not in this one.
+        :type removed: Set[Quad].
+        """
+        if not self._times:
+            raise ValueError("The most recent snapshot must be added first.")
+        self._append(time, frozenset(added), frozenset(removed))
+
+    def _append(self, time:str, added:FrozenSet[Quad], removed:FrozenSet[Quad]) -> None:
+        if time in self._indexes:
+            # Two snapshots with the same time: as in a dictionary, the last one added wins.
+            # Its delta is relative to the first one, so the two deltas are composed
+            index = self._indexes[time]
+            if index != len(self._times) - 1:
+                raise ValueError("The snapshots must be added from the most recent to the oldest.")
+            if index == 0:
+                self._newest_quads = (self._newest_quads - removed) | added
+            else:
+                previous_added, previous_removed = self._deltas[index]
+                self._deltas[index] = ((previous_added - removed) | added, (previous_removed - added) | removed)
+            return
+        self._indexes[time] = len(self._times)
+        self._times.append(time)
+        self._deltas.append((added, removed))
+
+    def get_quads(self, time:str) -> Set[Quad]:
+        """
+        It returns the quads of the graph at a given snapshot.
+
+        :param time: The time of the snapshot.
+        :type time: str.
+        :returns: Set[Quad] -- The quads of the snapshot graph.
+        """
+        index = self._indexes[time]
+        quads = set(self._newest_quads)
+        for added, removed in self._deltas[1:index+1]:
+            quads.difference_update(removed)
+            quads.update(added)
+        return quads
+
+    def iter_quads(self) -> Iterator[Tuple[str, Set[Quad]]]:
+        """
+        It yields the time and the quads of each snapshot, from the most recent to the oldest.
+        The same set is updated in place from one snapshot to the next: copy it to keep it.
+
+        :returns: Iterator[Tuple[str, Set[Quad]]] -- The time and the quads of each snapshot.
+        """
+        quads = set(self._newest_quads)
+        for time, (added, removed) in zip(self._times, self._deltas):
+            quads.difference_update(removed)
+            quads.update(added)
+            yield time, quads
+
+    def iter_deltas(self) -> Iterator[Tuple[str, FrozenSet[Quad], FrozenSet[Quad]]]:
+        """
+        It yields the snapshots as they are stored, from the most recent to the oldest:
+        the most recent one with all its quads as added and no quad removed,
+        each of the others with the quads added and removed with respect to the following one.
+        Passing them to add_newest and add_older, in the same order, rebuilds the snapshots.
+
+        :returns: Iterator[Tuple[str, FrozenSet[Quad], FrozenSet[Quad]]] -- The time, the added quads and the removed quads of each snapshot.
+        """
+        for index, (time, (added, removed)) in enumerate(zip(self._times, self._deltas)):
+            if index == 0:
+                yield time, self._newest_quads, frozenset()
+            else:
+                yield time, added, removed
+
+    def __getitem__(self, time:str) -> ConjunctiveGraph:
+        return to_conjunctive_graph(self.get_quads(time))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._times)
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    def __contains__(self, time:object) -> bool:
+        return time in self._indexes
+
+    def items(self) -> ItemsView:
+        return _SnapshotsItemsView(self)
+
+    def values(self) -> ValuesView:
+        return _SnapshotsValuesView(self)
+
+
+class _SnapshotsItemsView(ItemsView):
+    def __iter__(self) -> Iterator[Tuple[str, ConjunctiveGraph]]:
+        for time, quads in self._mapping.iter_quads():
+            yield time, to_conjunctive_graph(quads)
+
+
+class _SnapshotsValuesView(ValuesView):
+    def __iter__(self) -> Iterator[ConjunctiveGraph]:
+        for _, quads in self._mapping.iter_quads():
+            yield to_conjunctive_graph(quads)
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Dict, Tuple
+
+import os, threading
+from collections import OrderedDict
+from rdflib import ConjunctiveGraph
+
+
+MAX_TRIPLES = 5000000
+
+
+class GraphStore:
+    """
+    An in-memory store of the graphs parsed from JSON-LD files.
+    Each file is parsed lazily, the first time it is requested,
+    and kept in memory until it changes on disk, that is, until its modification time changes.
+    The memory is capped by the total number of triples held:
+    when the cap is exceeded, the least recently used graphs are evicted.
+
+    :param max_triples: The maximum number of triples held in memory. The default is 5,000,000.
+    :type max_triples: int.
+    """
+    def __init__(self, max_triples:int=MAX_TRIPLES):
+        self.max_triples = max_triples
+        self.triples_count = 0
+        self._graphs:Dict[str, Tuple[float, ConjunctiveGraph]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_graph(self, file_path:str) -> ConjunctiveGraph:
+        """
+        It returns the graph contained in a JSON-LD file, parsing it only if it is not in memory or if it has changed since it was parsed.
+        The returned graph is shared: it must not be modified.
+
+        :param file_path: The path to a JSON-LD file.
+        :type file_path: str.
+        :returns:  ConjunctiveGraph -- The graph contained in the file.
+        """
+        path = os.path.abspath(file_path)
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            if path in self._graphs:
+                cached_mtime, cg = self._graphs[path]
+                if cached_mtime == mtime:
+                    self._graphs.move_to_end(path)
+                    return cg
+                self._evict(path)
+        cg = ConjunctiveGraph()
+        cg.parse(location=path, format="json-ld")
+        with self._lock:
+            if path in self._graphs:
+                self._evict(path)
+            self._graphs[path] = (mtime, cg)
+            self.triples_count += len(cg)
+            # The graph just added is never evicted, even if it alone exceeds the cap
+            while self.triples_count > self.max_triples and len(self._graphs) > 1:
+                self._evict(next(iter(self._graphs)))
+        return cg
+
+    def _evict(self, path:str) -> None:
+        _, cg = self._graphs.pop(path)
+        self.triples_count -= len(cg)
+
+    def clear(self) -> None:
+        """
+        It removes all the graphs from memory.
+        """
+        with self._lock:
+            self._graphs.clear()
+            self.triples_count = 0
+
+
+_graph_store:GraphStore = None
+_graph_store_lock = threading.Lock()
+
+def get_graph_store(settings:dict=None) -> GraphStore:
+    """
+    It returns the graph store shared by the whole process, creating it at the first request.
+    The settings are read from the "graph_store" section of the configuration file: ::
+
+        "graph_store": {
+            "max_triples": 5000000
+        }
+
+    :param settings: The "graph_store" section of the configuration file. Missing keys take the default values.
+    :type settings: dict.
+    :returns: GraphStore -- The graph store of the process.
+    """
+    global _graph_store
+    with _graph_store_lock:
+        if _graph_store is None:
+            settings = settings or dict()
+            _graph_store = GraphStore(max_triples=settings.get("max_triples", MAX_TRIPLES))
+        return _graph_store
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Dict, Optional, Tuple
+
+import json, os, sqlite3, threading, zlib
+
+from time_agnostic_browser.entity_snapshots import EntitySnapshots, dump_quads, load_quads
+
+
+# The version of the format of the stored histories: rows written in another format are ignored
+FORMAT_VERSION = 1
+# The maximum number of parameters of a SQLite statement in old versions of SQLite
+MAX_PARAMETERS = 999
+
+
+class HistoryCache:
+    """
+    A persistent cache of the histories of the entities, stored in a SQLite database.
+    The history of an entity is stored together with the IRI and the time of its latest snapshot,
+    which are the key to validate it: a history is valid as long as the latest snapshot of the entity is still the same,
+    because a new snapshot is the only way in which the history of an entity can change.
+    Each history is stored as the N-Quads of its most recent graph and of the deltas of the previous ones, compressed with zlib.
+    The histories reconstructed with and without the provenance metadata are stored separately,
+    since only the snapshots with a description are considered when the metadata are requested.
+
+    :param path: The path to the SQLite database, which is created if it does not exist.
+    :type path: str.
+    """
+    def __init__(self, path:str):
+        self.path = os.path.abspath(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._get_connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS histories (
+                    entity TEXT NOT NULL,
+                    prov_metadata INTEGER NOT NULL,
+                    snapshot TEXT NOT NULL,
+                    time TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    history BLOB NOT NULL,
+                    metadata BLOB,
+                    PRIMARY KEY (entity, prov_metadata))
+            """)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared among threads: each thread opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, entity:str, snapshot:str, time:str, include_prov_metadata:bool=False) -> Optional[Tuple[EntitySnapshots, Optional[dict]]]:
+        """
+        It returns the history of an entity, if it is stored and its latest snapshot is the given one.
+
+        :param entity: The IRI of the entity.
+        :type entity: str.
+        :param snapshot: The IRI of the latest snapshot of the entity, according to the provenance.
+        :type snapshot: str.
+        :param time: The generation time of the latest snapshot, as recorded in the provenance.
+        :type time: str.
+        :param include_prov_metadata: True to get the history reconstructed together with the provenance metadata, False to get the one reconstructed without them. The default is False.
+        :type include_prov_metadata: bool.
+        :returns: Optional[Tuple[EntitySnapshots, Optional[dict]]] -- The history and the provenance metadata, which are None if include_prov_metadata is False, or None if the history is not stored or is outdated.
+        """
+        return self.get_many({entity: (snapshot, time)}, include_prov_metadata).get(entity)
+
+    def get_many(self, latest_snapshots:Dict[str, Tuple[str, str]], include_prov_metadata:bool=False) -> Dict[str, Tuple[EntitySnapshots, Optional[dict]]]:
+        """
+        Like :meth:`get`, but for several entities at once.
+
+        :param latest_snapshots: The IRI and the time of the latest snapshot of each entity, by entity IRI.
+        :type latest_snapshots: Dict[str, Tuple[str, str]].
+        :param include_prov_metadata: True to get the histories reconstructed together with the provenance metadata. The default is False.
+        :type include_prov_metadata: bool.
+        :returns: Dict[str, Tuple[EntitySnapshots, Optional[dict]]] -- The valid histories found, with their provenance metadata, by entity IRI.
+        """
+        entities = [str(entity) for entity in latest_snapshots]
+        latest_snapshots = {str(entity): (str(snapshot), str(time)) for entity, (snapshot, time) in latest_snapshots.items()}
+        output = dict()
+        connection = self._get_connection()
+        for i in range(0, len(entities), MAX_PARAMETERS - 1):
+            batch = entities[i:i+MAX_PARAMETERS-1]
+            rows = connection.execute(
+                f"SELECT entity, snapshot, time, version, history, metadata FROM histories WHERE prov_metadata = ? AND entity IN ({','.join('?' * len(batch))})",
+                [int(include_prov_metadata)] + batch).fetchall()
+            for entity, snapshot, time, version, history, metadata in rows:
+                if version != FORMAT_VERSION or (snapshot, time) != latest_snapshots[entity]:
+                    continue
+                metadata = json.loads(zlib.decompress(metadata)) if metadata is not None else None
+                output[entity] = (self._load_history(history), metadata)
+        return output
+
+    def put(self, entity:str, snapshot:str, time:str, history:EntitySnapshots, metadata:dict=None) -> None:
+        """
+        It stores the history of an entity, replacing the one stored before, if any.
+        The history is stored as reconstructed with the provenance metadata if they are given, without them otherwise.
+
+        :param entity: The IRI of the entity.
+        :type entity: str.
+        :param snapshot: The IRI of the latest snapshot of the entity.
+        :type snapshot: str.
+        :param time: The generation time of the latest snapshot, as recorded in the provenance.
+        :type time: str.
+        :param history: The history of the entity.
+        :type history: EntitySnapshots.
+        :param metadata: The provenance metadata of the entity, as returned by AgnosticEntity.get_history, or None if they were not requested. The default is None.
+        :type metadata: dict.
+        """
+        compressed_metadata = zlib.compress(json.dumps(metadata).encode("utf-8")) if metadata is not None else None
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO histories (entity, prov_metadata, snapshot, time, version, history, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(entity), int(metadata is not None), str(snapshot), str(time), FORMAT_VERSION, self._dump_history(history), compressed_metadata))
+
+    def clear(self) -> None:
+        """
+        It removes all the stored histories.
+        """
+        connection = self._get_connection()
+        with connection:
+            connection.execute("DELETE FROM histories")
+
+    def __len__(self) -> int:
+        return self._get_connection().execute("SELECT COUNT(*) FROM histories").fetchone()[0]
+
+    def _dump_history(self, history:EntitySnapshots) -> bytes:
+        deltas = [[time, dump_quads(added), dump_quads(removed)] for time, added, removed in history.iter_deltas()]
+        return zlib.compress(json.dumps(deltas).encode("utf-8"))
+
+    def _load_history(self, data:bytes) -> EntitySnapshots:
+        history = EntitySnapshots()
+        bnode_context = dict()
+        for index, (time, added, removed) in enumerate(json.loads(zlib.decompress(data))):
+            if index == 0:
+                history.add_newest(time, load_quads(added, bnode_context))
+            else:
+                history.add_older(time, load_quads(added, bnode_context), load_quads(removed, bnode_context))
+        return history
+
+
+_caches:Dict[str, HistoryCache] = dict()
+_caches_lock = threading.Lock()
+
+def get_history_cache(settings:dict=None) -> Optional[HistoryCache]:
+    """
+    It returns the history cache shared by the whole process for a given database, creating it at the first request,
+    or None if the cache is disabled.
+    The settings are read from the "history_cache" section of the configuration file: ::
+
+        "history_cache": {
+            "path": "./history_cache.db"
+        }
+
+    The cache is disabled if the section is missing or the path is empty.
+
+    :param settings: The "history_cache" section of the configuration file.
+    :type settings: dict.
+    :returns: Optional[HistoryCache] -- The history cache, or None if it is disabled.
+    """
+    path = (settings or dict()).get("path")
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = HistoryCache(path)
+        return _caches[path]
@@ -0,0 +1,455 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import BinaryIO, Dict, Iterator, List, Mapping, Optional, Set, Tuple, Union
+
+import gzip, json, os, threading, time
+from rdflib import ConjunctiveGraph
+from tqdm import tqdm
+
+from time_agnostic_browser.agnostic_entity import AgnosticEntity, get_entities_histories, BATCH_SIZE
+from time_agnostic_browser.config import Config, CONFIG_PATH
+from time_agnostic_browser.entity_snapshots import EntitySnapshots, Quad, dump_quads, get_quads, load_quads
+from time_agnostic_browser.prov_entity import ProvEntity
+from time_agnostic_browser.sparql import Sparql
+from time_agnostic_browser.support import convert_to_timestamp
+from time_agnostic_browser.update_query import apply_update_query
+
+
+PAST_GRAPHS_PATH = "./past_graphs.log.gz"
+# The checkpoint of the materialisation is saved next to the past graphs, with this extension
+CHECKPOINT_EXTENSION = ".checkpoint.json"
+FORMAT_VERSION = 1
+# The past graphs are refreshed before a query at most once in this many seconds, see prepare_past_graphs
+REFRESH_INTERVAL = 600
+
+
+def get_checkpoint_path(path:str) -> str:
+    """
+    It returns the path of the checkpoint of the past graphs materialised in a file.
+
+    :param path: The path to the past graphs.
+    :type path: str.
+    :returns: str -- The path to the checkpoint.
+    """
+    return path + CHECKPOINT_EXTENSION
+
+def read_checkpoint(path:str) -> Optional[dict]:
+    """
+    It returns the checkpoint of the past graphs materialised in a file, or None if there is none.
+    The checkpoint is a dictionary with the following keys: ::
+
+        {
+            "version": 1,
+            "last_entity": "https://github.com/arcangelo7/time_agnostic/ra/4",
+            "size": 20480,
+            "complete": false,
+            "watermark": "2021-06-01T18:46:41"
+        }
+
+    "last_entity" is the last entity written, in alphabetical order, "size" is the size of the file in bytes after it was written
+    and "complete" is true once all the entities have been written. 
+    "watermark" is the time of the most recent snapshot written, from which :func:`refresh_past_graphs` looks for new snapshots.
+
+    :param path: The path to the past graphs.
+    :type path: str.
+    :returns: Optional[dict] -- The checkpoint.
+    """
+    checkpoint_path = get_checkpoint_path(path)
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, encoding="utf8") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint.get("version") != FORMAT_VERSION:
+        raise ValueError(f"The past graphs in {path} were materialised in an unsupported format: materialise them again.")
+    return checkpoint
+
+def _write_checkpoint(path:str, checkpoint:dict) -> None:
+    # The checkpoint is replaced atomically, so that a crash leaves either the old one or the new one
+    checkpoint_path = get_checkpoint_path(path)
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf8") as checkpoint_file:
+        json.dump(dict(checkpoint, version=FORMAT_VERSION), checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+def _iter_forward_deltas(snapshots:Mapping[str, ConjunctiveGraph]) -> Iterator[Tuple[str, Set[Quad], Set[Quad]]]:
+    # The snapshots from the oldest to the most recent:
+    # the oldest one with all its quads as added, each of the others with the quads added and removed with respect to the previous one
+    if isinstance(snapshots, EntitySnapshots):
+        deltas = list(snapshots.iter_deltas())
+        oldest_quads = set()
+        for _, quads in snapshots.iter_quads():
+            oldest_quads = quads
+        yield deltas[-1][0], set(oldest_quads), set()
+        for index in range(len(deltas) - 1, 0, -1):
+            # The delta of a snapshot goes from the following one to it: going forward, it is reversed
+            _, added, removed = deltas[index]
+            yield deltas[index-1][0], set(removed), set(added)
+        return
+    previous_quads = set()
+    for time in sorted(snapshots, key=convert_to_timestamp):
+        quads = get_quads(snapshots[time])
+        yield time, quads - previous_quads, previous_quads - quads
+        previous_quads = quads
+
+def write_history(output:BinaryIO, entity:str, snapshots:Mapping[str, ConjunctiveGraph]) -> None:
+    """
+    It writes the history of an entity as a sequence of events, from the oldest snapshot to the most recent.
+    Each snapshot is introduced by a line with "S", the entity and the time of the snapshot, separated by tabs,
+    followed by a line for each quad added, with "+", and removed, with "-", with respect to the previous snapshot of the entity,
+    in N-Quads: ::
+
+        S	https://github.com/arcangelo7/time_agnostic/ra/4	2021-05-07T09:59:15
+        +	<https://github.com/arcangelo7/time_agnostic/ra/4> <http://xmlns.com/foaf/0.1/name> "Giulio Marini" <https://github.com/arcangelo7/time_agnostic/ra/> .
+        S	https://github.com/arcangelo7/time_agnostic/ra/4	2021-06-01T18:46:41
+        -	<https://github.com/arcangelo7/time_agnostic/ra/4> <http://xmlns.com/foaf/0.1/name> "Giulio Marini" <https://github.com/arcangelo7/time_agnostic/ra/> .
+
+    A line with "R" and the entity discards the events of the entity written before it, 
+    so that its whole history can be written again.
+
+    :param output: The binary stream to write to.
+    :type output: BinaryIO.
+    :param entity: The IRI of the entity.
+    :type entity: str.
+    :param snapshots: The graphs of the entity by snapshot time, as returned by :func:`time_agnostic_browser.agnostic_entity.get_entities_histories`.
+    :type snapshots: Mapping[str, ConjunctiveGraph].
+    """
+    for time, added, removed in _iter_forward_deltas(snapshots):
+        lines = [f"S\t{entity}\t{time}\n"]
+        lines.extend(f"+\t{line}\n" for line in dump_quads(added).split("\n") if line)
+        lines.extend(f"-\t{line}\n" for line in dump_quads(removed).split("\n") if line)
+        output.write("".join(lines).encode("utf-8"))
+
+def read_past_graphs(path:str, entities:Set[str]=None) -> Dict[str, EntitySnapshots]:
+    """
+    It reads the past graphs materialised by :func:`materialize_past_graphs`.
+
+    :param path: The path to the past graphs.
+    :type path: str.
+    :param entities: The IRIs of the entities to read. The lines of the other entities are skipped without being parsed. The default is None, that is, all the entities.
+    :type entities: Set[str].
+    :returns: Dict[str, EntitySnapshots] -- The snapshots of each entity, by entity IRI.
+    :raises: ValueError if the materialisation of the past graphs has not been completed.
+    """
+    checkpoint = read_checkpoint(path)
+    if checkpoint is not None and not checkpoint["complete"]:
+        raise ValueError(f"The materialisation of the past graphs in {path} has not been completed: resume it with materialize_past_graphs.")
+    # The events of an entity are not necessarily contiguous, since the refreshes append them at the end of the file
+    entities_events:Dict[str, List[Tuple[str, List[str], List[str]]]] = dict()
+    events = None
+    with gzip.open(path, "rt", encoding="utf-8", newline="\n") as past_graphs_file:
+        for line in past_graphs_file:
+            if line.startswith("S\t"):
+                _, entity, time = line.rstrip("\n").split("\t")
+                if entities is None or entity in entities:
+                    events = entities_events.setdefault(entity, list())
+                    events.append((time, list(), list()))
+                else:
+                    events = None
+            elif line.startswith("R\t"):
+                entities_events.pop(line.rstrip("\n").split("\t")[1], None)
+                events = None
+            elif line.startswith("+\t"):
+                if events is not None:
+                    events[-1][1].append(line[2:])
+            elif line.startswith("-\t"):
+                if events is not None:
+                    events[-1][2].append(line[2:])
+            elif line.strip():
+                raise ValueError(f"Invalid line in the past graphs in {path}: {line}")
+    return {entity: _build_snapshots(events) for entity, events in entities_events.items()}
+
+def _build_snapshots(events:List[Tuple[str, List[str], List[str]]]) -> EntitySnapshots:
+    # The events go from the oldest snapshot to the most recent, whereas EntitySnapshots is built from the most recent
+    bnode_context = dict()
+    deltas = [(time, load_quads("".join(added), bnode_context), load_quads("".join(removed), bnode_context)) for time, added, removed in events]
+    newest_quads = set()
+    for _, added, removed in deltas:
+        newest_quads.difference_update(removed)
+        newest_quads.update(added)
+    snapshots = EntitySnapshots()
+    snapshots.add_newest(deltas[-1][0], newest_quads)
+    for index in range(len(deltas) - 1, 0, -1):
+        _, added, removed = deltas[index]
+        snapshots.add_older(deltas[index-1][0], removed, added)
+    return snapshots
+
+_past_graphs:Dict[str, Tuple[Tuple[float, int], Dict[str, EntitySnapshots]]] = dict()
+_past_graphs_lock = threading.Lock()
+
+def load_past_graphs(path:str) -> Dict[str, EntitySnapshots]:
+    """
+    Like :func:`read_past_graphs`, but the past graphs are read once and shared by the whole process, until the file changes.
+
+    :param path: The path to the past graphs.
+    :type path: str.
+    :returns: Dict[str, EntitySnapshots] -- The snapshots of each entity, by entity IRI. Do not modify it.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime, stat.st_size)
+    with _past_graphs_lock:
+        if path in _past_graphs and _past_graphs[path][0] == version:
+            return _past_graphs[path][1]
+    past_graphs = read_past_graphs(path)
+    with _past_graphs_lock:
+        _past_graphs[path] = (version, past_graphs)
+    return past_graphs
+
+def _query_entities(config:Config) -> List[str]:
+    query_entities = f"""
+        SELECT DISTINCT ?entity
+        WHERE {{
+            ?snapshot <{ProvEntity.iri_specialization_of}> ?entity.
+        }}
+    """
+    return sorted(result[0] for result in Sparql(query_entities, config).run_select_query())
+
+def materialize_past_graphs(destination:str=PAST_GRAPHS_PATH, config:Union[str, Config]=CONFIG_PATH, progress_bar:bool=True) -> None:
+    """
+    It reconstructs the history of all the entities described by the provenance, once,
+    and it writes it to a gzip-compressed file, as a stream of events, see :func:`write_history`.
+    The file can be passed to AgnosticQuery as past_graphs_location, so that the entities are not reconstructed again.
+
+    The entities are processed in alphabetical order, in batches whose size is given by "batch_size"
+    in the "reconstruction" section of the configuration file, see :func:`time_agnostic_browser.agnostic_entity.get_entities_histories`.
+    After each batch, the file is synced to disk and a checkpoint is saved next to it, see :func:`read_checkpoint`.
+    If the materialisation is interrupted, calling this function again resumes it from the last checkpoint.
+    If it has already been completed, the past graphs are brought up to date with :func:`refresh_past_graphs`: 
+    remove the file and its checkpoint to materialise them again from scratch.
+
+    :param destination: The path to the file. The default is "./past_graphs.log.gz".
+    :type destination: str.
+    :param config: The path to the configuration file or the Config parsed from it. The default is "./config.json".
+    :type config: Union[str, Config].
+    :param progress_bar: True to show the progress of the materialisation. The default is True.
+    :type progress_bar: bool.
+    :raises: ValueError if the destination is the URL of a triplestore, which is not supported.
+    """
+    if destination.startswith(("http://", "https://")):
+        raise ValueError("The past graphs can only be materialised to a file.")
+    config = Config.load(config)
+    checkpoint = read_checkpoint(destination)
+    if checkpoint is not None and checkpoint["complete"]:
+        print(f"[PastGraphs:INFO] The past graphs in {destination} have already been materialised: refreshing them.")
+        refresh_past_graphs(destination, config)
+        return
+    entities = _query_entities(config)
+    directory = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(directory, exist_ok=True)
+    if checkpoint is None:
+        with open(destination, "wb"):
+            pass
+        checkpoint = {"last_entity": None, "size": 0, "complete": False, "watermark": None}
+    else:
+        # Whatever was written after the last checkpoint is discarded and written again
+        with open(destination, "r+b") as past_graphs_file:
+            past_graphs_file.truncate(checkpoint["size"])
+        entities = [entity for entity in entities if checkpoint["last_entity"] is None or entity > checkpoint["last_entity"]]
+        print(f"[PastGraphs:INFO] Resuming the materialisation of the past graphs after {checkpoint['last_entity']}.")
+    batch_size = config.get("reconstruction", dict()).get("batch_size", BATCH_SIZE)
+    pbar = tqdm(total=len(entities)) if progress_bar else None
+    with open(destination, "ab") as past_graphs_file:
+        for i in range(0, len(entities), batch_size):
+            batch = entities[i:i+batch_size]
+            entities_histories = get_entities_histories(set(batch), config=config)[0]
+            # Each batch is a gzip member of its own: the members are read as a single stream
+            watermark = checkpoint["watermark"]
+            with gzip.GzipFile(fileobj=past_graphs_file, mode="wb") as gzip_file:
+                for entity in batch:
+                    if entities_histories.get(entity):
+                        write_history(gzip_file, entity, entities_histories[entity])
+                        watermark = _get_watermark(watermark, entities_histories[entity])
+            past_graphs_file.flush()
+            os.fsync(past_graphs_file.fileno())
+            checkpoint = {"last_entity": batch[-1], "size": past_graphs_file.tell(), "complete": False, "watermark": watermark}
+            _write_checkpoint(destination, checkpoint)
+            if pbar is not None:
+                pbar.update(len(batch))
+    if pbar is not None:
+        pbar.close()
+    _write_checkpoint(destination, dict(checkpoint, complete=True))
+
+_refreshes:Dict[str, Tuple[threading.Lock, Optional[float]]] = dict()
+_refreshes_lock = threading.Lock()
+
+def prepare_past_graphs(destination:str=PAST_GRAPHS_PATH, config:Union[str, Config]=CONFIG_PATH) -> None:
+    """
+    It makes sure that the past graphs in a file can be queried, like :func:`materialize_past_graphs`, 
+    but once they have been materialised they are refreshed at most once per interval by the whole process, 
+    so that the provenance is not scanned again for every query.
+    The interval, in seconds, is given by "refresh_interval" in the "past_graphs" section of the configuration file: ::
+
+        "past_graphs": {
+            "refresh_interval": 600
+        }
+
+    If it is null, the past graphs are refreshed only the first time in the process. 
+    The default is 600.
+
+    :param destination: The path to the file. The default is "./past_graphs.log.gz".
+    :type destination: str.
+    :param config: The path to the configuration file or the Config parsed from it. The default is "./config.json".
+    :type config: Union[str, Config].
+    """
+    config = Config.load(config)
+    interval = config.get("past_graphs", dict()).get("refresh_interval", REFRESH_INTERVAL)
+    path = os.path.abspath(destination)
+    with _refreshes_lock:
+        lock, _ = _refreshes.setdefault(path, (threading.Lock(), None))
+    # The other queries on the same file wait for the refresh instead of refreshing it too
+    with lock:
+        last_refresh = _refreshes[path][1]
+        if last_refresh is not None and (interval is None or time.monotonic() - last_refresh < interval):
+            checkpoint = read_checkpoint(destination)
+            if checkpoint is not None and checkpoint["complete"]:
+                return
+        materialize_past_graphs(destination, config)
+        with _refreshes_lock:
+            _refreshes[path] = (lock, time.monotonic())
+
+def _get_watermark(watermark:Optional[str], snapshots:Mapping[str, ConjunctiveGraph]) -> Optional[str]:
+    times = list(snapshots) + ([watermark] if watermark is not None else [])
+    return max(times, key=convert_to_timestamp) if times else None
+
+def _query_new_snapshots(watermark:str, config:Config) -> Dict[str, List[Tuple[str, Optional[str]]]]:
+    # The times are compared as xsd:dateTime, without their timezone, which is discarded as in convert_to_datetime,
+    # so that the filter agrees with the watermark whether the times are typed or not and whatever their timezone. 
+    # The snapshots at the watermark itself are then discarded by comparing the timestamps
+    query_snapshots = f"""
+        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+        SELECT ?entity ?time ?updateQuery
+        WHERE {{
+            ?snapshot <{ProvEntity.iri_specialization_of}> ?entity;
+                      <{ProvEntity.iri_generated_at_time}> ?time.
+            OPTIONAL {{
+                ?snapshot <{ProvEntity.iri_has_update_query}> ?updateQuery.
+            }}
+            FILTER (xsd:dateTime(SUBSTR(STR(?time), 1, 19)) >= "{AgnosticEntity._get_snapshot_key(watermark)}"^^xsd:dateTime)
+        }}
+    """
+    watermark_timestamp = convert_to_timestamp(watermark)
+    new_snapshots:Dict[str, List[Tuple[str, Optional[str]]]] = dict()
+    for entity, time, update_query in Sparql(query_snapshots, config).run_select_query():
+        if convert_to_timestamp(time) > watermark_timestamp:
+            new_snapshots.setdefault(entity, list()).append((time, update_query))
+    for snapshots in new_snapshots.values():
+        snapshots.sort(key=lambda snapshot: convert_to_timestamp(snapshot[0]))
+    return new_snapshots
+
+def _extend_history(output:BinaryIO, entity:str, snapshots:EntitySnapshots, new_snapshots:List[Tuple[str, Optional[str]]]) -> Optional[str]:
+    # The update queries of the new snapshots are applied forward, from the most recent snapshot written, 
+    # and the events are appended only once all of them have been applied. 
+    # The snapshots with the same key are written as one, like in EntitySnapshots.
+    # It returns the time of the most recent snapshot written, or None if there was nothing new.
+    last_time = next(iter(snapshots))
+    quads = snapshots.get_quads(last_time)
+    events:List[Tuple[str, Set[Quad], Set[Quad]]] = list()
+    for time, update_query in new_snapshots:
+        key = AgnosticEntity._get_snapshot_key(time)
+        if convert_to_timestamp(key) <= convert_to_timestamp(last_time):
+            continue
+        if events and events[-1][0] == key:
+            events.pop()
+        else:
+            previous_quads = set(quads)
+        if update_query is not None:
+            apply_update_query(quads, update_query)
+        events.append((key, quads - previous_quads, previous_quads - quads))
+    lines = list()
+    for key, added, removed in events:
+        lines.append(f"S\t{entity}\t{key}\n")
+        lines.extend(f"+\t{line}\n" for line in dump_quads(added).split("\n") if line)
+        lines.extend(f"-\t{line}\n" for line in dump_quads(removed).split("\n") if line)
+    output.write("".join(lines).encode("utf-8"))
+    return events[-1][0] if events else None
+
+def refresh_past_graphs(path:str=PAST_GRAPHS_PATH, config:Union[str, Config]=CONFIG_PATH) -> Set[str]:
+    """
+    It brings the past graphs materialised by :func:`materialize_past_graphs` up to date, 
+    looking for the snapshots generated after the watermark saved in the checkpoint, 
+    that is, whose prov:generatedAtTime follows the most recent one written.
+    Only the entities with new snapshots are read from the file, and the update queries of the new snapshots
+    are applied to their most recent state, so that the cost is proportional to the changes rather than to the dataset. 
+    The new events are appended to the file, which is then synced to disk before the checkpoint is updated: 
+    if the refresh is interrupted, the next one starts again from the previous checkpoint.
+    The entities that did not exist yet, and the ones whose update queries cannot be applied forward, 
+    are reconstructed from scratch and their whole history is written again.
+
+    .. CAUTION::
+        The snapshots are found by their time, not by their IRI: a snapshot added to the provenance 
+        after the watermark was saved, but generated at or before it, is never picked up. 
+        This happens only if the provenance is not written in chronological order, for example when it is imported late from another source.
+        In that case, remove the file and its checkpoint and materialise the past graphs again.
+
+    :param path: The path to the past graphs. The default is "./past_graphs.log.gz".
+    :type path: str.
+    :param config: The path to the configuration file or the Config parsed from it. The default is "./config.json".
+    :type config: Union[str, Config].
+    :returns: Set[str] -- The IRIs of the entities updated.
+    :raises: ValueError if the materialisation of the past graphs has not been completed.
+    """
+    config = Config.load(config)
+    checkpoint = read_checkpoint(path)
+    if checkpoint is None or not checkpoint["complete"]:
+        raise ValueError(f"The materialisation of the past graphs in {path} has not been completed: resume it with materialize_past_graphs.")
+    if checkpoint["watermark"] is None:
+        # Nothing has been written yet: every snapshot is new
+        new_snapshots = {entity: list() for entity in _query_entities(config)}
+    else:
+        new_snapshots = _query_new_snapshots(checkpoint["watermark"], config)
+    if not new_snapshots:
+        print(f"[PastGraphs:INFO] The past graphs in {path} are up to date.")
+        return set()
+    # Whatever was written after the last checkpoint is discarded and written again
+    with open(path, "r+b") as past_graphs_file:
+        past_graphs_file.truncate(checkpoint["size"])
+    past_graphs = read_past_graphs(path, set(new_snapshots))
+    updated_entities = set()
+    entities_to_rebuild = list()
+    watermark = checkpoint["watermark"]
+    with open(path, "ab") as past_graphs_file:
+        with gzip.GzipFile(fileobj=past_graphs_file, mode="wb") as gzip_file:
+            for entity in sorted(new_snapshots):
+                if entity not in past_graphs:
+                    entities_to_rebuild.append(entity)
+                    continue
+                try:
+                    last_time = _extend_history(gzip_file, entity, past_graphs[entity], new_snapshots[entity])
+                except ValueError:
+                    entities_to_rebuild.append(entity)
+                    continue
+                if last_time is not None:
+                    updated_entities.add(entity)
+                    watermark = max(watermark, last_time, key=convert_to_timestamp)
+            batch_size = config.get("reconstruction", dict()).get("batch_size", BATCH_SIZE)
+            for i in range(0, len(entities_to_rebuild), batch_size):
+                batch = entities_to_rebuild[i:i+batch_size]
+                entities_histories = get_entities_histories(set(batch), config=config)[0]
+                for entity in batch:
+                    if entities_histories.get(entity):
+                        if entity in past_graphs:
+                            gzip_file.write(f"R\t{entity}\n".encode("utf-8"))
+                        write_history(gzip_file, entity, entities_histories[entity])
+                        updated_entities.add(entity)
+                        watermark = _get_watermark(watermark, entities_histories[entity])
+        past_graphs_file.flush()
+        os.fsync(past_graphs_file.fileno())
+        _write_checkpoint(path, dict(checkpoint, size=past_graphs_file.tell(), watermark=watermark))
+    print(f"[PastGraphs:INFO] {len(updated_entities)} entities updated in the past graphs in {path}.")
+    return updated_entities
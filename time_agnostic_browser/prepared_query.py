@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import List, Optional
+
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from rdflib import Graph, Variable
+from rdflib.plugins.sparql.algebra import translateUpdate
+from rdflib.plugins.sparql.parser import parseUpdate
+from rdflib.plugins.sparql.processor import prepareQuery
+from rdflib.plugins.sparql.sparql import Query
+from rdflib.plugins.sparql.update import evalUpdate
+from rdflib.plugins.sparql.parserutils import CompValue
+
+
+MAX_PREPARED_QUERIES = 1024
+# The parser of rdflib is not thread-safe: every text is parsed holding this lock
+_parser_lock = threading.Lock()
+
+
+@dataclass(frozen=True, eq=False)
+class PreparedQuery:
+    """
+    A SPARQL query parsed and translated into algebra.
+
+    :param text: The text of the query.
+    :type text: str.
+    :param query: The query as returned by rdflib's prepareQuery, which can be passed to Graph.query in place of the text.
+    :type query: rdflib.plugins.sparql.sparql.Query.
+    :param algebra: The algebra of the query.
+    :type algebra: CompValue.
+    :param variables: The projected variables, or None if the query does not project variables, as in the case of a CONSTRUCT.
+    :type variables: List[Variable].
+    :param limit: The value of the LIMIT clause, or None if there is no LIMIT.
+    :type limit: int.
+    """
+    text: str
+    query: Query
+    algebra: CompValue
+    variables: Optional[List[Variable]]
+    limit: Optional[int]
+
+
+@lru_cache(maxsize=MAX_PREPARED_QUERIES)
+def prepare_query(query:str) -> PreparedQuery:
+    """
+    It parses a SPARQL query, unless it has already been parsed.
+    The last 1024 queries parsed are kept in memory,
+    so that the same text is never parsed twice while it is in use.
+
+    :param query: The text of a SPARQL query.
+    :type query: str.
+    :returns: PreparedQuery -- The parsed query, its algebra, its projected variables and its LIMIT.
+    """
+    with _parser_lock:
+        prepared_query:Query = prepareQuery(query)
+    algebra:CompValue = prepared_query.algebra
+    variables = list(algebra["PV"]) if "PV" in algebra else None
+    limit = int(algebra["p"]["length"]) if "length" in algebra["p"] else None
+    return PreparedQuery(text=query, query=prepared_query, algebra=algebra, variables=variables, limit=limit)
+
+def parse_update(update_query:str) -> CompValue:
+    """
+    It parses a SPARQL update query, one at a time with the other queries parsed by this module,
+    since the parser of rdflib is not thread-safe. The update queries are not cached, as each of them is usually parsed once.
+
+    :param update_query: The text of a SPARQL update query.
+    :type update_query: str.
+    :returns: CompValue -- The parse tree of the update query, as returned by rdflib's parseUpdate.
+    """
+    with _parser_lock:
+        return parseUpdate(update_query)
+
+def process_update(graph:Graph, update_query:str) -> None:
+    """
+    Like rdflib's processUpdate, it applies a SPARQL update query to a graph, 
+    but the query is parsed under the same lock as the others, see :func:`parse_update`.
+
+    :param graph: The graph to update.
+    :type graph: Graph.
+    :param update_query: The text of a SPARQL update query.
+    :type update_query: str.
+    """
+    evalUpdate(graph, translateUpdate(parse_update(update_query)))
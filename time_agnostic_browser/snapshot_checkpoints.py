@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import os, sqlite3, threading, zlib
+
+from time_agnostic_browser.entity_snapshots import Quad, dump_quads, load_quads
+
+
+# The version of the format of the stored checkpoints: rows written in another format are ignored
+FORMAT_VERSION = 1
+# A checkpoint is stored every INTERVAL snapshots of an entity
+INTERVAL = 50
+
+
+class SnapshotCheckpoints:
+    """
+    A persistent store of checkpoints, that is, of the full graphs of the entities at some of their snapshots, 
+    stored in a SQLite database. A checkpoint is identified by the entity and by the IRI of the snapshot, 
+    and it never becomes outdated, because a new snapshot does not change the graphs of the previous ones.
+    Starting from the nearest checkpoint, the graph of an entity at any snapshot can be obtained 
+    by replaying at most interval / 2 update queries, forward or backward, whatever the number of snapshots of the entity.
+    Each graph is stored as N-Quads compressed with zlib.
+
+    :param path: The path to the SQLite database, which is created if it does not exist.
+    :type path: str.
+    :param interval: A checkpoint is stored every interval snapshots, counting from the first one. The default is 50.
+    :type interval: int.
+    """
+    def __init__(self, path:str, interval:int=INTERVAL):
+        if interval < 1:
+            raise ValueError("The interval between checkpoints must be at least 1.")
+        self.path = os.path.abspath(path)
+        self.interval = interval
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._get_connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    entity TEXT NOT NULL,
+                    snapshot TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    quads BLOB NOT NULL,
+                    PRIMARY KEY (entity, snapshot))
+            """)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared among threads: each thread opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def is_checkpoint(self, index:int) -> bool:
+        """
+        It tells whether the snapshot at a given position is one of those to be stored as checkpoints.
+
+        :param index: The position of the snapshot among those of the entity, from the oldest, which is 0.
+        :type index: int.
+        :returns: bool -- True if the snapshot is to be stored as a checkpoint.
+        """
+        return index % self.interval == 0
+
+    def get_snapshots(self, entity:str) -> Set[str]:
+        """
+        It returns the snapshots of an entity for which a checkpoint is stored.
+
+        :param entity: The IRI of the entity.
+        :type entity: str.
+        :returns: Set[str] -- The IRIs of the snapshots.
+        """
+        rows = self._get_connection().execute(
+            "SELECT snapshot FROM checkpoints WHERE entity = ? AND version = ?", (str(entity), FORMAT_VERSION)).fetchall()
+        return {row[0] for row in rows}
+
+    def get(self, entity:str, snapshot:str) -> Optional[Set[Quad]]:
+        """
+        It returns the graph of an entity at a snapshot, if it is stored.
+
+        :param entity: The IRI of the entity.
+        :type entity: str.
+        :param snapshot: The IRI of the snapshot.
+        :type snapshot: str.
+        :returns: Optional[Set[Quad]] -- The quads of the graph, or None if no checkpoint is stored for the snapshot.
+        """
+        row = self._get_connection().execute(
+            "SELECT quads FROM checkpoints WHERE entity = ? AND snapshot = ? AND version = ?", (str(entity), str(snapshot), FORMAT_VERSION)).fetchone()
+        if row is None:
+            return None
+        return load_quads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put_many(self, entity:str, checkpoints:Iterable[Tuple[str, Set[Quad]]]) -> None:
+        """
+        It stores the graphs of an entity at some snapshots, in a single transaction.
+
+        :param entity: The IRI of the entity.
+        :type entity: str.
+        :param checkpoints: The IRI of each snapshot and the quads of the graph of the entity at that snapshot.
+        :type checkpoints: Iterable[Tuple[str, Set[Quad]]].
+        """
+        rows = [(str(entity), str(snapshot), FORMAT_VERSION, zlib.compress(dump_quads(quads).encode("utf-8"))) for snapshot, quads in checkpoints]
+        connection = self._get_connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO checkpoints (entity, snapshot, version, quads) VALUES (?, ?, ?, ?)", rows)
+
+    def clear(self) -> None:
+        """
+        It removes all the stored checkpoints.
+        """
+        connection = self._get_connection()
+        with connection:
+            connection.execute("DELETE FROM checkpoints")
+
+    def __len__(self) -> int:
+        return self._get_connection().execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+
+
+_checkpoints:Dict[str, SnapshotCheckpoints] = dict()
+_checkpoints_lock = threading.Lock()
+
+def get_snapshot_checkpoints(settings:dict=None) -> Optional[SnapshotCheckpoints]:
+    """
+    It returns the checkpoints shared by the whole process for a given database, creating them at the first request,
+    or None if the checkpoints are disabled.
+    The settings are read from the "checkpoints" section of the configuration file: ::
+
+        "checkpoints": {
+            "path": "./checkpoints.db",
+            "interval": 50
+        }
+
+    The checkpoints are disabled if the section is missing or the path is empty.
+
+    :param settings: The "checkpoints" section of the configuration file.
+    :type settings: dict.
+    :returns: Optional[SnapshotCheckpoints] -- The checkpoints, or None if they are disabled.
+    """
+    settings = settings or dict()
+    path = settings.get("path")
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    with _checkpoints_lock:
+        if path not in _checkpoints:
+            _checkpoints[path] = SnapshotCheckpoints(path, settings.get("interval", INTERVAL))
+        return _checkpoints[path]
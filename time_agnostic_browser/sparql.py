@@ -15,30 +15,45 @@
 # SOFTWARE.
 
 from pprint import pprint
-from typing import Set, Tuple
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-import os, subprocess
-from SPARQLWrapper import SPARQLWrapper, POST, RDFXML, JSON
-from rdflib import ConjunctiveGraph, XSD
+import os, re, subprocess, json, threading, time, warnings
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from functools import partial
+from urllib.parse import urlencode
+from rdflib import ConjunctiveGraph, Graph, XSD
 from rdflib.term import _toPythonMapping
 from rdflib.term import URIRef, Literal
-from rdflib.plugins.sparql.processor import prepareQuery
-from rdflib.plugins.sparql.sparql import Query
+from rdflib.parser import InputSource
 from rdflib.plugins.sparql.parserutils import CompValue
 from time_agnostic_browser import prov_entity
 
 
-from time_agnostic_browser.support import FileManager
-from time_agnostic_browser.prov_entity import ProvEntity
+from time_agnostic_browser.config import Config, CONFIG_PATH
+from time_agnostic_browser.connection_pool import get_pool
+from time_agnostic_browser.graph_store import get_graph_store
+from time_agnostic_browser.prepared_query import prepare_query
+from time_agnostic_browser.sparql_results import iter_bindings, to_node
 
 
-CONFIG_PATH = "./config.json"
+MAX_WORKERS = 1
+SELECT_QUADS = re.compile(
+    r"(?P<prologue>(?:(?!\bSELECT\b).)*)SELECT\s+(?:DISTINCT\s+|REDUCED\s+)?\?(?P<s>\w+)\s+\?(?P<p>\w+)\s+\?(?P<o>\w+)\s+\?(?P<c>\w+)\s*(?=WHERE\b|\{)",
+    re.IGNORECASE | re.DOTALL)
+PAGE_SIZE = 10000
+TRAILING_LIMIT = re.compile(r"\bLIMIT\s+\d+\s*$", re.IGNORECASE)
+# The algebra operators of the queries whose solutions cannot be split in pages by appending ORDER BY, LIMIT and OFFSET
+UNPAGEABLE_NODES = {"OrderBy", "Group", "AggregateJoin"}
+# The deadline of the fan-out that each worker thread is querying a source for, if any
+_deadlines = threading.local()
 
 class Sparql:
     """
     The Sparql class handles SPARQL queries.
     It is instantiated by passing as a parameter 
-    the path to a configuration file, whose default location is "./config.json".
+    the path to a configuration file, whose default location is "./config.json", 
+    or a :class:`time_agnostic_browser.config.Config` already parsed from it.
     The configuration file must be in JSON format and contain information on the sources to be queried. 
     There are two types of sources, dataset sources and provenance sources, and they need to be specified separately. 
     Each must contain the URLs of the triplestore on which to search for information and/or the paths of the files that 
@@ -52,23 +67,64 @@ class Sparql:
             "provenance": {
                 "triplestore_urls": [],
                 "file_paths": ["./test/scientometrics_prov.json"]
-            }
+            },
+            "connection_pool": {
+                "pool_size": 10,
+                "timeout": 60,
+                "retries": 3,
+                "backoff_factor": 0.5
+            },
+            "graph_store": {
+                "max_triples": 5000000
+            },
+            "fan_out": {
+                "max_workers": 4,
+                "timeout": 120,
+                "allow_partial_results": false
+            },
+            "pagination": {
+                "page_size": 10000
+            },
+            "construct_quads": false
         }            
 
-    :param config_path: The path to the configuration file.
+    The "connection_pool" section is optional. The connections to each triplestore are kept alive 
+    and shared by all the Sparql instances, see :func:`time_agnostic_browser.connection_pool.get_pool`.
+    The "graph_store" section is optional too. Each file is parsed once and kept in memory 
+    until it changes, see :func:`time_agnostic_browser.graph_store.get_graph_store`.
+    The "fan_out" section is optional as well. If "max_workers" is greater than 1, 
+    the sources are queried concurrently by up to that many threads, and a source that does not answer 
+    within "timeout" seconds from when a thread starts querying it is given up, 
+    so that the sources waiting for a free thread are not penalised. The requests given up are abandoned rather than cancelled, 
+    but the socket timeout of each of them is the time left before its deadline, 
+    so that they end on their own and release their threads and connections soon after. 
+    The queries on files cannot be interrupted and run to the end. Whatever the order in which the sources answer, their results are merged 
+    in the order in which they appear in the configuration file. If a source fails, an exception is raised, 
+    unless "allow_partial_results" is true: in that case the results of the other sources are returned and 
+    the failed sources are reported in the failed_sources attribute, a dictionary from each source to its exception, 
+    and with a RuntimeWarning.
+    The "pagination" section is optional: "page_size" is the number of solutions requested at a time 
+    by :meth:`iter_construct_query`.
+    The "construct_quads" option is false by default. If it is true, the SELECT queries that return quads,
+    such as SELECT ?s ?p ?o ?c, are sent to the triplestores as CONSTRUCT queries with a GRAPH template,
+    and the results are requested and parsed as N-Quads rather than as SPARQL results in JSON.
+    It is a SPARQL 1.1 extension: enable it only if the triplestores support quads in the CONSTRUCT template.
+
+    :param config: The path to the configuration file or the Config parsed from it.
+    :type config: Union[str, Config].
+    :param config_path: Deprecated, use config instead.
     :type config_path: str.
     """
-    def __init__(self, query:str, config_path:str=CONFIG_PATH):
+    def __init__(self, query:str, config:Union[str, Config]=CONFIG_PATH, config_path:str=None):
         self.query = query
-        config_path = config_path
-        prov_properties = ProvEntity.get_prov_properties()
-        config:list = FileManager(config_path).import_json()
-        if any(uri in query for uri in prov_properties):
-            self.storer:dict = config["provenance"]
-        else:
-            self.storer:dict = config["dataset"]
-        if self.storer["triplestore_urls"]:
-            pass
+        config = Config.load(config, config_path)
+        self.storer:dict = config.get_storer(query)
+        self.pool_settings:dict = config.get("connection_pool", dict())
+        self.graph_store = get_graph_store(config.get("graph_store", dict()))
+        self.fan_out_settings:dict = config.get("fan_out", dict())
+        self.construct_quads:bool = config.get("construct_quads", False)
+        self.pagination_settings:dict = config.get("pagination", dict())
+        self.failed_sources:dict = dict()
         self._hack_dates()
 
     @classmethod
@@ -87,43 +143,135 @@ class Sparql:
         :returns:  Set[Tuple] -- A set of tuples, in which the positional value of the tuples corresponds to the positional value of the variables indicated in the query.
         """
         output = set()
-        if self.storer["file_paths"]:
-            output.update(self._get_tuples_from_files())
-        if self.storer["triplestore_urls"]:
-            output.update(self._get_tuples_from_triplestores())
+        sources = self._get_sources(self._get_tuples_from_file, self._get_tuples_from_triplestore)
+        self._fan_out(sources, output.update)
         output = set(self._cut_by_limit(list(output)))
         return output
 
+    def _get_sources(self, file_function:Callable, triplestore_function:Callable) -> List[Tuple[str, Callable]]:
+        sources = [(file_path, partial(file_function, file_path)) for file_path in self.storer["file_paths"]]
+        sources.extend((url, partial(triplestore_function, url)) for url in self.storer["triplestore_urls"])
+        return sources
+
+    def _fan_out(self, sources:List[Tuple[str, Callable]], merge:Callable) -> None:
+        # The results are merged as soon as they arrive, but always in the order of the sources in the configuration file:
+        # a result that arrives before those of the previous sources waits for them
+        self.failed_sources = dict()
+        max_workers = self.fan_out_settings.get("max_workers", MAX_WORKERS)
+        if max_workers <= 1 or len(sources) <= 1:
+            for source, function in sources:
+                try:
+                    merge(function())
+                except Exception as e:
+                    self.failed_sources[source] = e
+        else:
+            timeout = self.fan_out_settings.get("timeout", None)
+            executor = ThreadPoolExecutor(max_workers=min(max_workers, len(sources)))
+            # The time at which each source is picked up by a worker, from which its timeout runs
+            started:Dict[int, float] = dict()
+            futures = [executor.submit(self._call_by_deadline, function, timeout, started, index) for index, (_, function) in enumerate(sources)]
+            pending = set(futures)
+            given_up:Set[int] = set()
+            next_to_merge = 0
+            while pending:
+                remaining = None
+                if timeout is not None:
+                    # A source picked up later than now would have a later deadline
+                    deadlines = [started[index] + timeout for index, future in enumerate(futures) if future in pending and index in started]
+                    remaining = max(min(deadlines) - time.monotonic(), 0) if deadlines else timeout
+                _, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                if timeout is not None:
+                    now = time.monotonic()
+                    for index, future in enumerate(futures):
+                        if future in pending and index in started and now >= started[index] + timeout:
+                            pending.discard(future)
+                            given_up.add(index)
+                            self.failed_sources[sources[index][0]] = TimeoutError(f"No answer within {timeout} seconds")
+                while next_to_merge < len(futures) and (next_to_merge in given_up or futures[next_to_merge].done()):
+                    if next_to_merge not in given_up:
+                        self._merge_future(sources[next_to_merge][0], futures[next_to_merge], merge)
+                    next_to_merge += 1
+            executor.shutdown(wait=False)
+        if self.failed_sources:
+            if len(self.failed_sources) == len(sources) or not self.fan_out_settings.get("allow_partial_results", False):
+                raise next(iter(self.failed_sources.values()))
+            for source, e in self.failed_sources.items():
+                warnings.warn(f"The source {source} was skipped: {e!r}", RuntimeWarning)
+
+    @classmethod
+    def _call_by_deadline(cls, function:Callable, timeout:Optional[float], started:Dict[int, float], index:int):
+        started[index] = time.monotonic()
+        _deadlines.deadline = started[index] + timeout if timeout is not None else None
+        try:
+            return function()
+        finally:
+            _deadlines.deadline = None
+
+    def _merge_future(self, source:str, future:Future, merge:Callable) -> None:
+        try:
+            result = future.result()
+        except Exception as e:
+            self.failed_sources[source] = e
+            return
+        merge(result)
+
     def _get_tuples_from_files(self) -> Set[Tuple]:
         output = set()
         storer = self.storer["file_paths"]
         for file_path in storer:
-            file_cg = ConjunctiveGraph()
-            file_cg.parse(location=file_path, format="json-ld")
-            results = file_cg.query(self.query)
-            for result in results:
-                result_tuple = tuple(str(var) for var in result)
-                output.add(result_tuple)
+            output.update(self._get_tuples_from_file(file_path))
+        return output
+
+    def _get_tuples_from_file(self, file_path:str) -> Set[Tuple]:
+        output = set()
+        file_cg = self.graph_store.get_graph(file_path)
+        results = file_cg.query(prepare_query(self.query).query)
+        for result in results:
+            result_tuple = tuple(str(var) for var in result)
+            output.add(result_tuple)
         return output
     
+    def _post_query(self, url:str, accept:str) -> bytes:
+        with self._stream_query(url, accept) as response:
+            return response.read()
+
+    @contextmanager
+    def _stream_query(self, url:str, accept:str, query:str=None) -> Iterator[BinaryIO]:
+        pool = get_pool(url, self.pool_settings)
+        body = urlencode({"query": query or self.query}).encode("utf-8")
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": accept
+        }
+        # Within a fan-out with a deadline, the request must end by the deadline
+        timeout = None
+        deadline = getattr(_deadlines, "deadline", None)
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise TimeoutError("The deadline of the query has passed")
+            if pool.timeout is not None:
+                timeout = min(timeout, pool.timeout)
+        with pool.stream("POST", body, headers, timeout) as response:
+            yield response
+
+    def _iter_bindings(self, url:str, query:str=None) -> Iterator[Dict[str, Dict[str, str]]]:
+        # The bindings are parsed while the response is read, so that the whole document is never in memory
+        with self._stream_query(url, "application/sparql-results+json", query) as response:
+            yield from iter_bindings(response)
+
     def _get_tuples_from_triplestores(self) -> Set[Tuple]:
         output = set()
         storer = self.storer["triplestore_urls"]
         for url in storer:
-            sparql = SPARQLWrapper(url)
-            sparql.setMethod(POST)
-            sparql.setQuery(self.query)
-            sparql.setReturnFormat(JSON)
-            results = sparql.queryAndConvert()
-            vars_list = prepareQuery(self.query).algebra["PV"]
-            for result_dict in results["results"]["bindings"]:
-                results_list = list()
-                for var in vars_list:
-                    if str(var) in result_dict:
-                        results_list.append(result_dict[str(var)]["value"])
-                    else:
-                        results_list.append(None)
-                output.add(tuple(results_list))
+            output.update(self._get_tuples_from_triplestore(url))
+        return output
+
+    def _get_tuples_from_triplestore(self, url:str) -> Set[Tuple]:
+        output = set()
+        vars_list = [str(var) for var in prepare_query(self.query).variables]
+        for result_dict in self._iter_bindings(url):
+            output.add(tuple(result_dict[var]["value"] if var in result_dict else None for var in vars_list))
         return output
         
     def run_construct_query(self) -> ConjunctiveGraph:
@@ -135,69 +283,171 @@ class Sparql:
         :returns:  ConjunctiveGraph -- A ConjunctiveGraph containing the results of the query. 
         """
         cg = ConjunctiveGraph()
-        if self.storer["file_paths"]:
-            results = self._get_graph_from_files()
-            for quad in results.quads():
-                cg.add(quad)
-        if self.storer["triplestore_urls"]:
-            results = self._get_graph_from_triplestores()
+        def merge(results:ConjunctiveGraph) -> None:
             for quad in results.quads():
                 cg.add(quad)
+        sources = self._get_sources(self._get_graph_from_file, self._get_graph_from_triplestore)
+        self._fan_out(sources, merge)
         cg = self._cut_by_limit(cg)
         return cg
     
+    def iter_construct_query(self, page_size:int=None) -> Iterator[ConjunctiveGraph]:
+        """
+        Like :meth:`run_construct_query`, but the results are fetched and returned one page at a time, 
+        so that they can be processed while the next pages are downloaded and are never all in memory.
+        Each triplestore is asked for the solutions of the query sorted by all its variables, 
+        page_size at a time, with LIMIT and OFFSET, until a page holds fewer solutions than requested, 
+        or, if the triplestore returns triples rather than solutions, until a page is empty. 
+        If the query has a LIMIT, no solution beyond it is requested. 
+        The queries that cannot be split in pages, that is, those with ORDER BY, OFFSET or GROUP BY, 
+        are sent as they are, as a single page. Each file is a single page as well.
+        The sources are queried one after the other: the "fan_out" section of the configuration file is ignored, 
+        except for "allow_partial_results".
+
+        :param page_size: The number of solutions in each page. The default is the "page_size" of the "pagination" section of the configuration file, or 10000.
+        :type page_size: int.
+        :returns: Iterator[ConjunctiveGraph] -- The pages of results.
+        """
+        page_size = page_size or self.pagination_settings.get("page_size", PAGE_SIZE)
+        self.failed_sources = dict()
+        sources = [(file_path, True) for file_path in self.storer["file_paths"]] + [(url, False) for url in self.storer["triplestore_urls"]]
+        for source, is_file in sources:
+            try:
+                for page in ([self._get_graph_from_file(source)] if is_file else self._iter_pages_from_triplestore(source, page_size)):
+                    yield page
+            except Exception as e:
+                if not self.fan_out_settings.get("allow_partial_results", False):
+                    raise
+                self.failed_sources[source] = e
+                warnings.warn(f"The source {source} was skipped: {e!r}", RuntimeWarning)
+        if sources and len(self.failed_sources) == len(sources):
+            raise next(iter(self.failed_sources.values()))
+
+    def _iter_pages_from_triplestore(self, url:str, page_size:int) -> Iterator[ConjunctiveGraph]:
+        order_by = self._get_order_by()
+        if order_by is None:
+            yield self._get_graph_from_triplestore(url)
+            return
+        # The LIMIT of the query, if any, is replaced by those of the pages
+        query = TRAILING_LIMIT.sub("", self.query)
+        limit = prepare_query(self.query).limit
+        offset = 0
+        while limit is None or offset < limit:
+            size = page_size if limit is None else min(page_size, limit - offset)
+            page, solutions = self._get_page_from_triplestore(url, f"{query}\nORDER BY {order_by}\nLIMIT {size}\nOFFSET {offset}")
+            if not len(page) and not solutions:
+                return
+            yield page
+            # A page with fewer solutions than requested is the last one. 
+            # If the number of solutions is unknown, the pages are requested until one is empty
+            if solutions is not None and solutions < size:
+                return
+            offset += size
+
+    def _get_order_by(self) -> Optional[str]:
+        # The variables by which the solutions are sorted, so that the pages do not overlap, 
+        # or None if the query already has solution modifiers that paging would conflict with
+        prepared_query = prepare_query(self.query)
+        if self._contains_nodes(prepared_query.algebra, UNPAGEABLE_NODES):
+            return None
+        if prepared_query.limit is not None and not TRAILING_LIMIT.search(self.query):
+            return None
+        # The solution modifiers must follow the WHERE clause: a trailing VALUES clause would precede them
+        if not TRAILING_LIMIT.sub("", self.query).rstrip().endswith("}"):
+            return None
+        variables = prepared_query.variables if prepared_query.variables is not None else sorted(prepared_query.algebra["p"]["_vars"])
+        if not variables:
+            return None
+        return " ".join(variable.n3() for variable in variables)
+
+    @classmethod
+    def _contains_nodes(cls, node, names:Set[str]) -> bool:
+        if isinstance(node, CompValue):
+            if node.name in names or (node.name == "Slice" and node.get("start")):
+                return True
+            return any(cls._contains_nodes(value, names) for value in node.values())
+        if isinstance(node, (list, tuple)):
+            return any(cls._contains_nodes(value, names) for value in node)
+        return False
+
     def _get_graph_from_files(self) -> ConjunctiveGraph:
         cg = ConjunctiveGraph()
         storer = self.storer["file_paths"]
         for file_path in storer:
-            file_cg = ConjunctiveGraph()
-            file_cg.parse(location=file_path, format="json-ld")
-            results = file_cg.query(self.query)
-            for result in results:
-                cg.add(result)
+            cg += self._get_graph_from_file(file_path)
+        return cg
+
+    def _get_graph_from_file(self, file_path:str) -> ConjunctiveGraph:
+        cg = ConjunctiveGraph()
+        file_cg = self.graph_store.get_graph(file_path)
+        results = file_cg.query(prepare_query(self.query).query)
+        for result in results:
+            cg.add(result)
         return cg
 
     def _get_graph_from_triplestores(self) -> ConjunctiveGraph:
         cg = ConjunctiveGraph()
         storer = self.storer["triplestore_urls"]
-        prepare_query:Query = prepareQuery(self.query)
-        algebra:CompValue = prepare_query.algebra
         for url in storer:
-            sparql = SPARQLWrapper(url)
-            sparql.setMethod(POST)
-            sparql.setQuery(self.query)
-            # A SELECT hack can be used to return RDF quads in named graphs, 
-            # since the CONSTRUCT allows only to return triples in SPARQL 1.1.
-            # Here is an exemple of SELECT hack
-            #
-            # SELECT DISTINCT ?s ?p ?o ?c
-            # WHERE {
-            #     GRAPH ?c {?s ?p ?o}
-            #     BIND (<{self.res}> AS ?s)
-            # }}
-            #
-            # Aftwerwards, the rdflib add method can be used to add quads to a Conjunctive Graph, 
-            # where the fourth element is the context.    
-            if algebra.name == "SelectQuery":
-                sparql.setReturnFormat(JSON)
-                results = sparql.queryAndConvert()
-                for quad in results["results"]["bindings"]:
-                    quad_to_add = list()
-                    for var in results["head"]["vars"]:
-                        if quad[var]["type"] == "uri":
-                            quad_to_add.append(URIRef(quad[var]["value"]))
-                        elif quad[var]["type"] == "literal":
-                            quad_to_add.append(Literal(quad[var]["value"]))
-                    cg.add(tuple(quad_to_add))
-            elif algebra.name == "ConstructQuery":
-                sparql.setReturnFormat(RDFXML)
-                cg += sparql.queryAndConvert()            
+            for quad in self._get_graph_from_triplestore(url).quads():
+                cg.add(quad)
         return cg
+
+    def _get_graph_from_triplestore(self, url:str, query:str=None) -> ConjunctiveGraph:
+        return self._get_page_from_triplestore(url, query)[0]
+
+    def _get_page_from_triplestore(self, url:str, query:str=None) -> Tuple[ConjunctiveGraph, Optional[int]]:
+        # It returns the graph and the number of solutions it was built from, 
+        # which is known only if the solutions are read as bindings: 
+        # the triples of a CONSTRUCT do not correspond one to one to the solutions
+        query = query or self.query
+        cg = ConjunctiveGraph()
+        solutions = None
+        algebra:CompValue = prepare_query(self.query).algebra
+        # A SELECT hack can be used to return RDF quads in named graphs, 
+        # since the CONSTRUCT allows only to return triples in SPARQL 1.1.
+        # Here is an exemple of SELECT hack
+        #
+        # SELECT DISTINCT ?s ?p ?o ?c
+        # WHERE {
+        #     GRAPH ?c {?s ?p ?o}
+        #     BIND (<{self.res}> AS ?s)
+        # }}
+        #
+        # Aftwerwards, the rdflib add method can be used to add quads to a Conjunctive Graph, 
+        # where the fourth element is the context.    
+        if algebra.name == "SelectQuery":
+            construct_query = self._to_quads_construct_query(query) if self.construct_quads else None
+            if construct_query is not None:
+                # The N-Quads are parsed line by line while the response is read
+                with self._stream_query(url, "application/n-quads", construct_query) as response:
+                    input_source = InputSource(url)
+                    input_source.setByteStream(response)
+                    cg.parse(source=input_source, format="nquads")
+            else:
+                vars_list = [str(var) for var in prepare_query(self.query).variables]
+                solutions = 0
+                for quad in self._iter_bindings(url, query):
+                    cg.add(tuple(to_node(quad[var]) for var in vars_list))
+                    solutions += 1
+        elif algebra.name == "ConstructQuery":
+            with self._stream_query(url, "application/rdf+xml", query) as response:
+                cg += Graph().parse(data=response.read(), format="xml")
+        return cg, solutions
     
+    def _to_quads_construct_query(self, query:str=None) -> Optional[str]:
+        # SELECT [DISTINCT] ?s ?p ?o ?c WHERE {...} becomes CONSTRUCT {GRAPH ?c {?s ?p ?o}} WHERE {...}.
+        # None is returned if the query does not project exactly four variables.
+        query = query or self.query
+        match = SELECT_QUADS.match(query)
+        if match is None:
+            return None
+        s, p, o, c = match.group("s", "p", "o", "c")
+        return f"{match.group('prologue')}CONSTRUCT {{GRAPH ?{c} {{?{s} ?{p} ?{o}}}}}{query[match.end():]}"
+
     def _cut_by_limit(self, input):
-        algebra:CompValue = prepareQuery(self.query).algebra
-        if "length" in algebra["p"]:
-            limit = int(algebra["p"]["length"])
+        limit = prepare_query(self.query).limit
+        if limit is not None:
             input = input[:limit]
         return input
 
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Any, BinaryIO, Dict, Iterator
+
+import codecs, json
+from rdflib import BNode, Literal, URIRef
+from rdflib.term import Node
+
+
+# The number of bytes read from the stream at a time
+CHUNK_SIZE = 65536
+WHITESPACE = " \t\n\r"
+
+
+class _JsonReader:
+    """
+    A reader of the JSON values of a stream of bytes, one value at a time.
+    Only the text not consumed yet is kept in memory, together with the last chunk read.
+    """
+    def __init__(self, stream:BinaryIO, chunk_size:int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.position = 0
+        self.eof = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+
+    def _read(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.text = self.text[self.position:] + self._decoder.decode(chunk, final=self.eof)
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.position < len(self.text) and self.text[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.text):
+                return self.text[self.position]
+            if not self._read():
+                raise ValueError("Unexpected end of the SPARQL results.")
+
+    def expect(self, char:str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Malformed SPARQL results: '{char}' expected at '{self.text[self.position:self.position+20]}'.")
+        self.position += 1
+
+    def skip(self, char:str) -> bool:
+        if self.peek() == char:
+            self.position += 1
+            return True
+        return False
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self.text, self.position)
+            except json.JSONDecodeError:
+                # The value is truncated at the end of the chunk, unless the stream is over
+                if not self._read():
+                    raise ValueError(f"Malformed SPARQL results at '{self.text[self.position:self.position+20]}'.")
+                continue
+            # A number or a literal name at the end of the chunk may continue in the next one
+            if end < len(self.text) or not self._read():
+                self.position = end
+                return value
+
+    def members(self) -> Iterator[str]:
+        self.expect("{")
+        if self.skip("}"):
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.skip("}"):
+                return
+            self.expect(",")
+
+    def items(self) -> Iterator[None]:
+        self.expect("[")
+        if self.skip("]"):
+            return
+        while True:
+            yield
+            if self.skip("]"):
+                return
+            self.expect(",")
+
+
+def iter_bindings(stream:BinaryIO, chunk_size:int=CHUNK_SIZE) -> Iterator[Dict[str, Dict[str, str]]]:
+    """
+    It parses SPARQL results in the JSON format (application/sparql-results+json) incrementally, 
+    yielding the bindings one at a time while the stream is read.
+    Unlike json.load, it never holds the whole document in memory: 
+    only the binding being parsed and the last chunk read are kept, whatever the number of results.
+    The members other than results.bindings, such as head, are skipped.
+
+    :param stream: A binary file object, such as an HTTP response.
+    :type stream: BinaryIO.
+    :param chunk_size: The number of bytes read from the stream at a time. The default is 65536.
+    :type chunk_size: int.
+    :returns: Iterator[Dict[str, Dict[str, str]]] -- The bindings, as in the JSON document: a dictionary of RDF terms by variable name, in which the unbound variables are missing.
+    :raises: ValueError if the document is not valid.
+    """
+    reader = _JsonReader(stream, chunk_size)
+    for key in reader.members():
+        if key != "results":
+            reader.value()
+            continue
+        for results_key in reader.members():
+            if results_key != "bindings":
+                reader.value()
+                continue
+            for _ in reader.items():
+                yield reader.value()
+
+
+def to_node(term:Dict[str, str]) -> Node:
+    """
+    It converts an RDF term of the SPARQL results in the JSON format into an rdflib term,
+    keeping the datatype and the language tag of the literals.
+
+    :param term: The RDF term, as in a binding, for example {"type": "literal", "value": "1", "datatype": "http://www.w3.org/2001/XMLSchema#integer"}.
+    :type term: Dict[str, str].
+    :returns: Node -- A URIRef, a Literal or a BNode.
+    :raises: ValueError if the type of the term is unknown.
+    """
+    term_type = term["type"]
+    if term_type == "uri":
+        return URIRef(term["value"])
+    if term_type in {"literal", "typed-literal"}:
+        datatype = term.get("datatype")
+        return Literal(term["value"], lang=term.get("xml:lang"), datatype=URIRef(datatype) if datatype else None)
+    if term_type == "bnode":
+        return BNode(term["value"])
+    raise ValueError(f"Unknown type of RDF term: {term_type}.")
@@ -17,12 +17,21 @@
 from pprint import pprint
 from typing import Dict, List
 
-import json, os, zipfile
+import json, os, re, zipfile
+from datetime import datetime, timedelta
+from functools import lru_cache
 from zipfile import ZipFile
+from dateutil import parser
 from rdflib.graph import ConjunctiveGraph
 from rdflib import URIRef, Literal
 
 
+MAX_CACHED_TIMES = 65536
+# The xsd:dateTime lexical form, also without time, seconds or timezone
+XSD_DATETIME_PATTERN = re.compile(r"(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?(?:Z|[+-]\d{2}(?::?\d{2})?)?")
+EPOCH = datetime(1970, 1, 1)
+
+
 class FileManager:
     """
     Convenient class for file management.
@@ -80,6 +89,50 @@ class FileManager:
         new_path = "{0}_min.json".format(path)
         open(new_path, "w+", encoding="utf-8").write(json_string) 
 
+def convert_to_datetime(time_string:str) -> datetime:
+    """
+    It converts a time string into a datetime without timezone, 
+    discarding the timezone rather than converting to UTC.
+    The xsd:dateTime form used by the provenance is parsed with a compiled pattern, 
+    any other form by dateutil. The last 65,536 strings converted are kept in memory, 
+    so that sorting the same snapshots again does not parse them again.
+
+    :param time_string: The time, for example "2021-06-01T18:46:41.000Z".
+    :type time_string: str.
+    :returns: datetime -- The time without timezone.
+    """
+    return _convert_to_datetime(str(time_string))
+
+@lru_cache(maxsize=MAX_CACHED_TIMES)
+def _convert_to_datetime(time_string:str) -> datetime:
+    match = XSD_DATETIME_PATTERN.fullmatch(time_string.strip())
+    if match:
+        year, month, day, hour, minute, second, fraction = match.groups()
+        try:
+            return datetime(
+                int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0), 
+                int((fraction or "")[:6].ljust(6, "0")))
+        except ValueError:
+            # Out-of-range values, such as 24:00:00, are left to dateutil
+            pass
+    return parser.parse(time_string).replace(tzinfo=None)
+
+def convert_to_timestamp(time_string:str) -> int:
+    """
+    It converts a time string into the number of microseconds elapsed since 1970-01-01T00:00:00, 
+    discarding the timezone as :func:`convert_to_datetime` does. 
+    The integer is meant to be used as a cheap key to sort and compare snapshots.
+
+    :param time_string: The time, for example "2021-06-01T18:46:41.000Z".
+    :type time_string: str.
+    :returns: int -- The microseconds since 1970-01-01T00:00:00.
+    """
+    return _convert_to_timestamp(str(time_string))
+
+@lru_cache(maxsize=MAX_CACHED_TIMES)
+def _convert_to_timestamp(time_string:str) -> int:
+    return (_convert_to_datetime(time_string) - EPOCH) // timedelta(microseconds=1)
+
 def _to_nt_sorted_list(cg:ConjunctiveGraph) -> list:
     if cg is None:
         return None
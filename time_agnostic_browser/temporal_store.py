@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from rdflib import plugin, ConjunctiveGraph, Graph, URIRef
+from rdflib.store import Store
+from rdflib.term import Node
+
+from time_agnostic_browser.entity_snapshots import Quad
+
+
+Interval = Tuple[int, Optional[int]]
+
+
+class TemporalIndex:
+    """
+    An index in which each quad is stored once, together with the intervals of time in which it is valid.
+    An interval is a pair [start, end), where start is the time of the snapshot that introduced the quad
+    and end the time of the snapshot that removed it, or None if the quad is still valid.
+    Times are integers, as returned by :func:`time_agnostic_browser.support.convert_to_timestamp`.
+    Contiguous intervals of the same quad are merged.
+    The quads can be looked up by pattern, either as of an instant or over an interval of time.
+    """
+    def __init__(self):
+        self._intervals:Dict[Quad, List[List[Optional[int]]]] = dict()
+        self._by_subject:Dict[Node, Set[Quad]] = dict()
+        self._by_predicate:Dict[Node, Set[Quad]] = dict()
+        self._by_object:Dict[Node, Set[Quad]] = dict()
+        self._by_context:Dict[Node, Set[Quad]] = dict()
+
+    def add(self, quad:Quad, start:int, end:Optional[int]=None) -> None:
+        """
+        It records that a quad is valid from start, included, to end, excluded.
+
+        :param quad: The quad, whose context is an identifier.
+        :type quad: Quad.
+        :param start: The time from which the quad is valid.
+        :type start: int.
+        :param end: The time from which the quad is no longer valid, or None if it is still valid. The default is None.
+        :type end: int.
+        """
+        if end is not None and end <= start:
+            raise ValueError("The end of an interval must follow its start.")
+        intervals = self._intervals.get(quad)
+        if intervals is None:
+            self._intervals[quad] = [[start, end]]
+            s, p, o, c = quad
+            self._by_subject.setdefault(s, set()).add(quad)
+            self._by_predicate.setdefault(p, set()).add(quad)
+            self._by_object.setdefault(o, set()).add(quad)
+            self._by_context.setdefault(c, set()).add(quad)
+            return
+        new_interval = [start, end]
+        merged_intervals = list()
+        for interval in intervals:
+            if _overlap_or_touch(interval, new_interval):
+                new_interval = [min(interval[0], new_interval[0]), _max_end(interval[1], new_interval[1])]
+            else:
+                merged_intervals.append(interval)
+        merged_intervals.append(new_interval)
+        self._intervals[quad] = merged_intervals
+
+    def get_intervals(self, quad:Quad) -> List[Interval]:
+        """
+        It returns the intervals in which a quad is valid, sorted by start.
+
+        :param quad: The quad, whose context is an identifier.
+        :type quad: Quad.
+        :returns: List[Interval] -- The intervals, as (start, end) pairs. An end of None means that the quad is still valid.
+        """
+        return sorted((interval[0], interval[1]) for interval in self._intervals.get(quad, []))
+
+    def quads(self, pattern:Tuple[Node, Node, Node, Node]=(None, None, None, None), start:Optional[int]=None, end:Optional[int]=None) -> Iterator[Quad]:
+        """
+        It yields the quads matching a pattern that are valid at some instant between start and end, both included.
+        To look up the quads as of an instant, pass the same value as start and end.
+        Without start and end, all the quads ever valid are returned.
+
+        :param pattern: A (subject, predicate, object, context) pattern, where None matches any term.
+        :type pattern: Tuple[Node, Node, Node, Node].
+        :param start: The beginning of the period of time. The default is None, that is, no lower bound.
+        :type start: int.
+        :param end: The end of the period of time. The default is None, that is, no upper bound.
+        :type end: int.
+        :returns: Iterator[Quad] -- The quads.
+        """
+        s, p, o, c = pattern
+        candidates = None
+        for term, index in ((s, self._by_subject), (p, self._by_predicate), (o, self._by_object), (c, self._by_context)):
+            if term is not None:
+                quads = index.get(term, set())
+                if candidates is None or len(quads) < len(candidates):
+                    candidates = quads
+        if candidates is None:
+            candidates = self._intervals.keys()
+        for quad in candidates:
+            if (s is None or quad[0] == s) and (p is None or quad[1] == p) and (o is None or quad[2] == o) and (c is None or quad[3] == c):
+                if any(_is_valid(interval, start, end) for interval in self._intervals[quad]):
+                    yield quad
+
+    def has_changes(self, pattern:Tuple[Node, Node, Node, Node], start:int, end:int) -> bool:
+        """
+        It tells whether any quad matching a pattern became valid or stopped being valid after start and not later than end,
+        that is, whether the quads matching the pattern as of start differ from the ones as of end.
+
+        :param pattern: A (subject, predicate, object, context) pattern, where None matches any term.
+        :type pattern: Tuple[Node, Node, Node, Node].
+        :param start: The first instant.
+        :type start: int.
+        :param end: The second instant, which follows the first.
+        :type end: int.
+        :returns: bool -- True if the quads matching the pattern changed, False otherwise.
+        """
+        for quad in self.quads(pattern, start, end):
+            for interval in self._intervals[quad]:
+                if start < interval[0] <= end or (interval[1] is not None and start < interval[1] <= end):
+                    return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+
+def _max_end(end_1:Optional[int], end_2:Optional[int]) -> Optional[int]:
+    if end_1 is None or end_2 is None:
+        return None
+    return max(end_1, end_2)
+
+def _overlap_or_touch(interval_1:List[Optional[int]], interval_2:List[Optional[int]]) -> bool:
+    return (interval_1[1] is None or interval_1[1] >= interval_2[0]) and (interval_2[1] is None or interval_2[1] >= interval_1[0])
+
+def _is_valid(interval:List[Optional[int]], start:Optional[int], end:Optional[int]) -> bool:
+    return (end is None or interval[0] <= end) and (start is None or interval[1] is None or interval[1] > start)
+
+
+class TemporalStore(Store):
+    """
+    A read-only rdflib store that shows the quads of a TemporalIndex valid as of an instant,
+    or at some instant of a period of time. It is a view: no quad is copied.
+    It is registered as the "Temporal" store plugin and it is meant to back a ConjunctiveGraph: ::
+
+        ConjunctiveGraph(store=TemporalStore(index, start=t, end=t))
+
+    :param index: The index of the quads.
+    :type index: TemporalIndex.
+    :param start: The beginning of the period of time, included. The default is None, that is, no lower bound.
+    :type start: int.
+    :param end: The end of the period of time, included. The default is None, that is, no upper bound.
+    :type end: int.
+    """
+    context_aware = True
+    formula_aware = False
+    graph_aware = False
+    transaction_aware = False
+
+    def __init__(self, index:TemporalIndex=None, start:Optional[int]=None, end:Optional[int]=None, configuration:str=None, identifier:Node=None):
+        super(TemporalStore, self).__init__(configuration, identifier)
+        self.index = index if index is not None else TemporalIndex()
+        self.start = start
+        self.end = end
+        self._namespaces:Dict[str, URIRef] = dict()
+        self._prefixes:Dict[URIRef, str] = dict()
+        self._context_graphs:Dict[Node, Graph] = dict()
+
+    def _get_context_graph(self, identifier:Node) -> Graph:
+        if identifier not in self._context_graphs:
+            self._context_graphs[identifier] = Graph(store=self, identifier=identifier)
+        return self._context_graphs[identifier]
+
+    def _visible_quads(self, triple_pattern:Tuple[Node, Node, Node], context:Graph=None) -> Iterator[Quad]:
+        s, p, o = triple_pattern
+        c = context.identifier if context is not None else None
+        return self.index.quads((s, p, o, c), self.start, self.end)
+
+    def add(self, triple, context, quoted=False):
+        raise TypeError("TemporalStore is read-only: add the quads to its TemporalIndex.")
+
+    def remove(self, triple_pattern, context=None):
+        raise TypeError("TemporalStore is read-only.")
+
+    def triples(self, triple_pattern, context=None):
+        triples_contexts:Dict[Tuple[Node, Node, Node], List[Graph]] = dict()
+        for s, p, o, c in self._visible_quads(triple_pattern, context):
+            triples_contexts.setdefault((s, p, o), list()).append(self._get_context_graph(c))
+        for triple, contexts in triples_contexts.items():
+            yield triple, iter(contexts)
+
+    def __len__(self, context=None):
+        if context is None:
+            return len({quad[:3] for quad in self._visible_quads((None, None, None))})
+        return sum(1 for _ in self._visible_quads((None, None, None), context))
+
+    def contexts(self, triple=None):
+        identifiers = {quad[3] for quad in self._visible_quads(triple or (None, None, None))}
+        for identifier in identifiers:
+            yield self._get_context_graph(identifier)
+
+    def bind(self, prefix, namespace, override=True):
+        if override or prefix not in self._namespaces:
+            self._namespaces[prefix] = URIRef(namespace)
+            self._prefixes[URIRef(namespace)] = prefix
+
+    def prefix(self, namespace):
+        return self._prefixes.get(URIRef(namespace))
+
+    def namespace(self, prefix):
+        return self._namespaces.get(prefix)
+
+    def namespaces(self):
+        for prefix, namespace in self._namespaces.items():
+            yield prefix, namespace
+
+
+def get_view(index:TemporalIndex, start:Optional[int]=None, end:Optional[int]=None) -> ConjunctiveGraph:
+    """
+    It returns a read-only ConjunctiveGraph showing the quads of an index
+    valid at some instant between start and end, both included.
+    Pass the same value as start and end to get the state as of an instant.
+
+    :param index: The index of the quads.
+    :type index: TemporalIndex.
+    :param start: The beginning of the period of time. The default is None, that is, no lower bound.
+    :type start: int.
+    :param end: The end of the period of time. The default is None, that is, no upper bound.
+    :type end: int.
+    :returns: ConjunctiveGraph -- The view.
+    """
+    return ConjunctiveGraph(store=TemporalStore(index, start, end))
+
+
+plugin.register("Temporal", Store, "time_agnostic_browser.temporal_store", "TemporalStore")
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021, Arcangelo Massari <arcangelomas@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+import re
+from rdflib import ConjunctiveGraph, Literal, URIRef, BNode
+from rdflib.namespace import RDF, XSD
+from rdflib.term import Node
+
+from time_agnostic_browser.entity_snapshots import Quad
+
+
+_TOKENS = re.compile(r"""
+    (?P<skip>\s+|\#[^\n]*)
+    |<(?P<iri>[^<>"{}|^`\\\x00-\x20]*)>
+    |"{3}(?P<long_string_2>(?:[^"\\]|\\.|"(?!""))*)"{3}
+    |'{3}(?P<long_string_1>(?:[^'\\]|\\.|'(?!''))*)'{3}
+    |"(?P<string_2>(?:[^"\\\n\r]|\\.)*)"
+    |'(?P<string_1>(?:[^'\\\n\r]|\\.)*)'
+    |@(?P<lang>[a-zA-Z]+(?:-[a-zA-Z0-9]+)*)
+    |(?P<datatype>\^\^)
+    |_:(?P<bnode>[\w\-.]*[\w\-])
+    |(?P<number>[+-]?(?:\d+\.\d+|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+    |(?P<pname>(?:[A-Za-z][\w\-.]*)?:(?:[\w\-:%]+(?:\.+[\w\-:%]+)*)?)
+    |(?P<keyword>[A-Za-z]+)
+    |(?P<punctuation>[{}.;,])
+""", re.VERBOSE)
+
+_ESCAPES = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))", re.DOTALL)
+_ESCAPED_CHARACTERS = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+
+def _unescape(string:str) -> str:
+    def replace(match:re.Match) -> str:
+        if match.group(3) is None:
+            return chr(int(match.group(1) or match.group(2), 16))
+        if match.group(3) not in _ESCAPED_CHARACTERS:
+            raise ValueError(f"Invalid escape sequence in the update query: \\{match.group(3)}")
+        return _ESCAPED_CHARACTERS[match.group(3)]
+    return _ESCAPES.sub(replace, string) if "\\" in string else string
+
+
+class _Tokens:
+    def __init__(self, update_query:str):
+        self._update_query = update_query
+        self._position = 0
+        self._peeked:Optional[Tuple[str, str]] = None
+
+    def _read(self) -> Optional[Tuple[str, str]]:
+        while self._position < len(self._update_query):
+            match = _TOKENS.match(self._update_query, self._position)
+            if match is None:
+                raise ValueError(f"Unexpected character in the update query at position {self._position}.")
+            self._position = match.end()
+            kind = match.lastgroup
+            if kind != "skip":
+                return kind, match.group(kind)
+        return None
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        if self._peeked is None:
+            self._peeked = self._read()
+        return self._peeked
+
+    def next(self) -> Tuple[str, str]:
+        token = self.peek()
+        self._peeked = None
+        if token is None:
+            raise ValueError("Unexpected end of the update query.")
+        return token
+
+    def peek_is(self, value:str) -> bool:
+        token = self.peek()
+        return token is not None and token[0] in {"punctuation", "keyword"} and token[1].upper() == value
+
+    def expect(self, value:str) -> None:
+        kind, token = self.next()
+        if kind not in {"punctuation", "keyword"} or token.upper() != value:
+            raise ValueError(f"Expected '{value}' in the update query, found '{token}'.")
+
+
+class _UpdateQueryParser:
+    def __init__(self, update_query:str):
+        self.tokens = _Tokens(update_query)
+        self.prefixes:Dict[str, str] = dict()
+
+    def parse(self) -> Iterator[Tuple[str, Quad]]:
+        while self.tokens.peek() is not None:
+            kind, token = self.tokens.next()
+            keyword = token.upper() if kind == "keyword" else None
+            if kind == "punctuation" and token == ";":
+                continue
+            elif keyword == "PREFIX":
+                kind, prefix = self.tokens.next()
+                if kind != "pname" or not prefix.endswith(":"):
+                    raise ValueError(f"Invalid prefix in the update query: '{prefix}'.")
+                self.prefixes[prefix[:-1]] = self._iri(*self.tokens.next())
+            elif keyword in {"INSERT", "DELETE"}:
+                self.tokens.expect("DATA")
+                self.tokens.expect("{")
+                yield from self._quads(keyword)
+            else:
+                raise ValueError(f"Only INSERT DATA and DELETE DATA operations are supported, found '{token}'.")
+
+    def _quads(self, operation:str) -> Iterator[Tuple[str, Quad]]:
+        while not self.tokens.peek_is("}"):
+            if self.tokens.peek_is("GRAPH"):
+                self.tokens.next()
+                graph = self._iri(*self.tokens.next())
+                self.tokens.expect("{")
+                yield from self._triples(operation, graph)
+                self.tokens.expect("}")
+            else:
+                yield from self._triples(operation, None)
+            if self.tokens.peek_is("."):
+                self.tokens.next()
+        self.tokens.expect("}")
+
+    def _triples(self, operation:str, graph:Optional[URIRef]) -> Iterator[Tuple[str, Quad]]:
+        while not self.tokens.peek_is("}") and not self.tokens.peek_is("GRAPH"):
+            subject = self._term(*self.tokens.next())
+            while True:
+                predicate = self._predicate(*self.tokens.next())
+                while True:
+                    yield operation, (subject, predicate, self._term(*self.tokens.next()), graph)
+                    if not self.tokens.peek_is(","):
+                        break
+                    self.tokens.next()
+                if not self.tokens.peek_is(";"):
+                    break
+                while self.tokens.peek_is(";"):
+                    self.tokens.next()
+                if self.tokens.peek_is(".") or self.tokens.peek_is("}"):
+                    break
+            if not self.tokens.peek_is("."):
+                break
+            self.tokens.next()
+
+    def _iri(self, kind:str, token:str) -> URIRef:
+        if kind == "iri":
+            return URIRef(_unescape(token))
+        if kind == "pname":
+            prefix, _, local_name = token.partition(":")
+            if prefix not in self.prefixes:
+                raise ValueError(f"Undefined prefix in the update query: '{prefix}'.")
+            return URIRef(self.prefixes[prefix] + re.sub(r"\\(.)", r"\1", local_name))
+        raise ValueError(f"Expected an IRI in the update query, found '{token}'.")
+
+    def _predicate(self, kind:str, token:str) -> URIRef:
+        if kind == "keyword" and token == "a":
+            return RDF.type
+        return self._iri(kind, token)
+
+    def _term(self, kind:str, token:str) -> Node:
+        if kind in {"iri", "pname"}:
+            return self._iri(kind, token)
+        if kind == "bnode":
+            return BNode(token)
+        if kind in {"long_string_2", "long_string_1", "string_2", "string_1"}:
+            value = _unescape(token)
+            next_token = self.tokens.peek()
+            if next_token is not None and next_token[0] == "lang":
+                self.tokens.next()
+                return Literal(value, lang=next_token[1])
+            if next_token is not None and next_token[0] == "datatype":
+                self.tokens.next()
+                return Literal(value, datatype=self._iri(*self.tokens.next()))
+            return Literal(value)
+        if kind == "number":
+            if "e" in token or "E" in token:
+                return Literal(token, datatype=XSD.double)
+            if "." in token:
+                return Literal(token, datatype=XSD.decimal)
+            return Literal(token, datatype=XSD.integer)
+        if kind == "keyword" and token in {"true", "false"}:
+            return Literal(token, datatype=XSD.boolean)
+        raise ValueError(f"Unexpected term in the update query: '{token}'.")
+
+
+def parse_update_query(update_query:str) -> Iterator[Tuple[str, Quad]]:
+    """
+    It parses an update query made of INSERT DATA and DELETE DATA operations,
+    as the ones recorded by the oco:hasUpdateQuery property of the snapshots,
+    and it yields its quads one at a time, in the order in which they appear,
+    without building the whole query in memory.
+    The triples outside a GRAPH block have None as context.
+
+    :param update_query: The update query.
+    :type update_query: str.
+    :returns: Iterator[Tuple[str, Quad]] -- The operation, either "INSERT" or "DELETE", and the quad it applies to.
+    :raises: ValueError if the query contains anything other than INSERT DATA and DELETE DATA operations.
+    """
+    return _UpdateQueryParser(update_query).parse()
+
+def invert_update_query(graph:ConjunctiveGraph, update_query:str) -> Tuple[Set[Quad], Set[Quad]]:
+    """
+    It undoes an update query on a graph, in place:
+    the inserted quads are removed and the deleted ones are added back,
+    in the reverse order in which the query applies them, so that a quad deleted and then inserted again 
+    by the same query is present after the undo, as it was before the query.
+    The query is parsed before the graph is changed: if it cannot be parsed, the graph is left as it was and the error is raised.
+
+    :param graph: The graph on which the query is undone.
+    :type graph: ConjunctiveGraph.
+    :param update_query: The update query, made of INSERT DATA and DELETE DATA operations.
+    :type update_query: str.
+    :returns: Tuple[Set[Quad], Set[Quad]] -- The quads added to the graph and the quads removed from it. The contexts are given as identifiers.
+    :raises: ValueError if the query contains anything other than INSERT DATA and DELETE DATA operations.
+    """
+    default_context = graph.default_context.identifier
+    operations = list(parse_update_query(update_query))
+    added:Set[Quad] = set()
+    removed:Set[Quad] = set()
+    for operation, (s, p, o, c) in reversed(operations):
+        quad = (s, p, o, default_context if c is None else c)
+        if operation == "DELETE":
+            if quad not in graph:
+                graph.add(quad)
+                if quad in removed:
+                    removed.discard(quad)
+                else:
+                    added.add(quad)
+        elif quad in graph:
+            graph.remove(quad)
+            if quad in added:
+                added.discard(quad)
+            else:
+                removed.add(quad)
+    return added, removed
+
+def apply_update_query(quads:Set[Quad], update_query:str) -> Tuple[Set[Quad], Set[Quad]]:
+    """
+    It applies an update query to a set of quads, in place and in one pass, 
+    that is, it replays the change recorded by a snapshot on the state that precedes it.
+    It is the opposite of :func:`invert_update_query`.
+    If the query cannot be applied, the quads are restored as they were and the error is raised again.
+
+    :param quads: The quads on which the query is applied. The contexts are given as identifiers.
+    :type quads: Set[Quad].
+    :param update_query: The update query, made of INSERT DATA and DELETE DATA operations.
+    :type update_query: str.
+    :returns: Tuple[Set[Quad], Set[Quad]] -- The quads added and the quads removed.
+    :raises: ValueError if the query contains anything other than INSERT DATA and DELETE DATA operations, or triples outside a GRAPH block, whose context is unknown.
+    """
+    added:Set[Quad] = set()
+    removed:Set[Quad] = set()
+    try:
+        for operation, quad in parse_update_query(update_query):
+            if quad[3] is None:
+                raise ValueError("Only the triples inside a GRAPH block can be applied to a set of quads.")
+            if operation == "INSERT":
+                if quad not in quads:
+                    quads.add(quad)
+                    if quad in removed:
+                        removed.discard(quad)
+                    else:
+                        added.add(quad)
+            elif quad in quads:
+                quads.discard(quad)
+                if quad in added:
+                    added.discard(quad)
+                else:
+                    removed.add(quad)
+    except ValueError:
+        quads.difference_update(added)
+        quads.update(removed)
+        raise
+    return added, removed